@@ -35,6 +35,56 @@ def gen_velo_from_files2(mat_file, var_names=('x','y')):
         waveform2=pw.Waveform(mat_file, var_name=var_names[1])
     )
 
+class SinglePulseSweep(object):
+    """
+    Generates the single pulse waveforms for every point of an amplitude and
+    phase sweep at once. The carrier is evaluated once, and all of the
+    amplitude and phase variants are made by a single broadcast operation,
+    giving arrays of shape (points, samples), where the points run over
+    pulse_amps for each of pulse_phasedegs in turn.
+    """
+
+    def __init__(self,
+            pulse_width=100,
+            pulse_amps=(1,),
+            pulse_phasedegs=(0,),
+            phase_shift_degree=0,
+            num_avgs=1
+        ):
+
+        f = 200*10**6 # 200MHz carrier
+        w = f*2*np.pi
+        t_step = 10**-9 # 1ns timestep (1GSPs DAC rate)
+
+        ts_pulse1 = np.arange(0,pulse_width)
+        carrier = w * ts_pulse1 * t_step
+
+        amps = np.tile(np.asarray(pulse_amps, dtype=float), len(pulse_phasedegs))
+        phasedegs = np.repeat(np.asarray(pulse_phasedegs, dtype=float), len(pulse_amps))
+        phases = phasedegs * (np.pi / 180)
+        self.points = zip(amps, phasedegs)
+
+        ysI_pulse = amps[:, np.newaxis] * np.sin(carrier + phases[:, np.newaxis])
+        ysQ_pulse = amps[:, np.newaxis] * np.cos(carrier + (phases[:, np.newaxis] + (phase_shift_degree*(np.pi/180))))
+
+        self.ysI = np.tile(ysI_pulse, (1, num_avgs))
+        self.ysQ = np.tile(ysQ_pulse, (1, num_avgs))
+
+        self.scaled_ysI = ((2**15 - 1) * self.ysI).astype('<i2')
+        self.scaled_ysQ = ((2**15 - 1) * (self.ysQ+10)).astype('<i2')
+
+    def __len__(self):
+        return len(self.points)
+
+    def write_velo(self, idx, output_file='single_pulse.velo'):
+        pw.waveform_to_velo([True,False,True,False],
+                            output_file,
+                            waveform0=pw.Waveform(self.scaled_ysI[idx]),
+                            waveform2=pw.Waveform(self.scaled_ysQ[idx])
+                            )
+
+        return self.ysI[idx], self.ysQ[idx]
+
 def gen_velo_single_pulse(
         pulse_width=100,
         pulse_phasedeg=0,
@@ -43,46 +93,7 @@ def gen_velo_single_pulse(
         num_avgs=1
     ):
 
-    f = 200*10**6 # 200MHz carrier
-    #f = 50*10**6
-    w = f*2*np.pi
-    f1 = 50*10**6 # 50 MHz
-    w1 = f1*2*np.pi
-    t_step = 10**-9 # 1ns timestep (1GSPs DAC rate)
-    t_step2 = 10**-6
-
     output_file = 'single_pulse.velo'
 
-    ts_pulse1 = np.arange(0,pulse_width)
-
-  ##  ysI_pulse = pulse_amp*np.sin((w * ts_pulse1 * t_step) + (pulse_phasedeg * (np.pi / 180)))
- ##   ysQ_pulse = pulse_amp*np.cos((w * ts_pulse1 * t_step) + (pulse_phasedeg * (np.pi / 180)+(45*(np.pi/180))))
-  ##  ysQ_pulse = pulse_amp*np.cos((w * ts_pulse1 * t_step) + (pulse_phasedeg * (np.pi / 180)+(phase_shift_degree*(np.pi/180))))
-    a = np.random.rand()
-    b = np.random.rand()
-
-    ysI_pulse = pulse_amp*np.sin((w * ts_pulse1 * t_step) + (pulse_phasedeg * (np.pi / 180)))
-    ysQ_pulse = pulse_amp*np.cos((w * ts_pulse1 * t_step) + (pulse_phasedeg * (np.pi / 180)+(phase_shift_degree*(np.pi/180))))
-    #ysI_pulse = pulse_amp*np.sin((w * ts_pulse1 * t_step) + (pulse_phasedeg * (np.pi / 180))) + pulse_amp*np.sin(w1*ts_pulse1*t_step)
-    #ysQ_pulse = pulse_amp*np.cos((w * ts_pulse1 * t_step) + (pulse_phasedeg * (np.pi / 180)+(phase_shift_degree*(np.pi/180))))+ pulse_amp*np.sin(w1*ts_pulse1*t_step)
-
-
-    ysI = ysI_pulse
-    ysQ = ysQ_pulse
-
-    for idx in xrange(num_avgs-1):
-        ysI = np.append(ysI, ysI_pulse)
-        ysQ = np.append(ysQ, ysQ_pulse)
-
-    scaled_ysI = (2**15 - 1) * ysI
-    scaled_ysQ = (2**15 - 1) * (ysQ+10)
-    scaled_ysI.astype('<i2')
-    scaled_ysQ.astype('<i2')
-
-    pw.waveform_to_velo([True,False,True,False],
-                        output_file,
-                        waveform0=pw.Waveform(scaled_ysI),
-                        waveform2=pw.Waveform(scaled_ysQ)
-                        )
-
-    return ysI, ysQ
+    sweep = SinglePulseSweep(pulse_width, [pulse_amp], [pulse_phasedeg], phase_shift_degree, num_avgs)
+    return sweep.write_velo(0, output_file)
@@ -63,6 +63,9 @@ def run_expt(pulse_amps,
     # Loop over set of pulse times
     for idx in xrange(pulse_times.shape[0]):
 
+        # Generate the pulse waveforms for every amplitude at once
+        sweep = gw.SinglePulseSweep(pulse_times[idx], pulse_amps, [0], phase_shift_degree, num_avgs)
+
         # Loop over set of pulse amplitudes
         for idy in xrange(pulse_amps.shape[0]):
 
@@ -76,8 +79,8 @@ def run_expt(pulse_amps,
             #gen_transmitter_pattern_nodigital(pulse_times[idx],dead_time)
             gen_receiver_pattern(receiver_delay,acq_time)
 
-            # Generate pulse waveform
-            gw.gen_velo_single_pulse(pulse_times[idx],0,phase_shift_degree,pulse_amps[idy],num_avgs)
+            # Write out the pulse waveform for this amplitude
+            sweep.write_velo(idy)
 
             #gw.gen_velo_from_files('rand_data_1.mat', 'rand_data_1.mat', var_name='r')
             #gw.gen_velo_from_files('rand_data_1_10.mat', 'rand_data_1_10.mat', var_name='r')
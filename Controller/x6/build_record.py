@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# build_record.py: Records what a compiled output directory was built from,
+#     so that recompiling it need only rebuild the outputs that changed.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from x6 import waveform_library as wl
+from x6.parse_cache import PARSER_VERSION
+from x6.process_waveform import Waveform, IQWaveform, NP_ARRAY
+from x6.xpp_types import Time, Identifier, IQChannel
+import x6.timeline as tl
+
+## CONSTANTS ###################################################################
+
+#: Name of the file in which an output directory's record is kept.
+BUILD_RECORD_FILENAME = '.build_record.json'
+
+#: Bump whenever the format of build records, or the way that artifact
+#: digests are computed, changes.
+BUILD_RECORD_VERSION = 1
+
+## FUNCTIONS ###################################################################
+
+def _sha1(*chunks):
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def file_fingerprint(filename):
+    """
+    Returns the modification time, size and SHA-1 digest of a file, or
+    `None` if the file cannot be read.
+    """
+    try:
+        stat = os.stat(filename)
+        with open(filename, 'rb') as f:
+            contents = f.read()
+    except (IOError, OSError):
+        return None
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': _sha1(contents)}
+
+def value_fingerprint(value):
+    """
+    Returns a digest of a namespace value, or `None` if the value cannot be
+    fingerprinted, in which case it is taken to change on every compile.
+    """
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        return _sha1(repr((array.dtype.str, array.shape)), array.tostring())
+    elif isinstance(value, Time):
+        return _sha1('time', repr(value._time))
+    elif isinstance(value, (Waveform, IQWaveform)):
+        return waveform_fingerprint(value)
+    elif isinstance(value, (bool, int, long, float, basestring)) or value is None:
+        return _sha1(type(value).__name__, repr(value))
+    text = repr(value)
+    if ' at 0x' in text:
+        # The default repr identifies an object, not its value.
+        return None
+    return _sha1(type(value).__name__, text)
+
+def waveform_fingerprint(waveform):
+    """
+    Returns a digest of the samples of a waveform, or `None` if the samples
+    cannot be read without disturbing the waveform.
+    """
+    if isinstance(waveform, IQWaveform):
+        parts = [waveform_fingerprint(waveform.waveform_i), waveform_fingerprint(waveform.waveform_q)]
+        return None if None in parts else _sha1('iq', *parts)
+    elif not isinstance(waveform, Waveform):
+        # Digital pulses are played with a boolean in place of a waveform.
+        return _sha1(type(waveform).__name__, repr(waveform))
+    elif waveform._waveform_type == NP_ARRAY:
+        return _sha1(np.ascontiguousarray(waveform._data_handle).tostring())
+    elif waveform._from is not None:
+        fingerprint = file_fingerprint(waveform._from)
+        return fingerprint['sha1'] if fingerprint is not None else None
+    return None
+
+def waveform_files(timeline):
+    """
+    Returns the files from which the waveforms played in a timeline were
+    loaded.
+    """
+    files = set()
+    for waveform in timeline.waveforms:
+        parts = [waveform.waveform_i, waveform.waveform_q] if isinstance(waveform, IQWaveform) else [waveform]
+        for part in parts:
+            source = getattr(part, '_from', None)
+            if source is None:
+                continue
+            reference = wl.split_reference(source)
+            files.add(os.path.abspath(reference[0] if reference is not None else source))
+    return sorted(files)
+
+def fingerprint_inputs(source, parser, peripheral_id, namespace):
+    """
+    Returns the fingerprints of the inputs given to the compiler, as kept
+    in a `~x6.build_record.BuildRecord`.
+
+    :param dict namespace: Namespace as returned by
+        `~x6.pulprog.mk_namespace_dict`.
+    """
+    return {
+        'version': BUILD_RECORD_VERSION,
+        'parser_version': PARSER_VERSION,
+        'source': _sha1(source),
+        'parser': parser,
+        'peripheral_id': peripheral_id,
+        'namespace': {
+            key.name if isinstance(key, Identifier) else str(key): value_fingerprint(value)
+            for key, value in namespace.iteritems()
+        }
+    }
+
+def _channel_set_key(channels):
+    return [
+        (tl.channel_pins(ch), ch.analog, ch.is_rx, isinstance(ch, IQChannel))
+        for ch in channels
+    ]
+
+def waveform_digest(timeline, peripheral_id):
+    """
+    Returns a digest of everything that the Velo file written by
+    `~x6.pulprog.WaveformBuilderVisitor` depends on, or `None` if some
+    waveform cannot be fingerprinted.
+
+    The samples of TX pulses are written one after another, so the Velo
+    file depends on the order, lengths, channels, waveforms and phases of
+    those pulses, but not on when they start. Changing only delays thus
+    leaves the Velo file as it was.
+    """
+    fingerprints = [waveform_fingerprint(waveform) for waveform in timeline.waveforms]
+    if None in fingerprints:
+        return None
+    entries = timeline.entries[timeline.pri_codes(rx=False) >= 0]
+    return _sha1(
+        repr((BUILD_RECORD_VERSION, peripheral_id, list(timeline.active_channels or ()))),
+        repr([_channel_set_key(channels) for channels in timeline.channel_sets]),
+        repr(timeline.phases),
+        repr(fingerprints),
+        *[np.ascontiguousarray(entries[column]).tostring() for column in ('n_samp', 'channels', 'waveform', 'phase')]
+    )
+
+def patterns_digest(timeline):
+    """
+    Returns a digest of everything that the PRI patterns written by
+    `~x6.pulprog.PRIPatternVisitor`, and the options that it declares,
+    depend on.
+    """
+    explicit = sorted(set(
+        name for _, name, _ in timeline.options if name in ('rx_enable_pri', 'tx_enable_pri')
+    ))
+    return _sha1(
+        repr((BUILD_RECORD_VERSION, explicit)),
+        timeline.pri_entries(rx=True).tostring(),
+        timeline.pri_entries(rx=False).tostring()
+    )
+
+## CLASSES #####################################################################
+
+class BuildRecord(object):
+    """
+    Describes what the outputs in a directory were compiled from: the
+    source, parser and namespace, the files that the program read, and a
+    digest of the compiled pulses that each artifact depends on. See
+    `~x6.pulprog.compile_incremental`.
+
+    An artifact is a group of output files written by one visitor, such as
+    ``rx.pattern`` and ``tx.pattern``, along with the final options that
+    the visitor declared.
+
+    :param dict inputs: As returned by `~x6.build_record.fingerprint_inputs`.
+    :param list files: Paths of the include and waveform files read.
+    """
+
+    def __init__(self, inputs, files=(), artifacts=None):
+        self.inputs = inputs
+        self.files = {filename: file_fingerprint(filename) for filename in files}
+        self.artifacts = dict(artifacts or {})
+
+    ## FRESHNESS ##
+
+    def _file_is_fresh(self, filename, fingerprint):
+        if fingerprint is None:
+            return False
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if stat.st_mtime == fingerprint['mtime'] and stat.st_size == fingerprint['size']:
+            return True
+        # A file may have been touched or rewritten without changing.
+        current = file_fingerprint(filename)
+        return current is not None and current['sha1'] == fingerprint['sha1']
+
+    def is_up_to_date(self, inputs, dirname):
+        """
+        Returns `True` if compiling with the given inputs would reproduce
+        the outputs in ``dirname`` without any change.
+        """
+        if inputs != self.inputs or None in inputs['namespace'].values():
+            return False
+        if not all(self._file_is_fresh(filename, fingerprint) for filename, fingerprint in self.files.iteritems()):
+            return False
+        # The same inputs compile to the same pulses, so it only remains to
+        # check that the outputs are all still there.
+        return all(
+            os.path.isfile(os.path.join(dirname, filename))
+            for artifact in self.artifacts.itervalues() for filename in artifact['files']
+        )
+
+    def artifact_is_fresh(self, name, digest, dirname):
+        """
+        Returns `True` if the artifact ``name`` in ``dirname`` was built
+        from pulses with the given digest, and all of its files still exist.
+        """
+        artifact = self.artifacts.get(name)
+        if digest is None or artifact is None or artifact['digest'] != digest:
+            return False
+        return all(os.path.isfile(os.path.join(dirname, filename)) for filename in artifact['files'])
+
+    ## ARTIFACTS ##
+
+    def add_artifact(self, name, digest, files, options):
+        self.artifacts[name] = {'digest': digest, 'files': sorted(files), 'options': dict(options)}
+
+    def artifact_options(self, name):
+        return dict(self.artifacts[name]['options'])
+
+    ## SERIALIZATION ##
+
+    def to_dict(self):
+        return {'inputs': self.inputs, 'files': self.files, 'artifacts': self.artifacts}
+
+    def save(self, dirname):
+        with open(os.path.join(dirname, BUILD_RECORD_FILENAME), 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, sort_keys=True)
+
+    @classmethod
+    def load(cls, dirname):
+        """
+        Returns the record kept in ``dirname``, or `None` if there is no
+        usable record.
+        """
+        try:
+            with open(os.path.join(dirname, BUILD_RECORD_FILENAME), 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if data.get('inputs', {}).get('version') != BUILD_RECORD_VERSION:
+            return None
+        record = cls(_to_str(data['inputs']), artifacts=_to_str(data['artifacts']))
+        record.files = _to_str(data['files'])
+        return record
+
+def _to_str(value):
+    # JSON gives back unicode strings, while fingerprint_inputs gives str.
+    if isinstance(value, dict):
+        return {_to_str(key): _to_str(item) for key, item in value.iteritems()}
+    elif isinstance(value, list):
+        return [_to_str(item) for item in value]
+    elif isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            return value
+    return value
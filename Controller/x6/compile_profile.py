@@ -0,0 +1,247 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# compile_profile.py: Timing and call counts collected while compiling
+#     xpulprog programs.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+## CONSTANTS ###################################################################
+
+# Name used for the main program in per-line timings when the compiler is
+# not told which file it came from.
+UNNAMED_SOURCE = '<source>'
+
+## CLASSES #####################################################################
+
+class _Counter(object):
+    __slots__ = ('calls', 'seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+
+    def to_dict(self):
+        return {'calls': self.calls, 'seconds': self.seconds}
+
+class CompileProfile(object):
+    """
+    Wall time and call counts recorded while compiling a program with
+    ``profile=True``; see `~x6.pulprog.compile_program`.
+
+    Times are inclusive, so that the time of a ``repeat_statement``
+    includes that of the statements in its block, and the time of a
+    statement includes the visitor calls that it makes.
+
+    Timings are grouped by:
+
+    - ``statements``: statement type;
+    - ``lines``: ``(file, line)`` of each statement;
+    - ``visitors``: visitor class and method;
+    - ``sections``: named steps, such as parsing, waveform writes and
+      Velo encoding.
+
+    ``files`` records the number of bytes in each output file.
+    """
+
+    def __init__(self):
+        self.statements = {}
+        self.lines = {}
+        self.visitors = {}
+        self.sections = {}
+        self.files = {}
+        self.total_seconds = 0.0
+        self._source_stack = [UNNAMED_SOURCE]
+        # Visitors may run their post compilation steps in parallel threads;
+        # see x6.pulprog.MultiVisitor.
+        self._lock = threading.Lock()
+
+    def _add(self, table, key, seconds):
+        with self._lock:
+            counter = table.get(key)
+            if counter is None:
+                counter = table[key] = _Counter()
+            counter.add(seconds)
+
+    ## RECORDING ##
+
+    @property
+    def current_source(self):
+        return self._source_stack[-1]
+
+    @contextmanager
+    def source(self, filename):
+        """
+        Attributes the statements run within this context to ``filename``.
+        """
+        self._source_stack.append(filename)
+        try:
+            yield
+        finally:
+            self._source_stack.pop()
+
+    def add_statement(self, stmt_type, lineno, seconds):
+        self._add(self.statements, stmt_type, seconds)
+        self._add(self.lines, (self.current_source, lineno), seconds)
+
+    def add_visitor_call(self, name, seconds):
+        self._add(self.visitors, name, seconds)
+
+    def add_section(self, name, seconds):
+        self._add(self.sections, name, seconds)
+
+    @contextmanager
+    def section(self, name):
+        """
+        Times the body of a ``with`` block as the named section.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_section(name, time.time() - start)
+
+    def add_output_files(self, dirname):
+        """
+        Records the size of each file in an output directory.
+        """
+        for filename in sorted(os.listdir(dirname)):
+            path = os.path.join(dirname, filename)
+            if os.path.isfile(path):
+                self.files[filename] = os.path.getsize(path)
+
+    ## REPORTING ##
+
+    def to_dict(self):
+        def table(counters, key_fn=str):
+            return [
+                dict(name=key_fn(key), **counter.to_dict())
+                for key, counter in sorted(counters.items(), key=lambda item: -item[1].seconds)
+            ]
+        return {
+            'total_seconds': self.total_seconds,
+            'statements': table(self.statements),
+            'lines': table(self.lines, lambda key: "{}:{}".format(*key)),
+            'visitors': table(self.visitors),
+            'sections': table(self.sections),
+            'files': self.files,
+        }
+
+    def to_json(self, filename=None, **kwargs):
+        """
+        Returns this profile as a JSON string, also writing it to
+        ``filename`` if given.
+        """
+        kwargs.setdefault('indent', 4)
+        data = json.dumps(self.to_dict(), **kwargs)
+        if filename is not None:
+            with open(filename, 'w') as f:
+                f.write(data)
+        return data
+
+    def report(self, max_rows=15):
+        """
+        Returns a printable summary of this profile, listing at most
+        ``max_rows`` of the slowest entries of each table.
+        """
+        data = self.to_dict()
+        lines = ["Compilation took {:.4f} s.".format(self.total_seconds)]
+        for title in ('sections', 'statements', 'lines', 'visitors'):
+            rows = data[title]
+            if not rows:
+                continue
+            lines.append("")
+            lines.append("{:<48} {:>10} {:>12}".format(title.capitalize(), "calls", "seconds"))
+            for row in rows[:max_rows]:
+                lines.append("{:<48} {:>10} {:>12.6f}".format(row['name'], row['calls'], row['seconds']))
+            if len(rows) > max_rows:
+                lines.append("... {} more".format(len(rows) - max_rows))
+        if self.files:
+            lines.append("")
+            lines.append("{:<48} {:>23}".format("Files", "bytes"))
+            for filename, size in sorted(self.files.items()):
+                lines.append("{:<48} {:>23}".format(filename, size))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.report()
+
+class ProfiledVisitor(object):
+    """
+    Wraps a visitor so that each call to one of its methods is recorded in
+    a `~x6.compile_profile.CompileProfile`.
+    """
+    METHODS = (
+        'visit_pulseexpr', 'visit_pulses', 'visit_advance', 'visit_option', 'visit_repeat', 'visit_timeline',
+        'declare_final_options', 'post_compilation'
+    )
+
+    def __init__(self, visitor, profile):
+        self._visitor = visitor
+        self._profile = profile
+        prefix = type(visitor).__name__
+        for method in self.METHODS:
+            if hasattr(visitor, method):
+                setattr(self, method, self._wrap(getattr(visitor, method), "{}.{}".format(prefix, method)))
+
+    def _wrap(self, method, name):
+        # Visitors record sections of their own work with
+        # x6.compile_profile.section, so the profile is made active for the
+        # duration of each call.
+        profile = self._profile
+        def timed(*args):
+            start = time.time()
+            try:
+                with activate(profile):
+                    return method(*args)
+            finally:
+                profile.add_visitor_call(name, time.time() - start)
+        return timed
+
+    def __getattr__(self, name):
+        return getattr(self._visitor, name)
+
+## FUNCTIONS ###################################################################
+
+_active = threading.local()
+
+@contextmanager
+def activate(profile):
+    """
+    Makes ``profile`` the profile that `~x6.compile_profile.section`
+    records to within this thread, for the duration of a ``with`` block.
+    """
+    previous = getattr(_active, 'profile', None)
+    _active.profile = profile
+    try:
+        yield profile
+    finally:
+        _active.profile = previous
+
+@contextmanager
+def section(name):
+    """
+    Times the body of a ``with`` block as the named section of the active
+    profile, if there is one.
+    """
+    profile = getattr(_active, 'profile', None)
+    if profile is None:
+        yield
+    else:
+        with profile.section(name):
+            yield
@@ -0,0 +1,535 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# compile_server.py: Long-lived local server that compiles XPP programs in
+#     a pool of warm worker processes, for scripts and consoles that would
+#     otherwise pay for importing the compiler and filling its caches on
+#     every compilation.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import sys
+import errno
+import socket
+import binascii
+import tempfile
+import threading
+import traceback
+import multiprocessing
+import Queue
+
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+## CONSTANTS ###################################################################
+
+#: Environment variable from which the key that clients must present to
+#: the server is taken, if none is given explicitly. If it is not set
+#: either, the key is read from `~x6.compile_server.authkey_file`.
+AUTHKEY_ENV_VAR = 'X6_COMPILE_SERVER_AUTHKEY'
+
+#: Number of random bytes in a generated key.
+AUTHKEY_BYTES = 32
+
+#: Kinds of compile job that a server accepts, and the function of
+#: `x6.pulprog` that runs each.
+JOB_KINDS = {
+    'incremental': 'compile_incremental',
+    'directory': 'compile_to_directory',
+    'boards': 'compile_to_boards'
+}
+
+## EXCEPTIONS ##################################################################
+
+class CompileError(RuntimeError):
+    """
+    Raised by `~x6.compile_server.CompileClient` when a job fails on the
+    server. The traceback from the worker process that ran the job is kept
+    as ``remote_traceback``.
+    """
+    def __init__(self, message, remote_traceback=None):
+        super(CompileError, self).__init__(message)
+        self.remote_traceback = remote_traceback
+
+## FUNCTIONS ###################################################################
+
+def default_address():
+    """
+    Returns the address at which a server listens unless told otherwise: a
+    named pipe on Windows, and otherwise a UNIX socket inside the system
+    temporary directory. A server makes its UNIX socket accessible to the
+    current user only.
+    """
+    if sys.platform.startswith('win'):
+        return r'\\.\pipe\x6-compile-server-{}'.format(os.environ.get('USERNAME', ''))
+    return os.path.join(tempfile.gettempdir(), 'x6-compile-server-{}.sock'.format(os.getuid()))
+
+def authkey_file():
+    """
+    Returns the path of the file holding the current user's key for the
+    compile server, inside ``%APPDATA%`` on Windows and the XDG config
+    directory (usually ``~/.config``) elsewhere.
+    """
+    if sys.platform.startswith('win'):
+        config_dir = os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        config_dir = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config_dir, 'x6', 'compile_server.key')
+
+def load_authkey(create=False):
+    """
+    Returns the current user's key for the compile server, read from
+    `~x6.compile_server.authkey_file`.
+
+    Connections carry pickles, which can run arbitrary code when loaded, so
+    the key must not be known to other users: it is generated at random,
+    and the file is only readable by its owner.
+
+    :param bool create: If `True`, generates the key file if it does not
+        yet exist.
+    :raises IOError: if there is no key file and ``create`` is `False`,
+        or if the key file is readable by other users.
+    """
+    filename = authkey_file()
+    if not create and not os.path.exists(filename):
+        raise IOError("No compile server key has been made at {}.".format(filename))
+    if create and not os.path.exists(filename):
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename), 0700)
+        try:
+            fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        except OSError as ex:
+            # Another server may have just made the file; if so, use its key.
+            if ex.errno != errno.EEXIST:
+                raise
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(binascii.hexlify(os.urandom(AUTHKEY_BYTES)))
+
+    if not sys.platform.startswith('win') and os.stat(filename).st_mode & 0077:
+        raise IOError("The compile server key {} is accessible to other users.".format(filename))
+    with open(filename, 'r') as f:
+        authkey = f.read().strip()
+    if not authkey:
+        raise IOError("The compile server key {} is empty.".format(filename))
+    return authkey
+
+def _authkey(authkey, create=False):
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_ENV_VAR) or load_authkey(create=create)
+    return authkey
+
+def _is_socket_path(address):
+    return isinstance(address, basestring) and not address.startswith('\\\\')
+
+def _socket_accepts(address):
+    # multiprocessing.connection.Client keeps retrying a refused UNIX socket
+    # for many seconds, so a socket left behind by a server that has
+    # exited is detected with a plain connection instead.
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(address)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+def _server_is_listening(address, authkey):
+    if _is_socket_path(address):
+        return _socket_accepts(address)
+    # A server that rejects our key is still a server.
+    try:
+        Client(address, authkey=authkey).close()
+    except AuthenticationError:
+        return True
+    except (IOError, OSError, EOFError):
+        return False
+    return True
+
+def run_job(job):
+    """
+    Runs a compile job in this process, and returns its result.
+
+    :param dict job: Arguments for the function of `x6.pulprog` that
+        ``job['kind']`` names in `~x6.compile_server.JOB_KINDS`, which
+        defaults to ``'incremental'``. ``source_file`` and ``dirname`` are
+        required; the other arguments are passed on as given.
+    :return: A `dict` with the output ``dirname``, and either the artifacts
+        ``rebuilt`` by an incremental compilation or the ``manifest``
+        written by a compilation to several boards.
+    """
+    # Imported here so that a client need not import the compiler.
+    from x6 import pulprog
+
+    job = dict(job)
+    kind = job.pop('kind', 'incremental')
+    if kind not in JOB_KINDS:
+        raise ValueError("Unknown kind of compile job {!r}.".format(kind))
+    compile_fn = getattr(pulprog, JOB_KINDS[kind])
+    source_file = str(job.pop('source_file'))
+    dirname = str(job.pop('dirname'))
+
+    output = compile_fn(source_file, dirname, **job)
+
+    result = {'dirname': dirname}
+    if kind == 'incremental':
+        result['rebuilt'] = output
+    elif kind == 'boards':
+        result['manifest'] = output
+    return result
+
+## WORKERS #####################################################################
+
+class _ProgressWriter(object):
+    # Stands in for sys.stdout in a worker, sending each line that the
+    # compiler prints back to the server as it is printed. The compiler
+    # prints from several threads, hence the lock.
+    def __init__(self, conn):
+        self._conn = conn
+        self._buffer = ''
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            self._buffer += data
+            while '\n' in self._buffer:
+                line, self._buffer = self._buffer.split('\n', 1)
+                if line.strip():
+                    self._conn.send(('progress', line))
+
+    def flush(self):
+        pass
+
+def _worker_main(conn):
+    # Runs in each worker process, so must be a module-level function.
+    # Importing the compiler once here builds the grammar, and the parse
+    # cache and waveform libraries that it opens are then kept for every
+    # job that this worker runs.
+    import x6.pulprog
+
+    stdout = sys.stdout
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, IOError):
+            break
+        if job is None:
+            break
+
+        sys.stdout = _ProgressWriter(conn)
+        try:
+            result = run_job(job)
+        except Exception as ex:
+            sys.stdout = stdout
+            conn.send(('error', "{}: {}".format(type(ex).__name__, ex), traceback.format_exc()))
+        else:
+            sys.stdout = stdout
+            conn.send(('done', result))
+
+class _Worker(object):
+    def __init__(self, idx):
+        self.idx = idx
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_main, args=(child_conn,), name="x6-compile-worker-{}".format(idx)
+        )
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (IOError, EOFError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+## CLASSES #####################################################################
+
+class CompileServer(object):
+    """
+    Compiles XPP programs on behalf of clients that connect over a local
+    socket, such as `~x6.compile_server.CompileClient`.
+
+    Jobs are run by a pool of long-lived worker processes. Each worker
+    builds the grammar once, and keeps the parse cache, the waveform
+    libraries that it has opened and the include resolution machinery warm
+    from one job to the next. Incremental jobs, the default, further reuse
+    the Velo files and PRI patterns already in the output directory. Lines
+    printed by the compiler are streamed back to the client while its job
+    runs.
+
+    Jobs for the same output directory are run one at a time, in the order
+    that they arrive; jobs for different directories run in parallel, up
+    to the number of workers.
+
+    On Windows, the server must be started from within an
+    ``if __name__ == "__main__":`` block of the calling script.
+
+    :param address: Address to listen on, as accepted by
+        `multiprocessing.connection.Listener`, defaulting to
+        `~x6.compile_server.default_address`.
+    :param str authkey: Key that clients must present, defaulting to the
+        value of the environment variable ``X6_COMPILE_SERVER_AUTHKEY``, or
+        else to that returned by `~x6.compile_server.load_authkey`, which
+        is generated if need be.
+    :param int workers: Number of worker processes, defaulting to the
+        number of CPUs.
+    """
+
+    def __init__(self, address=None, authkey=None, workers=None):
+        self.address = address if address is not None else default_address()
+        self._authkey = _authkey(authkey, create=True)
+        self._n_workers = max(1, workers or multiprocessing.cpu_count())
+
+        self._workers = []
+        self._idle = Queue.Queue()
+        self._listener = None
+        self._stopping = threading.Event()
+
+        self._lock = threading.Lock()
+        self._dir_locks = {}
+        self.jobs_run = 0
+
+    ## LIFECYCLE ##
+
+    def start(self):
+        """
+        Starts the worker processes and begins listening, without yet
+        accepting connections. Called by
+        `~x6.compile_server.CompileServer.serve_forever` if needed.
+
+        :raises RuntimeError: if another server is already listening on
+            the same address.
+        """
+        if self._listener is not None:
+            return
+        if _server_is_listening(self.address, self._authkey):
+            raise RuntimeError("A compile server is already listening on {}.".format(self.address))
+        if _is_socket_path(self.address) and os.path.exists(self.address):
+            # Left behind by a server that did not shut down cleanly.
+            os.remove(self.address)
+
+        for idx in xrange(self._n_workers):
+            worker = _Worker(idx)
+            self._workers.append(worker)
+            self._idle.put(worker)
+
+        # Only the owner may connect to the socket, from the moment that it
+        # is made.
+        umask = os.umask(0177)
+        try:
+            self._listener = Listener(self.address, authkey=self._authkey)
+        finally:
+            os.umask(umask)
+        self.address = self._listener.address
+        print "[XPP Compile Server] Listening on {} with {} workers.".format(self.address, self._n_workers)
+
+    def serve_forever(self):
+        """
+        Accepts connections, handling each in its own thread, until a client
+        asks the server to shut down.
+        """
+        self.start()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn = self._listener.accept()
+                except (IOError, EOFError, AuthenticationError):
+                    continue
+                if self._stopping.is_set():
+                    conn.close()
+                    break
+                thread = threading.Thread(target=self._handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        """
+        Stops `~x6.compile_server.CompileServer.serve_forever`. Jobs already
+        running are allowed to finish.
+        """
+        self._stopping.set()
+        try:
+            # Wakes the listener, which is blocked waiting for a connection.
+            Client(self.address, authkey=self._authkey).close()
+        except (IOError, EOFError, AuthenticationError):
+            pass
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        print "[XPP Compile Server] Stopped."
+
+    ## CONNECTIONS ##
+
+    def _handle(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, IOError):
+                    break
+                command = request[0]
+                if command == 'compile':
+                    self._compile(conn, request[1])
+                elif command == 'ping':
+                    conn.send(('pong', {'workers': self._n_workers, 'jobs_run': self.jobs_run}))
+                elif command == 'shutdown':
+                    conn.send(('done', None))
+                    self.shutdown()
+                    break
+                else:
+                    conn.send(('error', "Unknown command {!r}.".format(command), None))
+        finally:
+            conn.close()
+
+    def _dir_lock(self, dirname):
+        with self._lock:
+            return self._dir_locks.setdefault(os.path.abspath(dirname), threading.Lock())
+
+    def _compile(self, conn, job):
+        client = [conn]
+        def send(message):
+            # The client may hang up while its job runs; the worker must
+            # still be heard out, so that its next job starts afresh.
+            if client:
+                try:
+                    client[0].send(message)
+                except (IOError, EOFError):
+                    del client[:]
+
+        send(('progress', "[XPP Compile Server] Queued {}.".format(job.get('source_file'))))
+        with self._dir_lock(job['dirname']):
+            worker = self._idle.get()
+            try:
+                worker.conn.send(job)
+                while True:
+                    message = worker.conn.recv()
+                    send(message)
+                    if message[0] in ('done', 'error'):
+                        break
+            except (IOError, EOFError):
+                send(('error', "Compile worker {} exited while compiling.".format(worker.idx), None))
+                worker.stop()
+                worker = _Worker(worker.idx)
+                self._workers[worker.idx] = worker
+            finally:
+                with self._lock:
+                    self.jobs_run += 1
+                self._idle.put(worker)
+
+class CompileClient(object):
+    """
+    Connection to a `~x6.compile_server.CompileServer`.
+
+    :param address: Address of the server, defaulting to
+        `~x6.compile_server.default_address`.
+    :param str authkey: See `~x6.compile_server.CompileServer`.
+    """
+
+    def __init__(self, address=None, authkey=None):
+        self.address = address if address is not None else default_address()
+        self._conn = Client(self.address, authkey=_authkey(authkey))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def _call(self, request, progress=None):
+        self._conn.send(request)
+        while True:
+            message = self._conn.recv()
+            if message[0] == 'progress':
+                if progress is not None:
+                    progress(message[1])
+            elif message[0] == 'error':
+                raise CompileError(message[1], message[2])
+            else:
+                return message[1]
+
+    def compile(self, source_file, dirname, namespace=None, kind='incremental', progress=None, **kwargs):
+        """
+        Compiles the XPP source in a given file on the server, waiting for
+        the job to finish.
+
+        :param str source_file: Path to the file containing the xpulprog
+            source to be compiled.
+        :param str dirname: Path to the output directory.
+        :param dict namespace: See `~x6.pulprog.compile_to_directory`. Its
+            values must be picklable.
+        :param str kind: One of the keys of `~x6.compile_server.JOB_KINDS`.
+        :param callable progress: Called with each line of progress that
+            the server reports.
+        :return: As returned by `~x6.compile_server.run_job`.
+        :raises CompileError: if the job fails.
+        """
+        job = dict(kwargs,
+            kind=kind,
+            # The server's working directory need not be ours.
+            source_file=os.path.abspath(source_file),
+            dirname=os.path.abspath(dirname),
+            namespace=namespace
+        )
+        return self._call(('compile', job), progress=progress)
+
+    def ping(self):
+        """
+        Returns a `dict` describing the server.
+        """
+        return self._call(('ping',))
+
+    def shutdown(self):
+        """
+        Asks the server to stop once the jobs already running have finished.
+        """
+        self._call(('shutdown',))
+
+def connect(address=None, authkey=None):
+    """
+    Returns a `~x6.compile_server.CompileClient` connected to a running
+    server, or `None` if no server is listening at ``address``, or if no
+    key has been made for the current user.
+    """
+    if address is None:
+        address = default_address()
+    if _is_socket_path(address) and not _socket_accepts(address):
+        return None
+    try:
+        return CompileClient(address, authkey)
+    except (IOError, OSError, EOFError, AuthenticationError):
+        return None
+
+## MAIN ########################################################################
+
+if __name__ == "__main__":
+    import argparse
+    arg_parser = argparse.ArgumentParser(description="Runs a local XPP compile server.")
+    arg_parser.add_argument('--address', default=None,
+        help="UNIX socket or named pipe to listen on."
+    )
+    arg_parser.add_argument('--workers', type=int, default=None,
+        help="Number of worker processes; defaults to the number of CPUs."
+    )
+    args = arg_parser.parse_args()
+    CompileServer(address=args.address, workers=args.workers).serve_forever()
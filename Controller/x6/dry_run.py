@@ -0,0 +1,350 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# dry_run.py: Estimates the outputs of compiling an xpulprog program, and
+#     checks them for problems, without generating waveforms or files.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import time
+import pkgutil
+import cStringIO
+import ConfigParser as cp
+
+import x6.pulprog as pp
+import x6.timeline as tl
+from x6 import TX_CHANNELS
+from x6.xpp_types import IQChannel
+from x6.process_waveform import velo_size, DATA_ITEM_SIZE
+
+## CONSTANTS ###################################################################
+
+# Rough costs, in seconds, of each step of a full compilation, measured on a
+# development machine. These are only used to predict compile times.
+COST_PER_PULSE = 4e-5
+COST_PER_REPEATED_PULSE = 1e-6
+COST_PER_SAMPLE = 2e-9
+COST_PER_PRI_ENTRY = 3e-6
+COST_PER_VELO_BYTE = 1.5e-8
+
+# Section of the template pulse configuration holding its options.
+_TEMPLATE_SECTION = 'Compiled Pulse'
+
+## FUNCTIONS ###################################################################
+
+def _template_options():
+    # Options of the pulse configuration that PulseConfigurationVisitor
+    # starts from.
+    config = cp.ConfigParser()
+    config.readfp(cStringIO.StringIO(pkgutil.get_data('x6', '_template.pulse')))
+    return dict(config.items(_TEMPLATE_SECTION))
+
+def _as_bool(value):
+    return str(value).strip() == 'True'
+
+def _as_int(value):
+    try:
+        return int(float(str(value)))
+    except ValueError:
+        return None
+
+## CLASSES #####################################################################
+
+class DryRunVisitor(pp.CompilationVisitor):
+    """
+    Visitor that counts what the visitors of
+    `~x6.pulprog.build_all_visitor` would produce, without producing it.
+
+    Samples are counted as `~x6.pulprog.WaveformBuilderVisitor` would write
+    them, and PRI entries as `~x6.pulprog.PRIPatternVisitor` would collect
+    them. Entries produced by a ``repeat`` block are counted as distinct
+    from one another, and from all other entries.
+
+    Pulses that overlap in time on the same pin are recorded in
+    ``overlaps``, a `dict` from pin names to the number of overlapping
+    pulses and the time of the first overlap.
+    """
+
+    def __init__(self):
+        self.tx_samples = dict((pin, 0) for pin in TX_CHANNELS[:4])
+        self.options = {}
+        self.n_pulses = 0
+        self.n_repeated_pulses = 0
+        self.span = 0
+        self.overlaps = {}
+        self.has_written = False
+        self.sample_rate = None
+        self.active_channels = None
+
+        self._rx_entries = set()
+        self._tx_entries = set()
+        self._n_repeated_entries = {True: 0, False: 0}
+        self._pri_ends = {True: 0, False: 0}
+        self._ends = {}
+
+    def pri_entries(self, rx=False):
+        """
+        Returns the number of entries in the RX or TX PRI pattern.
+        """
+        entries = self._rx_entries if rx else self._tx_entries
+        return len(entries) + self._n_repeated_entries[rx]
+
+    def pri_span(self, rx=False):
+        """
+        Returns the time, in samples, at which the last entry of the RX or
+        TX PRI pattern ends.
+        """
+        return self._pri_ends[rx]
+
+    def _check_overlap(self, pin, t, n_samp):
+        if n_samp > 0 and t < self._ends.get(pin, 0):
+            count, first_t = self.overlaps.get(pin, (0, t))
+            self.overlaps[pin] = (count + 1, first_t)
+
+    def _add_samples(self, channels, n_samp, how_many=1):
+        for channel in channels:
+            if channel.is_rx or not (isinstance(channel, IQChannel) or channel.analog):
+                continue
+            for pin in tl.channel_pins(channel):
+                self.tx_samples[pin] += n_samp * how_many
+            if n_samp > 0:
+                self.has_written = True
+
+    def visit_pulseexpr(self, state, channels, t, n_samp, waveform, phase):
+        self.n_pulses += 1
+        self._add_samples(channels, n_samp)
+        self.span = max(self.span, t + n_samp)
+
+        for channel in channels:
+            for pin in tl.channel_pins(channel):
+                self._check_overlap(pin, t, n_samp)
+                self._ends[pin] = max(self._ends.get(pin, 0), t + n_samp)
+
+        for entries, rx in ((self._rx_entries, True), (self._tx_entries, False)):
+            code = tl.Timeline._pri_code(channels, rx)
+            if code >= 0:
+                entries.add((code, t, n_samp))
+                self._pri_ends[rx] = max(self._pri_ends[rx], t + n_samp)
+
+    def visit_repeat(self, state, pulses, period, how_many):
+        self.n_repeated_pulses += len(pulses)
+        offset = (how_many - 1) * period
+
+        # The extent of one iteration on each pin, as (start, end).
+        extents = {}
+        for channels, t, n_samp, waveform, phase in pulses:
+            self._add_samples(channels, n_samp, how_many)
+            self.span = max(self.span, t + n_samp + offset)
+            for channel in channels:
+                for pin in tl.channel_pins(channel):
+                    self._check_overlap(pin, t, n_samp)
+                    self._ends[pin] = max(self._ends.get(pin, 0), t + n_samp)
+                    if n_samp > 0:
+                        start, end = extents.get(pin, (t, t + n_samp))
+                        extents[pin] = (min(start, t), max(end, t + n_samp))
+
+        # Iterations overlap one another if any pin is busy for longer than
+        # the period.
+        for pin, (start, end) in extents.items():
+            if how_many > 1 and end - start > period:
+                count, first_t = self.overlaps.get(pin, (0, start + period))
+                self.overlaps[pin] = (count + how_many - 1, first_t)
+            self._ends[pin] += offset
+
+        for rx in (True, False):
+            iteration = set()
+            for channels, t, n_samp, waveform, phase in pulses:
+                code = tl.Timeline._pri_code(channels, rx)
+                if code >= 0:
+                    iteration.add((code, t, n_samp))
+                    self._pri_ends[rx] = max(self._pri_ends[rx], t + n_samp + offset)
+            self._n_repeated_entries[rx] += len(iteration) * (how_many if period > 0 else 1)
+
+    def visit_option(self, state, opt_name, opt_value):
+        self.options[opt_name] = opt_value
+
+    def post_compilation(self, sample_rate, active_channels, extra_options, peripheral_id):
+        self.sample_rate = sample_rate
+        self.active_channels = active_channels
+
+class DryRunReport(object):
+    """
+    Estimated outputs of compiling a program, as returned by
+    `~x6.dry_run.dry_run`.
+
+    :ivar dict tx_samples: Number of samples written for each DA channel.
+    :ivar int velo_bytes: Size of ``waveform.velo``, or 0 if none would be
+        written.
+    :ivar dict pri_entries: Number of entries in the ``'rx'`` and ``'tx'``
+        PRI patterns.
+    :ivar int span: Time, in samples, at which the last pulse ends.
+    :ivar float estimated_seconds: Predicted time to compile the program
+        with `~x6.pulprog.compile_to_directory`.
+    :ivar float dry_run_seconds: Time taken by the dry run itself.
+    :ivar list problems: Descriptions of each problem found.
+    """
+
+    def __init__(self, visitor, options, dry_run_seconds, limits):
+        self.sample_rate = visitor.sample_rate
+        self.active_channels = visitor.active_channels
+        self.tx_samples = dict(visitor.tx_samples)
+        self.span = visitor.span
+        self.n_pulses = visitor.n_pulses
+        self.n_repeated_pulses = visitor.n_repeated_pulses
+        self.pri_entries = {'rx': visitor.pri_entries(rx=True), 'tx': visitor.pri_entries(rx=False)}
+        self.options = options
+        self.dry_run_seconds = dry_run_seconds
+
+        if visitor.has_written:
+            self.velo_bytes = velo_size(
+                self.active_channels, [self.tx_samples[pin] for pin in TX_CHANNELS[:4]]
+            )
+        else:
+            self.velo_bytes = 0
+
+        self.estimated_seconds = (
+            COST_PER_PULSE * self.n_pulses +
+            COST_PER_REPEATED_PULSE * self.n_repeated_pulses +
+            COST_PER_SAMPLE * sum(self.tx_samples.values()) +
+            COST_PER_PRI_ENTRY * sum(self.pri_entries.values()) +
+            COST_PER_VELO_BYTE * self.velo_bytes
+        )
+
+        self.problems = []
+        for pin, (count, first_t) in sorted(visitor.overlaps.items()):
+            self.problems.append("{} overlapping pulses on {}, the first at sample {}.".format(count, pin, first_t))
+        for kind, rx in (('rx', True), ('tx', False)):
+            self._check_pri(kind, visitor.pri_span(rx))
+        self._check_limits(**limits)
+
+    def _check_pri(self, kind, pri_span):
+        name = lambda option: '{}_{}'.format(kind, option)
+        if not _as_bool(self.options.get(name('enable_pri'))):
+            return
+
+        # A period of zero leaves the pattern unbounded.
+        period = _as_int(self.options.get(name('period')))
+        if period is not None and 0 < period < pri_span:
+            self.problems.append("The {} PRI pattern spans {} samples, but {} is only {}.".format(
+                kind.upper(), pri_span, name('period'), period
+            ))
+
+        count = _as_int(self.options.get(name('count')))
+        if _as_bool(self.options.get(name('finite'))) and count is not None and count <= 0:
+            self.problems.append("{} is {}, so the finite {} PRI pattern would never play.".format(name('count'), count, kind.upper()))
+
+    def _check_limits(self, max_velo_bytes=None, max_pri_entries=None, max_seconds=None):
+        if max_velo_bytes is not None and self.velo_bytes > max_velo_bytes:
+            self.problems.append("waveform.velo would be {} bytes, more than the limit of {}.".format(self.velo_bytes, max_velo_bytes))
+        if max_pri_entries is not None:
+            for kind in ('rx', 'tx'):
+                if self.pri_entries[kind] > max_pri_entries:
+                    self.problems.append("The {} PRI pattern would have {} entries, more than the limit of {}.".format(
+                        kind.upper(), self.pri_entries[kind], max_pri_entries
+                    ))
+        if max_seconds is not None and self.estimated_seconds > max_seconds:
+            self.problems.append("Compilation would take about {:.1f} s, more than the limit of {} s.".format(self.estimated_seconds, max_seconds))
+
+    @property
+    def ok(self):
+        """
+        `True` if no problems were found.
+        """
+        return not self.problems
+
+    @property
+    def span_seconds(self):
+        return self.span / (self.sample_rate * 1e6) if self.sample_rate else None
+
+    @property
+    def waveform_bytes(self):
+        """
+        Memory taken by the samples of all DA channels while compiling.
+        """
+        return sum(self.tx_samples.values()) * DATA_ITEM_SIZE
+
+    def check(self):
+        """
+        Raises `ValueError` if any problems were found.
+        """
+        if self.problems:
+            raise ValueError("Dry run found problems:\n\t" + "\n\t".join(self.problems))
+
+    def report(self):
+        """
+        Returns a printable summary of this dry run.
+        """
+        lines = ["Dry run took {:.4f} s.".format(self.dry_run_seconds)]
+        lines.append("{:<32} {}".format("Sample rate (MHz)", self.sample_rate))
+        lines.append("{:<32} {}".format("Active channels", self.active_channels))
+        for pin in TX_CHANNELS[:4]:
+            lines.append("{:<32} {}".format("TX samples on " + pin, self.tx_samples[pin]))
+        lines.append("{:<32} {}".format("waveform.velo (bytes)", self.velo_bytes))
+        lines.append("{:<32} {}".format("RX PRI entries", self.pri_entries['rx']))
+        lines.append("{:<32} {}".format("TX PRI entries", self.pri_entries['tx']))
+        lines.append("{:<32} {}".format("Span (samples)", self.span))
+        lines.append("{:<32} {:.4f}".format("Estimated compile time (s)", self.estimated_seconds))
+        if self.problems:
+            lines.append("")
+            lines.append("Problems:")
+            lines.extend("    " + problem for problem in self.problems)
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.report()
+
+## FUNCTIONS ###################################################################
+
+def dry_run(source_file, namespace=None, parser='fast', max_velo_bytes=None, max_pri_entries=None,
+        max_seconds=None
+    ):
+    """
+    Runs the compiler over a program without generating any waveform
+    samples or output files, and estimates what compiling it would produce.
+
+    As ``repeat`` blocks whose iterations only differ in time are handled
+    as a whole, a dry run takes time proportional to the size of the
+    program rather than that of its outputs.
+
+    :param source_file: File containing the xpulprog source.
+    :type source_file: `str` containing a path or `file`-like
+    :param dict namespace: See `~x6.pulprog.compile_to_directory`.
+    :param str parser: See `~x6.pulprog.parse_program`.
+    :param int max_velo_bytes: If given, a ``waveform.velo`` larger than
+        this is reported as a problem.
+    :param int max_pri_entries: If given, a PRI pattern with more entries
+        than this is reported as a problem.
+    :param float max_seconds: If given, an estimated compile time longer
+        than this is reported as a problem.
+    :rtype: `~x6.dry_run.DryRunReport`
+    """
+    start = time.time()
+    namespace = pp.mk_namespace_dict(namespace)
+
+    if isinstance(source_file, str):
+        source_file = open(source_file, 'r')
+    try:
+        source = "".join(source_file)
+    finally:
+        source_file.close()
+
+    visitor = DryRunVisitor()
+    pp.compile_program(
+        source, pp.MultiVisitor(visitor, pp.StateVisitor()), namespace=namespace, parser=parser,
+        source_dir=pp._source_dir(source_file)
+    )
+
+    # As PRIPatternVisitor does, PRI is enabled for each pattern that has
+    # entries, unless the program says otherwise.
+    options = _template_options()
+    for kind, rx in (('rx', True), ('tx', False)):
+        options[kind + '_enable_pri'] = str(visitor.pri_entries(rx) > 0)
+    options.update(visitor.options)
+    return DryRunReport(visitor, options, time.time() - start, dict(
+        max_velo_bytes=max_velo_bytes, max_pri_entries=max_pri_entries, max_seconds=max_seconds
+    ))
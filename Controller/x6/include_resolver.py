@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# include_resolver.py: Finds and loads the files named by include statements
+#     in xpulprog programs, without changing the working directory.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import sys
+import threading
+import cPickle as pickle
+
+## CLASSES #####################################################################
+
+class IncludeResolver(object):
+    """
+    Finds the files named by ``include`` statements, and loads the
+    statements in them.
+
+    An include is looked for first in the directory of the file that
+    includes it, and then in each directory of the search path in turn.
+    Relative directories on the search path, such as the ``''`` entry that
+    `sys.path` often has, are taken relative to the including file rather
+    than to the working directory. Resolution thus never depends on, or
+    changes, the working directory, which is shared by all threads of a
+    process.
+
+    Resolved paths are memoized, as are the statements parsed from each
+    file, so that includes within ``repeat`` blocks are neither looked up
+    nor parsed again. The contents of each directory on the search path are
+    listed once, so that a name missing from most directories costs one
+    set lookup per directory rather than a call to `os.path.isfile`.
+
+    A resolver does not notice files being created, changed or deleted
+    after it has seen them; call `~x6.include_resolver.IncludeResolver.clear`
+    or use a new resolver for each compilation.
+
+    :param list search_path: Directories to search, or `None` to search
+        `sys.path` as it is at the time of each lookup.
+    """
+
+    def __init__(self, search_path=None):
+        self._search_path = list(search_path) if search_path is not None else None
+        self._resolved = {}
+        self._listings = {}
+        self._parsed = {}
+        self._lock = threading.Lock()
+
+    @property
+    def search_path(self):
+        return list(self._search_path if self._search_path is not None else sys.path)
+
+    @property
+    def resolved_files(self):
+        """
+        Paths of every file that this resolver has resolved, such as to
+        record what a compilation depended on.
+        """
+        with self._lock:
+            return sorted(set(self._resolved.values()))
+
+    def clear(self):
+        """
+        Forgets all resolved paths, directory listings and parsed files.
+        """
+        with self._lock:
+            self._resolved.clear()
+            self._listings.clear()
+            self._parsed.clear()
+
+    ## RESOLUTION ##
+
+    def _listing(self, dirname):
+        with self._lock:
+            listing = self._listings.get(dirname)
+        if listing is None:
+            try:
+                listing = frozenset(os.path.normcase(name) for name in os.listdir(dirname))
+            except OSError:
+                listing = frozenset()
+            with self._lock:
+                self._listings[dirname] = listing
+        return listing
+
+    def _find_in(self, dirname, filename):
+        # Only the first component of the name need be in the listing; the
+        # rest is checked by os.path.isfile below. Names leading out of the
+        # directory, such as "../common/channels.xpph", are never listed.
+        first = os.path.normcase(os.path.normpath(filename)).split(os.sep)[0]
+        if first != os.pardir and first not in self._listing(dirname):
+            return None
+        candidate = os.path.join(dirname, filename)
+        return candidate if os.path.isfile(candidate) else None
+
+    def resolve(self, filename, source_dir=None):
+        """
+        Returns the absolute path of the file named by an include statement.
+
+        :param str filename: Name given in the include statement.
+        :param str source_dir: Directory of the including file, or `None`
+            for the working directory.
+        :raises IOError: if the file cannot be found.
+        """
+        source_dir = os.path.abspath(source_dir if source_dir is not None else os.getcwd())
+        search_path = self._search_path if self._search_path is not None else sys.path
+        key = (filename, source_dir, tuple(search_path))
+        with self._lock:
+            resolved = self._resolved.get(key)
+        if resolved is not None:
+            return resolved
+
+        if os.path.isabs(filename):
+            resolved = filename if os.path.isfile(filename) else None
+        else:
+            resolved = None
+            for folder in [source_dir] + list(search_path):
+                resolved = self._find_in(os.path.join(source_dir, folder), filename)
+                if resolved is not None:
+                    break
+        if resolved is None:
+            raise IOError("Include file {} not found in {} or on the search path.".format(filename, source_dir))
+
+        resolved = os.path.abspath(resolved)
+        with self._lock:
+            self._resolved[key] = resolved
+        return resolved
+
+    ## LOADING ##
+
+    def load(self, filename, parser='fast', use_cache=True):
+        """
+        Returns the statements in a file returned by
+        `~x6.include_resolver.IncludeResolver.resolve`.
+
+        Statements from the fast parser are kept pickled, and each call
+        returns fresh statements, as the compiler may mutate values such as
+        `~x6.xpp_types.PhaseList` that they contain.
+
+        :param str parser: See `~x6.pulprog.parse_program`.
+        :param bool use_cache: See `~x6.pulprog.parse_program`.
+        """
+        # Imported here as x6.pulprog imports this module.
+        from x6.pulprog import parse_file
+
+        if parser != 'fast':
+            return parse_file(filename, parser, use_cache)
+
+        key = (filename, use_cache)
+        with self._lock:
+            data = self._parsed.get(key)
+        if data is None:
+            stmts = parse_file(filename, parser, use_cache)
+            with self._lock:
+                self._parsed[key] = pickle.dumps(stmts, pickle.HIGHEST_PROTOCOL)
+            return stmts
+        return pickle.loads(data)
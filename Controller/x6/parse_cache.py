@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# parse_cache.py: Caches parsed xpulprog sources in memory and on disk, so
+#     that unchanged programs and include files are parsed only once.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import sys
+import hashlib
+import tempfile
+import threading
+import cPickle as pickle
+
+from x6 import xpp_parser
+
+## CONSTANTS ###################################################################
+
+#: Bump whenever the statements produced by `x6.xpp_parser` change, so that
+#: entries pickled by an older parser are not reused.
+PARSER_VERSION = 3
+
+#: Environment variable overriding the directory used for the on-disk cache.
+#: Setting it to an empty string disables the on-disk cache.
+CACHE_DIR_ENV_VAR = 'XPP_PARSE_CACHE_DIR'
+
+#: Total size, in bytes, to which the on-disk cache is trimmed by deleting
+#: its least recently used entries.
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+## CLASSES #####################################################################
+
+class ParseCache(object):
+    """
+    Caches the statements produced by `x6.xpp_parser.parse`, keyed by a
+    hash of the source code.
+
+    Entries are kept in memory as pickles, and each lookup returns freshly
+    unpickled statements. This matters because the compiler shares values
+    such as `~x6.pulprog.PhaseList` between the parsed statements and its
+    namespace, and then mutates them; a cached entry must never see those
+    changes.
+
+    Loading a pickle can run arbitrary code, so entries are only read from
+    and written to a directory owned by the current user that no other user
+    can write to. The directory is made, accessible to its owner only, if
+    it does not exist; if it is not private, the cache is kept in memory
+    only.
+
+    :param str cache_dir: Directory in which to pickle entries across runs,
+        or `None` to cache in memory only.
+    :param int max_size: Total size of the entries on disk, in bytes, above
+        which the least recently used entries are deleted.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        # Whether cache_dir has been found to be private, or None if it has
+        # not yet been checked.
+        self._private = None
+        self._entries = {}
+        # Maps absolute paths to (mtime, size, key), so that unchanged files
+        # need not be read and hashed again.
+        self._files = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    def clear(self):
+        """
+        Forgets all in-memory entries. Entries on disk are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._files.clear()
+
+    def _key(self, source):
+        return hashlib.sha1("{}\0{}".format(PARSER_VERSION, source)).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self._cache_dir, key + '.pickle')
+
+    def _use_disk(self):
+        # Makes the cache directory if need be, and checks that no other
+        # user could have planted entries in it.
+        if self._cache_dir is None:
+            return False
+        if self._private is None:
+            try:
+                if not os.path.isdir(self._cache_dir):
+                    os.makedirs(self._cache_dir, 0700)
+                stat = os.stat(self._cache_dir)
+            except OSError:
+                return False
+            self._private = sys.platform.startswith('win') or (
+                stat.st_uid == os.getuid() and not stat.st_mode & 0022
+            )
+        return self._private
+
+    def _trim(self):
+        # Deletes the least recently used entries until those left fit in
+        # max_size. Loading an entry touches its file, so modification
+        # times order the entries by use.
+        entries = []
+        for filename in os.listdir(self._cache_dir):
+            if filename.endswith('.pickle'):
+                try:
+                    stat = os.stat(os.path.join(self._cache_dir, filename))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self._max_size:
+                break
+            try:
+                os.remove(os.path.join(self._cache_dir, filename))
+            except OSError:
+                # Another process may have just deleted it.
+                pass
+            total -= size
+
+    def _load(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+        if data is None and self._use_disk():
+            try:
+                with open(self._entry_path(key), 'rb') as f:
+                    data = f.read()
+                os.utime(self._entry_path(key), None)
+            except (IOError, OSError):
+                return None
+            with self._lock:
+                self._entries[key] = data
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # A truncated or stale file on disk; parse again instead.
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+
+    def _store(self, key, stmts):
+        data = pickle.dumps(stmts, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = data
+        if not self._use_disk():
+            return
+
+        # Write to a temporary file first, so that concurrent compilers
+        # never read a partially written entry.
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            try:
+                os.rename(tmp_name, self._entry_path(key))
+            except OSError:
+                # On Windows, rename fails if another process has already
+                # written the same entry.
+                os.remove(tmp_name)
+            self._trim()
+        except (IOError, OSError):
+            # The on-disk cache is only an optimization.
+            pass
+
+    def parse_source(self, source):
+        """
+        Returns the statements in ``source``, parsing it only if it has not
+        been seen before.
+
+        :param str source: Source code of the pulse program.
+        :raises XPPSyntaxError: if the source is not a valid program.
+        """
+        key = self._key(source)
+        stmts = self._load(key)
+        if stmts is None:
+            stmts = xpp_parser.parse(source)
+            # Only the pickle is kept, so these statements are ours to return.
+            self._store(key, stmts)
+        return stmts
+
+    def parse_file(self, filename):
+        """
+        Returns the statements in the given file. If the file's modification
+        time and size are unchanged since it was last parsed, the file is not
+        read again.
+
+        :param str filename: Path to an **xpulprog** source file.
+        :raises XPPSyntaxError: if the source is not a valid program.
+        """
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        with self._lock:
+            memo = self._files.get(filename)
+        if memo is not None and memo[:2] == (stat.st_mtime, stat.st_size):
+            stmts = self._load(memo[2])
+            if stmts is not None:
+                return stmts
+
+        with open(filename, 'r') as f:
+            source = f.read()
+        stmts = self.parse_source(source)
+        with self._lock:
+            self._files[filename] = (stat.st_mtime, stat.st_size, self._key(source))
+        return stmts
+
+## FUNCTIONS ###################################################################
+
+def default_cache_dir():
+    """
+    Returns the directory of the current user's on-disk parse cache, inside
+    ``%LOCALAPPDATA%`` on Windows and the XDG cache directory (usually
+    ``~/.cache``) elsewhere.
+    """
+    if sys.platform.startswith('win'):
+        cache_root = os.environ.get('LOCALAPPDATA') or os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        cache_root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_root, 'x6', 'parse_cache')
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def default_cache():
+    """
+    Returns the `~x6.parse_cache.ParseCache` shared by the compiler. Its
+    on-disk directory is taken from the environment variable
+    ``XPP_PARSE_CACHE_DIR`` if set, and is otherwise
+    `~x6.parse_cache.default_cache_dir`.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+            if cache_dir is None:
+                cache_dir = default_cache_dir()
+            _default_cache = ParseCache(cache_dir or None)
+        return _default_cache
+
+def parse_source(source):
+    """
+    Parses ``source`` using the default cache. See
+    `~x6.parse_cache.ParseCache.parse_source`.
+    """
+    return default_cache().parse_source(source)
+
+def parse_file(filename):
+    """
+    Parses the given file using the default cache. See
+    `~x6.parse_cache.ParseCache.parse_file`.
+    """
+    return default_cache().parse_file(filename)
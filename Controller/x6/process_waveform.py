@@ -11,11 +11,14 @@ from __future__ import division
 
 ## IMPORTS ##
 
-import os
+import os, sys
 import numpy as np
 import scipy.io as sio
 import tempfile as tf
+import threading
+import Queue
 import x6.vita_convert as vc
+import x6.waveform_library as wl
 from itertools import izip
 from x6 import TX_CHANNELS
 
@@ -33,6 +36,15 @@ MINIMUM_DATA_SIZE = 1000000
 DATA_TYPE = '<i2'
 DATA_ITEM_SIZE = np.dtype(DATA_TYPE).itemsize
 
+# Maximum number of buffers that may be waiting between two stages of the
+# waveform_to_velo pipeline. This bounds the memory used by the pipeline to
+# a few chunks per stage, regardless of how long the waveforms are.
+PIPELINE_QUEUE_DEPTH = 4
+
+# Number of bytes that a WaveformBuffer keeps in memory, by default, before
+# spilling its samples to a temporary file.
+WAVEFORM_BUFFER_MEMORY = 256 * 2**20
+
 ## CLASSES ##
 
 class Waveform(object):
@@ -41,10 +53,14 @@ class Waveform(object):
     
     :param waveform: The data for your waveform
     :type waveform: `str` for file locations where non .mat files are assumed to 
-        be binary in 16bit little-endian format; `file` for any readable open 
+        be binary in 16bit little-endian format, or for references of the form
+        ``"shapes.wlib:name"`` to a waveform stored in a waveform library
+        (see `x6.waveform_library`); `file` for any readable open 
         file-like object assumed to be in 16bit little-endian format; 
         `numpy.ndarray` for a numpy 1D array (this array is automatically astype'd)
-        to the correct data type
+        to the correct data type; arrays that already have the type
+        `DATA_TYPE` are used as-is without copying, even if they are strided
+        views such as ``array[::2]``
     :param str var_name: If ``waveform`` is the name of a MATLAB MAT-file or
         a NumPy NPZ file, then ``var_name`` specifies which variable to load
         from that file.
@@ -60,7 +76,14 @@ class Waveform(object):
         
         # Decide how to handle the waveform based on its type and contents.
         if isinstance(waveform, str):
-            if  waveform[-3:] == 'mat':
+            if wl.split_reference(waveform) is not None:
+                # Look the waveform up in its (memory-mapped) library, so that
+                # we get a view onto the library rather than a copy.
+                self._from = waveform
+                self._fromtype = "waveform library"
+                self.__set_to_ndarray(wl.load_reference(waveform))
+                
+            elif waveform[-3:] == 'mat':
                 # Load the specified variable from the waveform file
                 # and set it as an array.
                 self._from = waveform
@@ -112,7 +135,12 @@ class Waveform(object):
             
     def __set_to_ndarray(self, array):
         self._waveform_type = NP_ARRAY
-        self._data_handle = array.astype(DATA_TYPE).data
+        # Keep a view onto the array whenever we can, rather than a copy
+        # of its buffer; only a change of data type forces a copy.
+        array = np.asarray(array)
+        if array.ndim != 1:
+            array = array.ravel()
+        self._data_handle = array.astype(DATA_TYPE, copy=False)
     
     def __repr__(self):
         return "<Waveform from {1}{0}>".format(
@@ -133,16 +161,9 @@ class Waveform(object):
             self._pos = min(self._pos, DATA_ITEM_SIZE * self._data_handle.tell())
             return data
         elif self._waveform_type == NP_ARRAY:
-            fetch_size = min(chunk_size, len(self._data_handle) // DATA_ITEM_SIZE - self._pos)
-            if self._pos < len(self._data_handle) // DATA_ITEM_SIZE:
-                data = np.frombuffer(   self._data_handle, 
-                                        dtype=DATA_TYPE, 
-                                        count=fetch_size,
-                                        offset=self._pos * DATA_ITEM_SIZE)
-                self._pos += chunk_size
-                self._pos = min(self._pos, self.length)
-            else:
-                data = np.empty(0,dtype=DATA_TYPE)
+            # Slicing returns a view, so no data is copied here.
+            data = self._data_handle[self._pos:self._pos + chunk_size]
+            self._pos = min(self._pos + chunk_size, self.length)
             return data
         else:
             raise NotImplementedError('Reading of this format not supported yet.')
@@ -152,7 +173,7 @@ class Waveform(object):
         Writes the 1D ndarray chunk to the current position of the waveform
         """
         if self._waveform_type == BIN_FILE:
-            self._data_handle.write(chunk.astype(DATA_TYPE).data)
+            self._data_handle.write(np.ascontiguousarray(chunk, dtype=DATA_TYPE).data)
             self._pos = DATA_ITEM_SIZE * self._data_handle.tell()
         else:
             raise NotImplementedError('Writing of this format not supported yet.')
@@ -183,7 +204,7 @@ class Waveform(object):
             num_bytes = self._data_handle.tell()
             self._data_handle.seek(curr_pos)
         elif self._waveform_type == NP_ARRAY:
-            num_bytes = len(self._data_handle)
+            return len(self._data_handle)
         else:
             raise NotImplementedError('Finding the length of this format not supported yet.')
             
@@ -208,6 +229,190 @@ class IQWaveform(Waveform):
             str(self.waveform_i), str(self.waveform_q)
         )
 
+class WaveformBuffer(Waveform):
+    """
+    Subclass of `Waveform` that can be written to, keeping its samples in
+    a growable in-memory array until they would take more than
+    ``memory_limit`` bytes. Past that, the samples are moved to a temporary
+    file and later writes go to that file.
+
+    While in memory, reading from the buffer returns views onto its array,
+    so a buffer can be passed to `~x6.process_waveform.waveform_to_velo`
+    without any file I/O.
+
+    :param int memory_limit: Number of bytes that the buffer may keep in
+        memory before spilling to disk, or `None` for no limit.
+    """
+    INITIAL_CAPACITY = 4096
+
+    def __init__(self, memory_limit=WAVEFORM_BUFFER_MEMORY):
+        self._pos = 0
+        self._mode = 'w+b'
+        self._from = None
+        self._fromtype = "in-memory buffer"
+        self._memory_limit = memory_limit
+        self._waveform_type = NP_ARRAY
+        self._array = np.empty(self.INITIAL_CAPACITY, dtype=DATA_TYPE)
+        self._data_handle = self._array[:0]
+
+    @property
+    def spilled(self):
+        """
+        `True` if the samples of this buffer have been moved to disk.
+        """
+        return self._waveform_type == BIN_FILE
+
+    def set_chunk(self, chunk):
+        """
+        Writes the 1D ndarray chunk to the current position of the waveform
+        """
+        if self._waveform_type == BIN_FILE:
+            return Waveform.set_chunk(self, chunk)
+
+        chunk = np.asarray(chunk).ravel()
+        end = self._pos + len(chunk)
+        if self._memory_limit is not None and end * DATA_ITEM_SIZE > self._memory_limit:
+            self._spill()
+            return Waveform.set_chunk(self, chunk)
+
+        if end > len(self._array):
+            # Grow geometrically, so that appending is amortized O(1).
+            capacity = max(end, 2 * len(self._array))
+            if self._memory_limit is not None:
+                capacity = min(capacity, self._memory_limit // DATA_ITEM_SIZE)
+            grown = np.empty(capacity, dtype=DATA_TYPE)
+            grown[:len(self._data_handle)] = self._data_handle
+            self._array = grown
+
+        self._array[self._pos:end] = chunk
+        self._data_handle = self._array[:max(end, len(self._data_handle))]
+        self._pos = end
+
+    def _spill(self):
+        data_file = tf.TemporaryFile()
+        # Fix for the TemporaryFile hack on Windows.
+        data_file = getattr(data_file, 'file', data_file)
+        data_file.write(self._data_handle.data)
+        data_file.seek(self._pos * DATA_ITEM_SIZE)
+        self._array = None
+        self._waveform_type = BIN_FILE
+        self._fromtype = "spilled buffer"
+        self._data_handle = data_file
+
+    def close(self):
+        """
+        Releases the memory or temporary file held by this buffer.
+        """
+        if self._waveform_type == BIN_FILE:
+            self._data_handle.close()
+        else:
+            self._array = np.empty(0, dtype=DATA_TYPE)
+            self._data_handle = self._array
+            self._pos = 0
+
+class _PipelineAbort(Exception):
+    """
+    Raised inside of a pipeline stage when another stage has failed.
+    """
+    pass
+
+class _Pipeline(object):
+    """
+    Runs a set of stages in separate threads, connected by bounded queues.
+    Buffers are handed from stage to stage without being copied, so that
+    stages which spend their time in NumPy or in file I/O (both of which
+    release the GIL) can overlap with each other.
+    
+    The first exception raised by any stage stops all of the other stages,
+    and is re-raised from `~x6.process_waveform._Pipeline.run`.
+    """
+    
+    # Sentinel put on a queue to mark that no more buffers will follow.
+    END = None
+    
+    def __init__(self, depth=PIPELINE_QUEUE_DEPTH):
+        self._depth = depth
+        self._threads = []
+        self._abort = threading.Event()
+        self._exc_info = None
+        
+    def queue(self):
+        return Queue.Queue(maxsize=self._depth)
+        
+    def put(self, queue, item):
+        # Poll so that a stage blocked on a full queue notices when some
+        # other stage has failed.
+        while True:
+            if self._abort.is_set():
+                raise _PipelineAbort()
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+                
+    def get(self, queue):
+        while True:
+            if self._abort.is_set():
+                raise _PipelineAbort()
+            try:
+                return queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+                
+    def iter_queue(self, queue):
+        """
+        Yields buffers from a queue until the end sentinel is found.
+        """
+        while True:
+            item = self.get(queue)
+            if item is self.END:
+                return
+            yield item
+        
+    def stage(self, target, *args):
+        """
+        Adds a stage to the pipeline that will call ``target(*args)`` in
+        its own thread once `~x6.process_waveform._Pipeline.run` is called.
+        """
+        def run_stage():
+            try:
+                target(*args)
+            except _PipelineAbort:
+                pass
+            except Exception:
+                if self._exc_info is None:
+                    self._exc_info = sys.exc_info()
+                self._abort.set()
+                
+        thread = threading.Thread(target=run_stage)
+        thread.daemon = True
+        self._threads.append(thread)
+        
+    def run(self):
+        for thread in self._threads:
+            thread.start()
+        for thread in self._threads:
+            thread.join()
+            
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+            
+class _QueueWriter(object):
+    """
+    File-like object that hands everything written to it to the next stage
+    of a `~x6.process_waveform._Pipeline`.
+    """
+    def __init__(self, pipeline, queue):
+        self._pipeline = pipeline
+        self._queue = queue
+        
+    def write(self, data):
+        self._pipeline.put(self._queue, data)
+        
+    def flush(self):
+        pass
+
 ## FUNCTIONS ##
 
 def rewind_write(waveform_out, waveform_in, n_samp):
@@ -218,23 +423,41 @@ def rewind_write(waveform_out, waveform_in, n_samp):
     added until the exact number of samples has been written to 
     waveform_out.
     
+    Repetitions are not written one at a time; instead, waveform_in is read
+    once and tiled into a block of up to `CHUNK_SIZE` samples, which is
+    then written as many times as needed. The cost of this function thus
+    scales with the number of samples written, and not with the number of
+    repetitions.
+    
     :param Waveform waveform_out: The `Waveform` to write to
     :param Waveform waveform_in: The `Waveform` to read from
     :param int n_samp: The number of samples in total to write to waveform_out
     """
+    if n_samp <= 0:
+        return
+        
+    # Finding the length of a file-backed waveform means seeking, so
+    # only do it once.
+    in_length = waveform_in.length
+    if in_length == 0:
+        raise ValueError("Cannot write {} samples from an empty waveform.".format(n_samp))
+        
+    waveform_in.seek(0)
+    if in_length >= n_samp:
+        waveform_out.set_chunk(waveform_in.get_chunk(n_samp))
+        return
+        
+    # Tile whole copies of waveform_in, so that every block we write
+    # starts at the beginning of waveform_in.
+    n_copies = max(1, min(n_samp, CHUNK_SIZE) // in_length)
+    block = np.tile(waveform_in.get_chunk(in_length), n_copies)
+    
     samps_written = 0
-    while samps_written < n_samp:
-        waveform_in.seek(0)
-        if n_samp - samps_written > n_samp % waveform_in.length:
-            # try to get n_samp samples, but we might get less if
-            # waveform_in is shorter than n_samp
-            data = waveform_in.get_chunk(n_samp)
-        else:
-            # there are more points in waveform_in than we have left
-            # to add
-            data = waveform_in.get_chunk(n_samp % waveform_in.length)
-        waveform_out.set_chunk(data)
-        samps_written += len(data)
+    while n_samp - samps_written >= len(block):
+        waveform_out.set_chunk(block)
+        samps_written += len(block)
+    if samps_written < n_samp:
+        waveform_out.set_chunk(block[:n_samp - samps_written])
         
 def apply_phase(iqwaveform, phase):
     """
@@ -372,6 +595,105 @@ def write_zeros(file_obj, zero_count):
         
     return total_written_count
         
+def _read_stage(pipeline, waveform, out_queue):
+    """
+    Pipeline stage that reads a waveform in chunks of `CHUNK_SIZE` samples.
+    """
+    if waveform is not None:
+        while True:
+            data = waveform.get_chunk(CHUNK_SIZE)
+            if len(data) == 0:
+                break
+            pipeline.put(out_queue, data)
+    pipeline.put(out_queue, pipeline.END)
+    
+def _stream_stage(pipeline, stream, in_queues, interleave, out_queue):
+    """
+    Pipeline stage that copies or interleaves the data for a single stream,
+    pads it out to `MINIMUM_DATA_SIZE` samples and splits the result into
+    chunks that each fill one Vita packet.
+    """
+    packet_samples = vc.VITA_PACKET_SIZE // DATA_ITEM_SIZE
+    pending = [np.empty(0, dtype=DATA_TYPE)]
+    
+    def emit(data):
+        # Only the leftover from the previous call is ever concatenated;
+        # every full packet is otherwise a view onto the incoming buffer.
+        if len(pending[0]) > 0:
+            data = np.concatenate((pending[0], data))
+        n_full = len(data) // packet_samples
+        for idx in xrange(n_full):
+            pipeline.put(out_queue, data[idx * packet_samples:(idx + 1) * packet_samples].tostring())
+        pending[0] = data[n_full * packet_samples:]
+    
+    words_written = 0
+    
+    if not interleave:
+        for data in pipeline.iter_queue(in_queues[0]):
+            emit(data)
+            words_written += len(data)
+            print "Copied {} bytes.".format(len(data) * DATA_ITEM_SIZE)
+    else:
+        # This follows binary_interleave exactly, except that chunks are
+        # taken from the reader stages rather than from the waveforms.
+        chunk_iters = [pipeline.iter_queue(queue) for queue in in_queues]
+        eof = [False, False]
+        while not all(eof):
+            data = [None, None]
+            for idx, chunk_iter in enumerate(chunk_iters):
+                if not eof[idx]:
+                    data[idx] = next(chunk_iter, None)
+                    if data[idx] is None:
+                        eof[idx] = True
+            len1, len2 = [len(d) if d is not None else 0 for d in data]
+            
+            if len1 == 0 and len2 == 0:
+                continue
+            
+            chunk = np.zeros(2*max(len1, len2), dtype=DATA_TYPE)
+            if len1 > 0: chunk[:2*len1:2] = data[0]
+            if len2 > 0: chunk[1:2*len2+1:2] = data[1]
+            
+            words_written += len(chunk)
+            print "Interweaved {0} bytes with {1} bytes.".format(len1 * DATA_ITEM_SIZE, len2 * DATA_ITEM_SIZE)
+            emit(chunk)
+            
+    # For a reason we don't understand, and that isn't documented, 
+    # it seems that there is some minimum data size we must obey 
+    # for the FPGA to work properly on multiple channels.
+    # We haven't bothered to find this minimum exactly, but we know
+    # it is somewhere between 100 and 1000000 samples
+    while words_written < MINIMUM_DATA_SIZE:
+        num_to_add = min(CHUNK_SIZE, MINIMUM_DATA_SIZE - words_written)
+        emit(np.zeros(num_to_add, dtype=DATA_TYPE))
+        words_written += num_to_add
+        print "Wrote {} zeros to end of file.".format(num_to_add * DATA_ITEM_SIZE)
+        
+    if len(pending[0]) > 0:
+        pipeline.put(out_queue, pending[0].tostring())
+    pipeline.put(out_queue, pipeline.END)
+    
+def _packetize_stage(pipeline, stream_queues, peripheral_id, out_queue):
+    """
+    Pipeline stage that packs the per-stream chunks into Vita packets, and
+    those into Velo packets.
+    """
+    packer = vc.VeloVitaPacker(_QueueWriter(pipeline, out_queue), peripheral_id)
+    for packet in vc.iter_vita_packets([
+        (stream, pipeline.iter_queue(queue)) for stream, queue in stream_queues
+    ]):
+        packer.pack(packet)
+    packer.flush()
+    pipeline.put(out_queue, pipeline.END)
+    
+def _write_stage(pipeline, output_filename, in_queue):
+    """
+    Pipeline stage that writes the finished Velo packets to disk.
+    """
+    with open(output_filename, 'wb') as f:
+        for data in pipeline.iter_queue(in_queue):
+            f.write(data)
+        
 def waveform_to_velo(active_channels, output_filename, waveform0=None, waveform1=None, waveform2=None, waveform3=None, peripheral_id=0, rewind=True):
     """
     Combines up to four waveforms into a vita/velo file based on which channels
@@ -382,6 +704,12 @@ def waveform_to_velo(active_channels, output_filename, waveform0=None, waveform1
     See `x6.process_waveform.CHANNEL_STREAM_MAP` to see which streams are 
     associated with which channels.
     
+    The conversion is run as a pipeline of threads connected by bounded
+    queues: one stage reads each waveform, one stage per stream copies or
+    interleaves, one stage packetizes and a final stage writes the Velo file.
+    No temporary files are used, and at most `PIPELINE_QUEUE_DEPTH` buffers
+    are held between any two stages.
+    
     :param list active_channels: A list of length four where each entry 
         corresponds to a channel, and each should be set to True or False.
     :param str output_filename: A string specifying the output file name of the
@@ -400,8 +728,6 @@ def waveform_to_velo(active_channels, output_filename, waveform0=None, waveform1
     """
     
     waveforms = [waveform0, waveform1, waveform2, waveform3]
-    rawbin_file_dict = {}
-    tmp_file_names = []
     
     # go to the beginning of the waveform if rewind is True
     for waveform in waveforms:
@@ -412,60 +738,98 @@ def waveform_to_velo(active_channels, output_filename, waveform0=None, waveform1
     for channel, waveform in enumerate(waveforms):
         if waveform and not active_channels[channel]:
             print "Warning: Channel {} is not active, and so the corresponding waveform will not be loaded.".format(channel)
+            
+    if not any([waveform is not None for waveform in waveforms]):
+        print "Warning: Nothing to do...no file written."
+        return
+    
+    pipeline = _Pipeline()
+    stream_queues = []
   
-    for idx, stream in enumerate(CHANNEL_STREAM_MAP):
+    for stream in CHANNEL_STREAM_MAP:
         
         ch0, ch1 = CHANNEL_STREAM_MAP[stream]   
         
         if any([waveforms[ch] is not None for ch in [ch0, ch1]]) and any([active_channels[ch] for ch in [ch0, ch1]]):
-           
-            # create a temporary file to store the interleaved (or otherwise) data
-            with tf.NamedTemporaryFile(mode='wb',delete=False) as tmp_file:
-                tmp_file_names.append(tmp_file.name)
-                
-                words_written = 0
-                
-                print "Stream {}: active channels {}, {}.".format(stream, active_channels[ch0], active_channels[ch1])
-                if active_channels[ch0] and not active_channels[ch1]:
-                    # in this case we should not interleave
-                    words_written = binary_copy(tmp_file, waveforms[ch0])
-                elif not active_channels[ch0] and active_channels[ch1]:
-                    # in this case we should not interleave
-                    words_written = binary_copy(tmp_file, waveforms[ch1])
-                else:
-                    # in this case we should interweave
-                    words_written = binary_interleave(tmp_file, waveforms[ch0], waveforms[ch1])
-                
-                # For a reason we don't understand, and that isn't documented, 
-                # it seems that there is some minimum data size we must obey 
-                # for the FPGA to work properly on multiple channels.
-                # We haven't bothered to find this minimum exactly, but we know
-                # it is somewhere between 100 and 1000000 samples
-                if words_written < MINIMUM_DATA_SIZE:
-                    write_zeros(tmp_file, MINIMUM_DATA_SIZE - words_written)
+            
+            print "Stream {}: active channels {}, {}.".format(stream, active_channels[ch0], active_channels[ch1])
+            if active_channels[ch0] and not active_channels[ch1]:
+                # in this case we should not interleave
+                read_channels = [ch0]
+            elif not active_channels[ch0] and active_channels[ch1]:
+                # in this case we should not interleave
+                read_channels = [ch1]
+            else:
+                # in this case we should interweave
+                read_channels = [ch0, ch1]
                 
-                rawbin_file_dict.update({stream: tmp_file.name})
+            read_queues = []
+            for ch in read_channels:
+                read_queue = pipeline.queue()
+                pipeline.stage(_read_stage, pipeline, waveforms[ch], read_queue)
+                read_queues.append(read_queue)
                 
-
+            stream_queue = pipeline.queue()
+            pipeline.stage(_stream_stage, pipeline, stream, read_queues, len(read_channels) == 2, stream_queue)
+            stream_queues.append((stream, stream_queue))
+            
     # finally, write our data to vita/velo format
-    if any([waveform is not None for waveform in waveforms]):
-        vc.rawbin_to_velo(output_filename, rawbin_file_dict, peripheral_id)
-    else:
-        print "Warning: Nothing to do...no file written."
-    
-    # delete all temporary files
-    for tmp_file_name in tmp_file_names:
-        os.remove(tmp_file_name)
+    velo_queue = pipeline.queue()
+    pipeline.stage(_packetize_stage, pipeline, stream_queues, peripheral_id, velo_queue)
+    pipeline.stage(_write_stage, pipeline, output_filename, velo_queue)
+    pipeline.run()
+
+def velo_size(active_channels, lengths):
+    """
+    Returns the number of bytes in the Velo file that
+    `~x6.process_waveform.waveform_to_velo` would write for waveforms of
+    the given lengths, without building it.
+    
+    :param list active_channels: As for
+        `~x6.process_waveform.waveform_to_velo`.
+    :param list lengths: The number of samples in each of the four
+        waveforms, or `None` for each waveform that is not given.
+    :return: The size of the file in bytes, or 0 if no file would be
+        written.
+    """
+    n_bytes = 0
+    for stream in CHANNEL_STREAM_MAP:
+        ch0, ch1 = CHANNEL_STREAM_MAP[stream]
+        if not (any([lengths[ch] is not None for ch in [ch0, ch1]]) and any([active_channels[ch] for ch in [ch0, ch1]])):
+            continue
+        
+        len0, len1 = lengths[ch0] or 0, lengths[ch1] or 0
+        if active_channels[ch0] and not active_channels[ch1]:
+            words = len0
+        elif not active_channels[ch0] and active_channels[ch1]:
+            words = len1
+        else:
+            words = 2 * max(len0, len1)
+        
+        # Each stream is padded out to MINIMUM_DATA_SIZE samples, and then
+        # split into Vita packets.
+        data_size = max(words, MINIMUM_DATA_SIZE) * DATA_ITEM_SIZE
+        n_packets = -(-data_size // vc.VITA_PACKET_SIZE)
+        n_bytes += data_size + n_packets * vc.VITA_OVERHEAD_SIZE
+        
+    n_velo_packets = -(-n_bytes // vc.VELO_PACKET_SIZE)
+    return n_bytes + n_velo_packets * vc.VELO_HEADER_SIZE
 
-def velo_to_waveform(active_channels, velo_file=None):
+def velo_to_waveform(active_channels, velo_file=None, lazy=False):
     """"
     Interprets a velo_file as data to be sent to the DACs of the x6, and
     returns the waveforms to be executed on the four channels.
     
+    Deinterleaved channels are returned as strided views onto the decoded
+    stream, so that no channel data is copied.
+    
     :param list active_channels: A length-four list of bools specifying 
         which of the four DA channels of the x6 will be active.
     :param velo_file: The file name of a velo/vita formatted file, for 
         example, as outputted by `~x6.process_waveform.waveform_to_velo`
+    :param bool lazy: If `True`, the streams are decoded into temporary files
+        that are memory-mapped, rather than into memory, so that the
+        returned waveforms are views onto those memory maps.
     :return: A dictionary from channel names to `Waveform`s or None, e.g.,
         {'DA0': Waveform(..), 'DA1': None, 'DA2': Waveform(..), 'DA3': None}
     """
@@ -475,7 +839,7 @@ def velo_to_waveform(active_channels, velo_file=None):
     if velo_file is not None:    
     
         # All of the hard work is done in this function:
-        stream_dict = vc.parse_velo_stream(velo_file)
+        stream_dict = vc.parse_velo_stream(velo_file, mmap=lazy)
         
         # Now we just need some logic statements to figure out how many waveforms
         # there are, whether to deinterleave, etc.
@@ -16,7 +16,7 @@ import x6.process_waveform as pw
 import ConfigParser as cp
 from itertools import izip
 from x6 import TX_CHANNELS, CHANNELS
-from x6.utils import PRIPatternParser, destcode_query, search_for_file
+from x6.utils import PRIPattern, destcode_query, search_for_file
 
 ## Classes #####################################################################
 
@@ -114,9 +114,9 @@ def pri_pattern_to_lines(active_channels, rx_pattern=None, tx_pattern=None, tx_v
     :param list active_channels: A length-four list of bools specifying 
         which of the four DA channels of the x6 will be active.
     :param  rx_pattern: A pattern to be interpretted as the RX line.
-    :type rx_pattern: `str` or `~x6.pulprog.PRIPatternParser` or None
+    :type rx_pattern: `str`, `~x6.utils.PRIPattern`, `~x6.utils.PRIPatternParser` or None
     :param  tx_pattern: A pattern to be interpretted as the RX line.
-    :type tx_pattern: `str` or `~x6.pulprog.PRIPatternParser` or None
+    :type tx_pattern: `str`, `~x6.utils.PRIPattern`, `~x6.utils.PRIPatternParser` or None
     :param tx_velofile: The filename of a velofile containing the tx analog
         output, e.g., as output by `~x6.process_waveform.waveform_to_velo`
     :type tx_velofile: `str` or None
@@ -124,16 +124,17 @@ def pri_pattern_to_lines(active_channels, rx_pattern=None, tx_pattern=None, tx_v
         2^15-1
     """
     
-    # get the waveform of each tx channel. Note that this might take up a
-    # whole lot of memory.
-    waveform_dict = pw.velo_to_waveform(active_channels, tx_velofile)
+    # get the waveform of each tx channel. These are views onto a
+    # memory-mapped decoding of the velo file, so that previewing does not
+    # pull every channel into memory.
+    waveform_dict = pw.velo_to_waveform(active_channels, tx_velofile, lazy=True)
     
     # allow the patterns to be strings pointing to pattern files
     patterns = [rx_pattern, tx_pattern]
     if isinstance(rx_pattern, str) or isinstance(rx_pattern, unicode):
-        patterns[0] = PRIPatternParser(rx_pattern)
+        patterns[0] = PRIPattern(rx_pattern)
     if isinstance(tx_pattern, str) or isinstance(tx_pattern, unicode):
-        patterns[1] = PRIPatternParser(tx_pattern)
+        patterns[1] = PRIPattern(tx_pattern)
     
     # we will first parse the pattern files and figure out the delays
     # and widths (ie. "pulses") on each tx and rx channel
@@ -190,9 +191,9 @@ def plot_pri_pattern(sample_rate, active_channels, rx_pattern=None, tx_pattern=N
         the x axis.
     :type sample_rate: Any kind of number, units of MHz.
     :param  rx_pattern: A pattern to be interpretted as the RX line.
-    :type rx_pattern: `str` or `~x6.pulprog.PRIPatternParser` or None
+    :type rx_pattern: `str`, `~x6.utils.PRIPattern`, `~x6.utils.PRIPatternParser` or None
     :param  tx_pattern: A pattern to be interpretted as the RX line.
-    :type tx_pattern: `str` or `~x6.pulprog.PRIPatternParser` or None
+    :type tx_pattern: `str`, `~x6.utils.PRIPattern`, `~x6.utils.PRIPatternParser` or None
     :param tx_velofile: The filename of a velofile containing the tx analog
         output, e.g., as output by `~x6.process_waveform.waveform_to_velo`
     :type tx_velofile: `str` or None
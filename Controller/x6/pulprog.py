@@ -14,6 +14,9 @@ from __future__ import division
 ## IMPORTS #####################################################################
 
 import os, sys
+import time
+import json
+import multiprocessing
 import numpy as np
 import pyparsing as pp
 import tempfile
@@ -31,22 +34,22 @@ except ImportError:
 
 from x6 import TX_CHANNELS, CHANNEL_PRI_CODES
 from x6 import pulplot
-from x6.process_waveform import Waveform, IQWaveform, waveform_to_velo, rewind_write, apply_phase
-from x6.utils import PRIPatternParser, validate_active_channels, find_on_path
+from x6.xpp_types import (
+    UNIT_VALUES, Time, Identifier, Expression, Resolvable, Channel, IQChannel,
+    PhaseList, PhaseRegistry, WaveformLiteral, IQWaveformLiteral, resolve_sym
+)
+from x6 import xpp_parser, parse_cache
+import x6.timeline as tl
+import x6.compile_profile as cprof
+import x6.build_record as br
+from x6.process_waveform import (
+    Waveform, IQWaveform, WaveformBuffer, waveform_to_velo, rewind_write, apply_phase,
+    WAVEFORM_BUFFER_MEMORY
+)
+from x6.utils import PRIPattern, validate_active_channels
+from x6.include_resolver import IncludeResolver
 import x6.utils as u
 
-## UNITS #######################################################################
-# We define units such as seconds abstractly so that we can easily change
-# scales.
-
-UNIT_VALUES = {
-    's':  1e6,
-    'ms': 1e3,
-    'us': 1e0,
-    'ns': 1e-3,
-    'ps': 1e-6
-}
-
 ## HELPER FUNCTIONS ############################################################
 
 def mk_namespace_dict(from_dict):
@@ -95,191 +98,6 @@ def fn_like_literal(keyword, inner_pattern, return_type):
         returner
     )
 
-def resolve_sym(sym, namespace):
-    if isinstance(sym, Identifier):
-        if sym in namespace:
-            return namespace[sym]
-        else:
-            raise KeyError("Variable {} has not been defined.".format(sym.name))
-    else:
-        return sym    
-        
-
-## CLASSES #####################################################################
-
-class Time(object):
-    def __init__(self, time):
-        self._time = time
-        
-    def __str__(self):
-        return "{} s".format(str(self._time/ UNIT_VALUES['s']))
-        
-    def __repr__(self):
-        return "<Time {} s>".format(self.time)
-        
-    @property
-    def time(self):
-        return self._time / UNIT_VALUES['s']
-        
-class Identifier(object):
-    """
-    Represents an identifier used as the name of a variable.
-    """
-    
-    def __init__(self, name):
-        self._name = name
-        
-    def __repr__(self):
-        return "<Identifier {}>".format(self.name)
-        
-    @property
-    def name(self):
-        return self._name
-        
-    def __hash__(self):
-        return hash(self.name)
-        
-    def __eq__(self, other):
-        if isinstance(other, Identifier):
-            return self.name == other.name
-        else:
-            return False
-
-class Resolvable(object):
-    """
-    Base class for object types that need identifiers resolved for them.
-    """
-    def _resolve_(self, namespace):
-        return NotImplemented
-        
-class Channel(object):
-    """
-    Represents either an analog or digital channel associated with a given
-    pinout name.
-    """
-
-    def __init__(self, pin_name, analog):
-        self._pin_name = pin_name
-        if isinstance(analog, str):
-            self._analog = analog == "analog"
-        else:
-            self._analog = bool(analog)
-            
-    @property
-    def analog(self):
-        return self._analog
-        
-    @property
-    def pri_code(self):
-        """
-        Returns the bitmask used as a PRI destination code when sending output
-        to or recieving input from this channel.
-        
-        :type: `int`
-        """
-        return CHANNEL_PRI_CODES[self._pin_name]
-        
-    @property
-    def is_rx(self):
-        """
-        `True` if and only if the pin for this channel is controlled by the
-        RX PRI settings on the X6 board.
-        
-        .. note::
-            This does not necessarily mean that the pin is used to recieve data,
-            but only that the pin is configured via the reciever settings.
-        """
-        return not self.is_tx
-        
-    @property
-    def is_tx(self):
-        """
-        `True` if and only if the pin for this channel is controlled by the
-        TX PRI settings on the X6 board.
-        
-        .. note::
-            This does not necessarily mean that the pin is used to transmit data,
-            but only that the pin is configured via the transmitter settings.
-        """
-        return self._pin_name in TX_CHANNELS
-            
-    def __str__(self):
-        return "{} [{}]".format(self._pin_name, "analog" if self.analog else "digital")
-        
-    def __repr__(self):
-        return "<Channel {}>".format(str(self))
-
-class IQChannel(Channel, Resolvable):
-    """
-    Subclass of `Channel` representing the pairing of two channels into
-    a single logical channel with in-phase and quadrature parts.
-    """
-    def __init__(self, ch_i, ch_q):
-        self._ch_i = ch_i
-        self._ch_q = ch_q
-
-    def _resolve_(self, namespace):
-        if isinstance(self._ch_i, Identifier):
-            self._ch_i = namespace[self._ch_i]
-        if isinstance(self._ch_q, Identifier):
-            self._ch_q = namespace[self._ch_q]
-        if self._ch_i._pin_name == self._ch_q._pin_name:
-            raise ValueError('Different TX channels must be used in an IQChannel.')
-        if not self._ch_i.analog or not self._ch_q.analog:
-            raise ValueError('Both channels in an IQChannel must be analog channels.')
-
-    @property
-    def resolved(self):
-        return not (isinstance(self._ch_i, Identifier) or isinstance(self._ch_q, Identifier))
-
-    @property
-    def analog(self): return True
-
-    @property
-    def is_tx(self): return True
-
-    @property
-    def pri_code(self):
-        if self.resolved:
-            return self._ch_i.pri_code | self._ch_q.pri_code
-        else:
-            return None
-
-    def __repr__(self):
-        if self.resolved:
-            return "<IQChannel I = {}, Q = {}>".format(
-                self._ch_i._pin_name, self._ch_q._pin_name
-            )
-        else:
-            return "<IQChannel I = {}, Q = {} [unresolved]>".format(
-                self._ch_i, self._ch_q
-            )
-
-    def __str__(self):
-        return "(I={}, Q={}) [iq]".format(
-            self._ch_i, self._ch_q
-        )
-       
-class PhaseList(object):
-    def __init__(self, phases, n_parts):
-        self._phases = phases
-        self._n_parts = n_parts
-        self._idx = 0
-        
-    def __str__(self):
-        return str(self._phases) + " / " + str(self._n_parts)
-        
-    def __repr__(self):
-        return "<PhaseList {}>".format(str(self))
-        
-    @property
-    def cur(self):
-        return (self._phases[self._idx], self._n_parts)
-        
-    def ipp(self):
-        self._idx = (self._idx + 1) % len(self._phases)
-        
-
 ## GRAMMAR #####################################################################
 
 # Disable newlines as a whitespace character.
@@ -500,11 +318,61 @@ class CompilationVisitor(object):
         """
         pass
         
+    def visit_pulses(self, state, pulses):
+        """
+        Called with all of the pulses of a pulse statement at once, as a
+        list of ``(channels, t, n_samp, waveform, phase)`` tuples in the
+        order in which they appear. Pulses from the same pulse sentence
+        share the same list of channels.
+        
+        By default, each pulse is passed to `visit_pulseexpr`. Visitors may
+        override this to handle the pulses together.
+        """
+        for channels, t, n_samp, waveform, phase in pulses:
+            self.visit_pulseexpr(state, channels, t, n_samp, waveform, phase)
+        
     def visit_option(self, state, opt_name, opt_value):
         """
         Called on every option statement in the XPP
         """
         pass
+        
+    def visit_advance(self, state, t_start, ends):
+        """
+        Called once each pulse statement has been evaluated, with the time
+        at which it started and the time at which each of its pulse
+        sentences ended. The statement advances the time to the latest of
+        these, or leaves it at ``t_start`` if none is later.
+        
+        Within a repeat block whose iterations are all identical, this is
+        called for the first iteration only.
+        """
+        pass
+        
+    def visit_repeat(self, state, pulses, period, how_many):
+        """
+        Called for a repeat block whose iterations are all identical, apart
+        from being shifted in time. ``pulses`` is a list of
+        ``(channels, t, n_samp, waveform, phase)`` tuples describing the
+        first iteration, and the ``k``-th iteration consists of the same
+        pulses delayed by ``k * period`` samples.
+        
+        By default, each pulse of each iteration is passed to
+        `visit_pulseexpr`. Visitors may override this to handle the whole
+        block at once.
+        """
+        for idx in xrange(how_many):
+            offset = idx * period
+            for channels, t, n_samp, waveform, phase in pulses:
+                self.visit_pulseexpr(state, channels, t + offset, n_samp, waveform, phase)
+    
+    def visit_timeline(self, state, timeline):
+        """
+        Called by `~x6.pulprog.compile_timeline` with all of the pulses
+        of an already compiled `~x6.timeline.Timeline`. By default, each
+        pulse is passed to `visit_pulseexpr`.
+        """
+        timeline.replay(self, state, options=False)
     
     def declare_final_options(self):
         """
@@ -536,22 +404,50 @@ class PrintVisitor(CompilationVisitor):
             t, n_samp, waveform, phase
         )
 
+class RepeatRecorder(CompilationVisitor):
+    """
+    Visitor that records the pulses of one iteration of a repeat block, so
+    that the compiler can pass the whole block to
+    `~x6.pulprog.CompilationVisitor.visit_repeat`.
+    
+    :param visitor: Visitor to which the advances of the statements in the
+        block are passed on as they are evaluated.
+    """
+    def __init__(self, visitor=None):
+        self.pulses = []
+        self._visitor = visitor
+        
+    def visit_advance(self, state, t_start, ends):
+        if self._visitor is not None:
+            self._visitor.visit_advance(state, t_start, ends)
+        
+    def visit_pulseexpr(self, state, channels, t, n_samp, waveform, phase):
+        self.pulses.append((channels, t, n_samp, waveform, phase))
+        
+    def visit_pulses(self, state, pulses):
+        self.pulses.extend(pulses)
+
 ## VISITORS FOR BUILD STEPS ####################################################
 
 class WaveformBuilderVisitor(CompilationVisitor):
     """
     Visitor that builds a set of waveform files into a Velocia packet stream
     for streaming to an X6-1000M board.
+    
+    The samples of each DA channel are kept in a
+    `~x6.process_waveform.WaveformBuffer`, and are only written to disk if
+    they would need more than the given memory budget.
+    
+    :param str filename: Name of the Velo file to write.
+    :param int memory_limit: Number of bytes that the samples of all four
+        channels may take in memory, or `None` for no limit.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, memory_limit=WAVEFORM_BUFFER_MEMORY):
         self.filename = filename
-        self.waveform_files = [tempfile.TemporaryFile(),
-                          tempfile.TemporaryFile(),
-                          tempfile.TemporaryFile(),
-                          tempfile.TemporaryFile()]
+        channel_limit = memory_limit // 4 if memory_limit is not None else None
         self.waveforms = {
-                            "DA{}".format(idx):Waveform(f) 
-                            for idx, f in enumerate(self.waveform_files)
+                            "DA{}".format(idx):WaveformBuffer(channel_limit) 
+                            for idx in range(4)
                          }
         self._has_written = False
         
@@ -578,10 +474,12 @@ class WaveformBuilderVisitor(CompilationVisitor):
         if not isinstance(iqwaveform, IQWaveform):
             raise ValueError("Expecting an IQWaveform on IQChannel {}, but recieved something else instead, of type {}.".format(str(iqchannel), type(iqwaveform)))
         
-        rotated_iqwaveform = apply_phase(iqwaveform, phase)
+        with cprof.section('apply_phase'):
+            rotated_iqwaveform = apply_phase(iqwaveform, phase)
         
-        rewind_write(self.waveforms[pin_name_i], rotated_iqwaveform.waveform_i, n_samp)
-        rewind_write(self.waveforms[pin_name_q], rotated_iqwaveform.waveform_q, n_samp)
+        with cprof.section('rewind_write'):
+            rewind_write(self.waveforms[pin_name_i], rotated_iqwaveform.waveform_i, n_samp)
+            rewind_write(self.waveforms[pin_name_q], rotated_iqwaveform.waveform_q, n_samp)
         
         if n_samp > 0:
             self._has_written = True
@@ -589,11 +487,12 @@ class WaveformBuilderVisitor(CompilationVisitor):
     def _build_analog_channel(self, channel, n_samp, waveform):
         # in this case append n_samp of data to the correct DA channel
         pin_name = channel._pin_name
-        if isinstance(waveform, IQWaveform):
-            rewind_write(self.waveforms[pin_name], waveform.waveform_i, n_samp)
-            warnings.warn("Received an IQWaveform instead of a Waveform on channel {}. Proceeding anyway using the I channel of the IQWaveform.".format(str(channel)))
-        else:
-            rewind_write(self.waveforms[pin_name], waveform, n_samp)
+        with cprof.section('rewind_write'):
+            if isinstance(waveform, IQWaveform):
+                rewind_write(self.waveforms[pin_name], waveform.waveform_i, n_samp)
+                warnings.warn("Received an IQWaveform instead of a Waveform on channel {}. Proceeding anyway using the I channel of the IQWaveform.".format(str(channel)))
+            else:
+                rewind_write(self.waveforms[pin_name], waveform, n_samp)
             
         if n_samp > 0:
             self._has_written = True
@@ -602,6 +501,24 @@ class WaveformBuilderVisitor(CompilationVisitor):
     def _build_digital_channel(self, channel, n_samp):
         # nothing to do here
         pass
+        
+    def visit_repeat(self, state, pulses, period, how_many):
+        # Samples are appended to each channel one pulse after another, so
+        # every iteration appends the same samples. We therefore build the
+        # first iteration as usual, and then tile what it appended.
+        starts = {pin: wf.length for pin, wf in self.waveforms.items()}
+        for channels, t, n_samp, waveform, phase in pulses:
+            self.visit_pulseexpr(state, channels, t, n_samp, waveform, phase)
+            
+        for pin, wf in self.waveforms.items():
+            n_iteration = wf.length - starts[pin]
+            if n_iteration == 0 or how_many <= 1:
+                continue
+            wf.seek(starts[pin])
+            iteration = Waveform(wf.get_chunk(n_iteration))
+            wf.seek(0, 2)
+            with cprof.section('rewind_write'):
+                rewind_write(wf, iteration, n_iteration * (how_many - 1))
     
     def declare_final_options(self):
         if self._has_written:
@@ -615,18 +532,19 @@ class WaveformBuilderVisitor(CompilationVisitor):
     def post_compilation(self, sample_rate, active_channels, extra_options, peripheral_id):
         if self._has_written:
             # we need to convert the four channels into a single velo file
-            waveform_to_velo(
-                active_channels, 
-                self.filename, 
-                waveform0=self.waveforms['DA0'],
-                waveform1=self.waveforms['DA1'],
-                waveform2=self.waveforms['DA2'],
-                waveform3=self.waveforms['DA3'], 
-                peripheral_id=peripheral_id, 
-                rewind=True
-            )
-        for f in self.waveform_files:
-            f.close()
+            with cprof.section('waveform_to_velo'):
+                waveform_to_velo(
+                    active_channels, 
+                    self.filename, 
+                    waveform0=self.waveforms['DA0'],
+                    waveform1=self.waveforms['DA1'],
+                    waveform2=self.waveforms['DA2'],
+                    waveform3=self.waveforms['DA3'], 
+                    peripheral_id=peripheral_id, 
+                    rewind=True
+                )
+        for wf in self.waveforms.values():
+            wf.close()
         
 class PulseConfigurationVisitor(CompilationVisitor):
     """
@@ -652,6 +570,13 @@ class PulseConfigurationVisitor(CompilationVisitor):
     def visit_option(self, state, opt_name, opt_value):
         self._pulse_config.set(self._pulse_name, opt_name, str(opt_value))
         
+    def visit_repeat(self, state, pulses, period, how_many):
+        # The pulse configuration does not depend on individual pulses.
+        pass
+        
+    def visit_timeline(self, state, timeline):
+        pass
+        
     def post_compilation(self, sample_rate, active_channels, extra_options, peripheral_id):
         self._pulse_config.set(self._pulse_name, 'tx_active_channels', ", ".join(map(str, active_channels)))
         self._pulse_config.set(self._pulse_name, 'sample_rate', str(sample_rate))
@@ -662,48 +587,130 @@ class PulseConfigurationVisitor(CompilationVisitor):
             self._pulse_config.write(f)      
             
 
+class PRIEntryBuffer(object):
+    """
+    Collects the entries of a PRI pattern during compilation. Entries are
+    kept in the order in which they are first added, and later duplicates
+    are dropped using a set, so that each addition takes constant time.
+    
+    :param entries: Initial ``(destination, delay, width)`` entries.
+    """
+    def __init__(self, entries=()):
+        self._seen = set()
+        self._entries = []
+        self.extend(entries)
+        
+    def __len__(self):
+        return len(self._entries)
+        
+    def __contains__(self, entry):
+        return entry in self._seen
+        
+    def add(self, destination, delay, width):
+        entry = (destination, delay, width)
+        if entry not in self._seen:
+            self._seen.add(entry)
+            self._entries.append(entry)
+            
+    def extend(self, entries):
+        """
+        Adds each of a sequence of ``(destination, delay, width)`` entries,
+        or each row of an array of `~x6.timeline.PRI_ENTRY_DTYPE`.
+        """
+        if isinstance(entries, np.ndarray):
+            entries = tl.first_occurrences(entries).tolist()
+        for entry in entries:
+            self.add(*entry)
+            
+    def to_array(self):
+        """
+        Returns the entries as an array of `~x6.timeline.PRI_ENTRY_DTYPE`.
+        """
+        return np.array(self._entries, dtype=tl.PRI_ENTRY_DTYPE)
+
 class PRIPatternVisitor(CompilationVisitor):
     """
     Visitor that writes to a pair of PRI pattern files.
+    
+    Entries are collected in a `~x6.pulprog.PRIEntryBuffer` for each
+    pattern, and the patterns are only written out by `post_compilation`.
     """
     
     def __init__(self, rx_pattern_filename, tx_pattern_filename):
-        self._rx_pattern = PRIPatternParser(rx_pattern_filename)
-        self._tx_pattern = PRIPatternParser(tx_pattern_filename)
+        self._rx_pattern = PRIPattern(rx_pattern_filename)
+        self._tx_pattern = PRIPattern(tx_pattern_filename)
+        
+        # Start from whatever the pattern files already contain.
+        self._rx_entries = PRIEntryBuffer(self._rx_pattern.get_all_pulses())
+        self._tx_entries = PRIEntryBuffer(self._tx_pattern.get_all_pulses())
         
         self._has_set_rx_enable_pri = False
         self._has_set_tx_enable_pri = False
         
+        # PRI destinations of each channel set seen, keyed by the identities
+        # of its channels; see _channel_codes.
+        self._codes = {}
+        
     def write(self):
-        self._rx_pattern.write()
-        self._tx_pattern.write()
+        for pattern, entries in ((self._rx_pattern, self._rx_entries), (self._tx_pattern, self._tx_entries)):
+            array = entries.to_array()
+            pattern.clear()
+            pattern.extend(array['destination'], array['delay'], array['width'])
+            with cprof.section('write PRI pattern'):
+                pattern.write()
+
+    def _channel_codes(self, channels):
+        # Returns the RX and TX PRI destinations of a channel set as
+        # bitmasks, with -1 for a set with no channels of that kind. The
+        # channels are kept along with their codes, so that their identities
+        # stay unique.
+        key = tuple(map(id, channels))
+        codes = self._codes.get(key)
+        if codes is None:
+            codes = self._codes[key] = (
+                tl.Timeline._pri_code(channels, True), tl.Timeline._pri_code(channels, False), tuple(channels)
+            )
+        return codes
 
     def visit_pulseexpr(self, state, channels, t, n_samp, waveform, phase):
+        self.visit_pulses(state, [(channels, t, n_samp, waveform, phase)])
         
-        # this helper function writes a length n_samp pulse at time t
-        # to the given pattern, deducing the correct pri code from the 
-        # channel list
-        def append_to_patterns(pattern, channel_list):
-            if len(channel_list) > 0:
-                pri_code = reduce(
-                    lambda a, b: a | b,
-                    [ch.pri_code for ch in channel_list]
-                )
-                if (pri_code, t, n_samp) not in pattern.get_all_pulses():
-                    pattern.append_pulse(pri_code, t, n_samp)
+    def visit_pulses(self, state, pulses):
+        # Each pulse adds an entry to the RX pattern for its RX channels, and
+        # to the TX pattern for its TX channels.
+        rx_entries, tx_entries = self._rx_entries, self._tx_entries
+        for channels, t, n_samp, waveform, phase in pulses:
+            rx_code, tx_code, _ = self._channel_codes(channels)
+            if rx_code >= 0:
+                rx_entries.add(rx_code, t, n_samp)
+            if tx_code >= 0:
+                tx_entries.add(tx_code, t, n_samp)
         
-        rx_channels = []
-        tx_channels = []
-
-        # sort the channels into rx and tx
-        for channel in channels:
-            if channel.is_rx:
-                rx_channels.append(channel)
-            else:
-                tx_channels.append(channel)
-           
-        append_to_patterns(self._rx_pattern, rx_channels)
-        append_to_patterns(self._tx_pattern, tx_channels)
+    def visit_repeat(self, state, pulses, period, how_many):
+        # Build the entries of every iteration at once by offsetting the
+        # times of the first iteration. The tx/rx count and period options
+        # cannot stand in for the repeat: they repeat the whole pattern on
+        # each trigger, with the count already set for averaging (as by
+        # single_pulse.py), and the DAC waveform must be written out in
+        # full either way.
+        if not pulses:
+            return
+        offsets = np.arange(how_many, dtype=np.int64) * period
+        for entries, rx in ((self._rx_entries, True), (self._tx_entries, False)):
+            codes = [tl.Timeline._pri_code(channels, rx) for channels, _, _, _, _ in pulses]
+            iteration = np.array([
+                (code, t, n_samp)
+                for code, (_, t, n_samp, _, _) in zip(codes, pulses) if code >= 0
+            ], dtype=tl.PRI_ENTRY_DTYPE)
+            if len(iteration) == 0:
+                continue
+            block = np.tile(iteration, how_many)
+            block['delay'] += np.repeat(offsets, len(iteration))
+            entries.extend(block)
+            
+    def visit_timeline(self, state, timeline):
+        self._rx_entries.extend(timeline.pri_entries(rx=True))
+        self._tx_entries.extend(timeline.pri_entries(rx=False))
         
     def visit_option(self, state, opt_name, opt_value):
         # keep track of whether or not the user has explictly enabled/disabled
@@ -719,9 +726,9 @@ class PRIPatternVisitor(CompilationVisitor):
             'tx_pattern_file': os.path.basename(self._tx_pattern._filename),
         }
         if not self._has_set_rx_enable_pri:
-            final_options['rx_enable_pri'] = str(self._rx_pattern.get_array_size() > 0)
+            final_options['rx_enable_pri'] = str(len(self._rx_entries) > 0)
         if not self._has_set_tx_enable_pri:
-            final_options['tx_enable_pri'] = str(self._tx_pattern.get_array_size() > 0)
+            final_options['tx_enable_pri'] = str(len(self._tx_entries) > 0)
         return final_options
         
     def post_compilation(self, sample_rate, active_channels, extra_options, peripheral_id):
@@ -750,6 +757,25 @@ class StateVisitor(CompilationVisitor):
         for idx, da_pin in enumerate(TX_CHANNELS[:4]):
             if da_pin in channel_pins:
                 state['active_channels'][idx] = True
+                
+    def visit_pulses(self, state, pulses):
+        # Pulses from the same sentence share their list of channels, which
+        # need only be looked at once.
+        last = None
+        for channels, t, n_samp, waveform, phase in pulses:
+            if channels is not last:
+                self.visit_pulseexpr(state, channels, t, n_samp, waveform, phase)
+                last = channels
+                
+    def visit_repeat(self, state, pulses, period, how_many):
+        # Every iteration uses the same channels.
+        self.visit_pulses(state, pulses)
+            
+    def visit_timeline(self, state, timeline):
+        used_pins = timeline.used_pins()
+        for idx, da_pin in enumerate(TX_CHANNELS[:4]):
+            if da_pin in used_pins:
+                state['active_channels'][idx] = True
         
     def visit_option(self, state, opt_name, opt_value):
         # two options are given special treatment
@@ -763,12 +789,133 @@ class StateVisitor(CompilationVisitor):
             state['override_tx_enable_pri'] = True
 
         
+class TimelineVisitor(CompilationVisitor):
+    """
+    Visitor that records every pulse and option into a
+    `~x6.timeline.Timeline`, available as ``timeline`` once compilation
+    has finished.
+
+    Channel sets, waveforms and phases are recorded once per distinct
+    object, so that a waveform played many times appears once in the
+    waveform table.
+    """
+    def __init__(self):
+        # Rows are collected in a list and moved into an array in _blocks
+        # whenever a repeat block is added as a whole.
+        self._rows = []
+        self._blocks = []
+        self._n_flushed = 0
+        self._options = []
+        self._channel_sets = []
+        self._channel_set_idx = {}
+        self._channel_masks = []
+        self._waveforms = []
+        self._waveform_idx = {}
+        self._phases = []
+        self._phase_idx = {}
+        self.timeline = None
+
+    def _intern(self, table, index, key, value):
+        idx = index.get(key)
+        if idx is None:
+            idx = index[key] = len(table)
+            table.append(value)
+        return idx
+
+    def _channel_set(self, channels):
+        channels = tuple(channels)
+        ch_key = tuple(map(id, channels))
+        ch_idx = self._channel_set_idx.get(ch_key)
+        if ch_idx is None:
+            ch_idx = self._intern(self._channel_sets, self._channel_set_idx, ch_key, channels)
+            self._channel_masks.append(sum(
+                tl.CHANNEL_BITS[pin] for pin in set(pin for ch in channels for pin in tl.channel_pins(ch))
+            ))
+        return ch_idx
+
+    def visit_pulseexpr(self, state, channels, t, n_samp, waveform, phase):
+        ch_idx = self._channel_set(channels)
+        self._rows.append((
+            t, n_samp, self._channel_masks[ch_idx], ch_idx,
+            self._intern(self._waveforms, self._waveform_idx, id(waveform), waveform),
+            self._intern(self._phases, self._phase_idx, phase, phase)
+        ))
+
+    def visit_pulses(self, state, pulses):
+        # Pulses from the same sentence share their list of channels, which
+        # need only be looked up once.
+        rows, intern = self._rows, self._intern
+        last = None
+        for channels, t, n_samp, waveform, phase in pulses:
+            if channels is not last:
+                ch_idx = self._channel_set(channels)
+                mask = self._channel_masks[ch_idx]
+                last = channels
+            rows.append((
+                t, n_samp, mask, ch_idx,
+                intern(self._waveforms, self._waveform_idx, id(waveform), waveform),
+                intern(self._phases, self._phase_idx, phase, phase)
+            ))
+
+    def _flush_rows(self):
+        if self._rows:
+            self._blocks.append(np.array(self._rows, dtype=tl.TIMELINE_DTYPE))
+            self._n_flushed += len(self._rows)
+            self._rows = []
+
+    def visit_repeat(self, state, pulses, period, how_many):
+        self._flush_rows()
+        for channels, t, n_samp, waveform, phase in pulses:
+            self.visit_pulseexpr(state, channels, t, n_samp, waveform, phase)
+        iteration = np.array(self._rows, dtype=tl.TIMELINE_DTYPE)
+        self._rows = []
+        
+        block = np.tile(iteration, how_many)
+        block['t'] += np.repeat(np.arange(how_many, dtype=np.int64) * period, len(iteration))
+        self._blocks.append(block)
+        self._n_flushed += len(block)
+
+    def visit_option(self, state, opt_name, opt_value):
+        self._options.append((self._n_flushed + len(self._rows), opt_name, opt_value))
+
+    def post_compilation(self, sample_rate, active_channels, extra_options, peripheral_id):
+        self._flush_rows()
+        entries = np.concatenate(self._blocks) if self._blocks else np.empty(0, dtype=tl.TIMELINE_DTYPE)
+        self.timeline = tl.Timeline(
+            entries,
+            self._channel_sets, self._waveforms, self._phases, self._options,
+            sample_rate=sample_rate, active_channels=active_channels
+        )
+
+class FinalOptionsVisitor(CompilationVisitor):
+    """
+    Visitor that only declares the given final options, standing in for a
+    visitor whose outputs were reused rather than rebuilt; see
+    `~x6.pulprog.compile_incremental`.
+    """
+    def __init__(self, options):
+        self._options = dict(options)
+        
+    def visit_timeline(self, state, timeline):
+        pass
+        
+    def declare_final_options(self):
+        return dict(self._options)
+
 class MultiVisitor(object):
     """
     Visitor that calls each of a sequence of other visitors in turn.
+    
+    :param bool parallel: If `True`, the post compilation steps of the
+        visitors run concurrently, each in its own thread. This must only be
+        used for visitors whose post compilation steps are independent, such
+        as those that each write their own output file.
     """
-    def __init__(self, *visitors):
+    def __init__(self, *visitors, **kwargs):
         self._visitors = visitors
+        self._parallel = kwargs.pop('parallel', False)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments: {}.".format(", ".join(sorted(kwargs))))
         
     def visit_option(self, state, opt_name, opt_value):
         for visitor in self._visitors:
@@ -778,6 +925,22 @@ class MultiVisitor(object):
         for visitor in self._visitors:
             visitor.visit_pulseexpr(state, channels, t, n_samp, waveform, phase)
             
+    def visit_pulses(self, state, pulses):
+        for visitor in self._visitors:
+            visitor.visit_pulses(state, pulses)
+            
+    def visit_advance(self, state, t_start, ends):
+        for visitor in self._visitors:
+            visitor.visit_advance(state, t_start, ends)
+            
+    def visit_repeat(self, state, pulses, period, how_many):
+        for visitor in self._visitors:
+            visitor.visit_repeat(state, pulses, period, how_many)
+            
+    def visit_timeline(self, state, timeline):
+        for visitor in self._visitors:
+            visitor.visit_timeline(state, timeline)
+            
     def declare_final_options(self):
         options = {}
         # join together the options from all sub visitors
@@ -789,62 +952,219 @@ class MultiVisitor(object):
         """
         Runs a post compilation function on each visitor.
         """
-        for visitor in self._visitors:
-            visitor.post_compilation(sample_rate, active_channels, extra_options, peripheral_id)
+        if self._parallel:
+            u.call_in_threads([
+                (lambda visitor=visitor: visitor.post_compilation(sample_rate, active_channels, extra_options, peripheral_id))
+                for visitor in self._visitors
+            ])
+        else:
+            for visitor in self._visitors:
+                visitor.post_compilation(sample_rate, active_channels, extra_options, peripheral_id)
             
-def build_all_visitor(folder_name):
+def build_all_visitor(folder_name, waveform_memory=WAVEFORM_BUFFER_MEMORY):
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
         
+    # Each visitor writes its own files, so the files are written
+    # concurrently.
     return MultiVisitor(
         PRIPatternVisitor(
             os.path.join(folder_name, 'rx.pattern'),
             os.path.join(folder_name, 'tx.pattern')
         ),
         WaveformBuilderVisitor(
-            os.path.join(folder_name, 'waveform.velo')
+            os.path.join(folder_name, 'waveform.velo'),
+            memory_limit=waveform_memory
         ),
         PulseConfigurationVisitor(
             os.path.join(folder_name, 'pulse.pulse')
         ),
-        StateVisitor()
+        StateVisitor(),
+        parallel=True
     )
 
-## COMPILER ####################################################################
+#: Board that channels belong to if their pin names do not name one.
+DEFAULT_BOARD = 'board0'
 
-def compile_program(source, pulse_visitor, namespace=None, state=None, peripheral_id=0, is_include=False, debug=False):
+def channel_board(channel):
     """
-    Given an **xpulprog**-language source file, calls a `visitor`_
-    for each pulse instruction in the compiled program. Most users will not
-    run this function directly, but will use one of the higher-level compiler
-    front-ends, such as `compile_to_directory`.
+    Returns the name of the board that a channel is on.
+    """
+    return channel.board if channel.board is not None else DEFAULT_BOARD
+
+class BoardRouterVisitor(CompilationVisitor):
+    """
+    Visitor that partitions a program between several X6 boards, passing
+    each pulse to the visitor for the board of its channels. A pulse
+    sentence whose channels are on several boards is split into one pulse
+    per board, and options are passed to every board.
     
-    :param str source: Source code for the pulse program to be compiled.
-    :param CompilationVisitor pulse_visitor: A `visitor`_ that will observe
-        pulse expressions, option statements, etc.
-        See `~x6.pulprog.PrintVisitor` for an example.
-    :param dict namespace: A mapping from `~x6.pulprog.Identifier` instances
-        to values for each variable.
-    :param dict state: Initial state of the compiler, containing zero or more
-        of the keys ``t``, ``sample_rate``, ``active_channels`` and
-        ``override_active_channels``.
-    :param bool debug: If `True`, extra debugging information will be printed
-        during compilation.
+    Each board has its own state, which records the sample rate and active
+    channels of that board. Visitors are made for each board the first time
+    that it is used, and are then given every option seen so far.
     
-        
-    .. _visitor: http://en.wikipedia.org/wiki/Visitor_pattern
+    After compilation, the post-compilation steps of the boards, such as
+    building their waveforms and PRI patterns, run in parallel threads.
     
+    :param callable make_visitor: Called with the name of a board to make
+        the visitor for that board.
+    :param callable peripheral_id: Called with the name of a board to find
+        its peripheral ID.
+    :param list boards: Names of boards to make visitors for up front,
+        whether or not the program uses them.
     """
+    def __init__(self, make_visitor, peripheral_id, boards=()):
+        self._make_visitor = make_visitor
+        self._peripheral_id = peripheral_id
+        self._options = []
+        self.visitors = {}
+        self.states = {}
+        self.boards = []
+        for board in boards:
+            self._board(board)
+            
+    def _board(self, board):
+        if board not in self.visitors:
+            visitor = self.visitors[board] = self._make_visitor(board)
+            state = self.states[board] = init_state()
+            self.boards.append(board)
+            for opt_name, opt_value in self._options:
+                visitor.visit_option(state, opt_name, opt_value)
+        return self.visitors[board], self.states[board]
+        
+    def _partition(self, channels):
+        # Returns the channels on each board, with the boards in the order
+        # in which their channels first appear.
+        by_board = {}
+        boards = []
+        for channel in channels:
+            board = channel_board(channel)
+            if board not in by_board:
+                by_board[board] = []
+                boards.append(board)
+            by_board[board].append(channel)
+        return [(board, by_board[board]) for board in boards]
+        
+    def _board_state(self, board, state):
+        visitor, board_state = self._board(board)
+        board_state['t'] = state['t']
+        return visitor, board_state
+        
+    def visit_pulseexpr(self, state, channels, t, n_samp, waveform, phase):
+        for board, board_channels in self._partition(channels):
+            visitor, board_state = self._board_state(board, state)
+            visitor.visit_pulseexpr(board_state, board_channels, t, n_samp, waveform, phase)
+            
+    def _partition_pulses(self, pulses):
+        # As _partition, but for a list of pulses.
+        by_board = {}
+        boards = []
+        for channels, t, n_samp, waveform, phase in pulses:
+            for board, board_channels in self._partition(channels):
+                if board not in by_board:
+                    by_board[board] = []
+                    boards.append(board)
+                by_board[board].append((board_channels, t, n_samp, waveform, phase))
+        return [(board, by_board[board]) for board in boards]
+        
+    def visit_pulses(self, state, pulses):
+        for board, board_pulses in self._partition_pulses(pulses):
+            visitor, board_state = self._board_state(board, state)
+            visitor.visit_pulses(board_state, board_pulses)
+            
+    def visit_repeat(self, state, pulses, period, how_many):
+        for board, board_pulses in self._partition_pulses(pulses):
+            visitor, board_state = self._board_state(board, state)
+            visitor.visit_repeat(board_state, board_pulses, period, how_many)
+            
+    def visit_option(self, state, opt_name, opt_value):
+        self._options.append((opt_name, opt_value))
+        for board in self.boards:
+            self.visitors[board].visit_option(self.states[board], opt_name, opt_value)
+            
+    def post_compilation(self, sample_rate, active_channels, extra_options, peripheral_id):
+        """
+        Runs the post compilation steps of every board in parallel. The
+        arguments, which describe the program as a whole, are ignored in
+        favour of those of each board.
+        """
+        def post_compile(board):
+            visitor, state = self.visitors[board], self.states[board]
+            return lambda: visitor.post_compilation(
+                state_sample_rate(state), state_active_channels(state),
+                visitor.declare_final_options(), self._peripheral_id(board)
+            )
+        u.call_in_threads([post_compile(board) for board in self.boards])
 
-    if namespace is None:
-        namespace = {}
-    
-    if debug == "return":
-        stmts = []
-    
-    # We cannot modify, e.g.,  the local variable `t` from within the closure
-    # below, so encapsulating it in a mutable datatype allows
-    # for information to be shared across the closure boundary.
+## COMPILER ####################################################################
+
+#: Statements that behave identically each time they are run, given the same
+#: start time. Repeat blocks made only of these are compiled symbolically.
+TIME_INVARIANT_STATEMENTS = ('delay_statement', 'pulse_statement', 'blank_statement', None)
+
+def is_time_invariant(stmts):
+    """
+    Returns `True` if running the given statements repeatedly would produce
+    the same pulses each time, shifted only in time. Blocks that define
+    variables, set options, increment phases, print or include other files
+    are not time-invariant.
+    """
+    for stmt in stmts:
+        stmt_type = stmt.getName()
+        if stmt_type == "repeat_statement":
+            if not is_time_invariant(stmt.block_contents):
+                return False
+        elif stmt_type not in TIME_INVARIANT_STATEMENTS:
+            return False
+    return True
+
+#: Parsers accepted by `~x6.pulprog.parse_program`.
+PARSERS = ('fast', 'pyparsing')
+
+def parse_program(source, parser='fast', use_cache=True):
+    """
+    Parses an **xpulprog** source into a sequence of statements.
+
+    :param str source: Source code for the pulse program to be parsed.
+    :param str parser: Either ``'fast'``, to use the hand-written parser in
+        `x6.xpp_parser`, or ``'pyparsing'``, to use the PyParsing grammar
+        `~x6.pulprog.pulse_program`. Only the fast parser understands
+        arithmetic expressions, such as ``define t2 = 2*tau + 15ns``.
+    :param bool use_cache: If `True`, results of the fast parser are
+        looked up in and saved to `x6.parse_cache`.
+    :raises XPPSyntaxError: if the fast parser rejects the source.
+    :raises pyparsing.ParseException: if the PyParsing grammar rejects the
+        source.
+    """
+    if parser == 'fast':
+        if use_cache:
+            return parse_cache.parse_source(source)
+        return xpp_parser.parse(source)
+    elif parser == 'pyparsing':
+        return pulse_program.parseString(source)
+    else:
+        raise ValueError("Unknown parser {}; expected one of {}.".format(parser, PARSERS))
+
+def parse_file(filename, parser='fast', use_cache=True):
+    """
+    Parses the **xpulprog** source in the given file. When the fast parser
+    and cache are used, a file whose modification time and size have not
+    changed since it was last parsed is not read again.
+
+    :param str filename: Path to the source file.
+    :param str parser: See `~x6.pulprog.parse_program`.
+    :param bool use_cache: See `~x6.pulprog.parse_program`.
+    """
+    if parser == 'fast' and use_cache:
+        return parse_cache.parse_file(filename)
+    with open(filename, 'r') as f:
+        return parse_program(f.read(), parser, use_cache)
+
+def init_state(state=None):
+    """
+    Returns ``state``, or a new `dict` if ``state`` is `None`, with any
+    missing keys of the compiler state set to their defaults.
+    """
     if state is None:
         state = {}
     
@@ -857,191 +1177,461 @@ def compile_program(source, pulse_visitor, namespace=None, state=None, periphera
         state['active_channels'] = [False] * 4
     if not state.has_key('override_active_channels'):
         state['override_active_channels'] = False
+    return state
     
+def state_sample_rate(state):
     # We force the user to declare the sample rate before performing 
     # any commands which require it
-    def sample_rate():
-        if state['sample_rate'] is None:
-            raise ValueError('"sample_rate" was requested, but it has not been set yet. Use the "option" command in your program to set it.')
-        else:
-            return state['sample_rate']
-            
-    def active_channels():
-        if state['override_active_channels']:
-            return validate_active_channels(state['override_active_channels'])
-        else:
-            return validate_active_channels(state['active_channels'])
-        
+    if state['sample_rate'] is None:
+        raise ValueError('"sample_rate" was requested, but it has not been set yet. Use the "option" command in your program to set it.')
+    else:
+        return state['sample_rate']
         
-    # Defining our loop body as a function makes recursion easier. 
-    def handle_single_statement(stmt):
+def state_active_channels(state):
+    if state['override_active_channels']:
+        return validate_active_channels(state['override_active_channels'])
+    else:
+        return validate_active_channels(state['active_channels'])
 
-        # Optionally print our or collect the statement
-        # for debugging purposes.
-        if debug is True:
-            print stmt
-        elif debug == "return":
-            stmts.append(stmt)
+def profiled_visitor(visitor, profile):
+    """
+    Wraps ``visitor`` so that calls to it are recorded in ``profile``. The
+    visitors within a `~x6.pulprog.MultiVisitor` are wrapped individually,
+    so that each is timed separately.
+    """
+    if isinstance(visitor, MultiVisitor):
+        return MultiVisitor(
+            *[profiled_visitor(sub, profile) for sub in visitor._visitors], parallel=visitor._parallel
+        )
+    return cprof.ProfiledVisitor(visitor, profile)
 
-        # Each kind of statement has a results name
-        # associated, so that we can find out what statement
-        # we got by querying that name.
-        stmt_type = stmt.getName()
-        
-        # A statement without a name shouldn't occur,
-        # but if it does, best to handle it with at most a warning.
-        if stmt_type == None:
-            warnings.warn("Nameless statement type handled; this may be a sign of an internal problem in pulprog.py.")
-            pass
+## STATEMENT COMPILATION ##
 
-        # Handle include statements by recursively calling compile.            
-        elif stmt_type == "incl_statement":
-            incl_file = find_on_path(stmt.incl_file)
-            if incl_file is None:
-                raise IOError("Include file {} not found on sys.path.".format(incl_file))
-            with open(incl_file, 'r') as f:
-                incl_source = f.read()
-                
-            with u.working_directory(incl_file): # <- Sets the working directory
-                                                 # for the next stmt only.
-                compile_program(
-                    incl_source, 
-                    pulse_visitor, 
-                    namespace=namespace, 
-                    state=state, 
-                    peripheral_id=peripheral_id, 
-                    is_include=True,
-                    debug=debug
-                )
+# Value of a slot whose variable has not been defined yet.
+_UNDEFINED = object()
+
+class _Slot(object):
+    """
+    Holds the current value of one variable, so that compiled statements
+    can read it without looking its identifier up in the namespace.
+    """
+    __slots__ = ('ident', 'value')
+
+    def __init__(self, ident, value):
+        self.ident = ident
+        self.value = value
+
+class StatementCompiler(object):
+    """
+    Turns parsed **xpulprog** statements into Python closures, each taking a
+    visitor and running its statement against it.
+
+    Statements are dispatched on their type once, when they are compiled,
+    rather than every time that they run. Identifiers are bound to slots
+    that ``define`` statements update alongside the namespace, literals are
+    resolved ahead of time, and whether a ``repeat`` block is
+    time-invariant is decided once, so that running the body of a repeat
+    is a loop over closures. The time of a pulse or delay is converted to
+    samples when it runs, as the sample rate is set by an ``option``
+    statement.
+
+    Included files are compiled when their ``include`` statement runs,
+    sharing the slots, namespace and state of the including program.
+
+    :param dict namespace: Mapping from `~x6.xpp_types.Identifier`
+        instances to values, updated by ``define`` statements.
+    :param dict state: Compiler state; see `~x6.pulprog.init_state`.
+    :param str source_dir: Directory against which relative paths are
+        resolved; see `~x6.pulprog.compile_program`.
+    :param IncludeResolver resolver: Finds and loads included files.
+    :param str parser: Parser for included files.
+    :param debug: If `True`, each statement is printed as it runs, and
+        ``repeat`` blocks are always unrolled. If ``"return"``, each
+        statement is instead appended to ``executed`` as it runs.
+    :param CompileProfile profile: If not `None`, each statement is timed.
+    :param PhaseRegistry phases: Phase lists bound to variables, which
+        ``ipp`` statements advance. By default, a registry is made holding
+        the phase lists in ``namespace``.
+    :param list executed: List to which statements are appended as they
+        run, if ``debug`` is ``"return"``.
+    """
+
+    def __init__(self, namespace, state, source_dir=None, resolver=None, parser='fast', debug=False,
+            profile=None, slots=None, phases=None, executed=None
+        ):
+        self.namespace = namespace
+        self.state = state
+        self.source_dir = source_dir
+        self.resolver = resolver if resolver is not None else IncludeResolver()
+        self.parser = parser
+        self.debug = debug
+        self.profile = profile
+        self._slots = slots if slots is not None else {}
+        if phases is None:
+            phases = PhaseRegistry()
+            phases.bind_all(namespace)
+        self.phases = phases
+        self.executed = executed if executed is not None else []
+
+    def for_include(self, incl_file):
+        """
+        Returns a compiler for statements in the given included file.
+        """
+        return StatementCompiler(
+            self.namespace, self.state, os.path.dirname(incl_file), self.resolver, self.parser,
+            self.debug, self.profile, self._slots, self.phases, self.executed
+        )
+
+    ## HELPERS ##
+
+    def sample_rate(self):
+        return state_sample_rate(self.state)
+
+    def _slot(self, ident):
+        slot = self._slots.get(ident.name)
+        if slot is None:
+            slot = self._slots[ident.name] = _Slot(ident, self.namespace.get(ident, _UNDEFINED))
+        return slot
+
+    def _value(self, sym):
+        # Returns a function that evaluates sym as resolve_sym would.
+        if isinstance(sym, Identifier):
+            slot = self._slot(sym)
+            def value():
+                val = slot.value
+                if val is _UNDEFINED:
+                    raise KeyError("Variable {} has not been defined.".format(slot.ident.name))
+                return val
+            return value
+        elif isinstance(sym, Expression):
+            function = sym.function
+            operands = [self._value(operand) for operand in sym.operands]
+            return lambda: function(*[operand() for operand in operands])
+        elif isinstance(sym, WaveformLiteral):
+            source_dir = self.source_dir
+            return lambda: sym.load(source_dir)
+        else:
+            return lambda: sym
+
+    def _samples(self, sym):
+        # Returns a function giving the number of samples in the time sym.
+        sample_rate = self.sample_rate
+        if isinstance(sym, Time):
+            seconds = sym._time
+            return lambda: int(seconds * sample_rate())
+        value = self._value(sym)
+        return lambda: int(value()._time * sample_rate())
 
-        # Defining a new variable or redefining an existing one
-        # is quite straightforward; just throw it in the namespace dict.
-        elif stmt_type == "define_statement":
-            val = resolve_sym(stmt.value, namespace)
+    ## COMPILATION ##
+
+    def compile_block(self, stmts):
+        """
+        Compiles a sequence of statements, returning a list of closures.
+        """
+        return [self.compile_statement(stmt) for stmt in stmts]
+
+    def compile_statement(self, stmt):
+        """
+        Compiles one statement into a closure taking a visitor.
+        """
+        stmt_type = stmt.getName()
+        method = self._COMPILERS.get(stmt_type)
+        if method is not None:
+            run = method(self, stmt)
+        elif stmt_type is None:
+            # A statement without a name shouldn't occur, but if it does,
+            # best to handle it with at most a warning.
+            def run(visitor):
+                warnings.warn("Nameless statement type handled; this may be a sign of an internal problem in pulprog.py.")
+        else:
+            def run(visitor):
+                print "Statement type {} not handled.".format(stmt_type)
+
+        if self.debug is True or self.debug == "return":
+            run = self._debugged(stmt, run)
+        if self.profile is not None:
+            run = self._profiled(stmt, stmt_type, run)
+        return run
+
+    def _debugged(self, stmt, run):
+        if self.debug == "return":
+            executed = self.executed
+            def debugged(visitor):
+                executed.append(stmt)
+                return run(visitor)
+        else:
+            def debugged(visitor):
+                print stmt
+                return run(visitor)
+        return debugged
+
+    def _profiled(self, stmt, stmt_type, run):
+        # Each statement is timed, including any statements nested inside
+        # of it.
+        profile = self.profile
+        lineno = getattr(stmt, 'lineno', None)
+        def profiled(visitor):
+            start = time.time()
+            try:
+                return run(visitor)
+            finally:
+                profile.add_statement(stmt_type, lineno, time.time() - start)
+        return profiled
+
+    def _compile_include(self, stmt):
+        compiler = self
+        resolver, parser, profile = self.resolver, self.parser, self.profile
+        def run(visitor):
+            incl_file = resolver.resolve(stmt.incl_file, compiler.source_dir)
+            # Include files may be included many times from within repeat
+            # blocks, so the resolver keeps what it has parsed.
+            try:
+                with profile.section('parse') if profile is not None else u.null_context():
+                    incl_stmts = resolver.load(incl_file, parser)
+            except (pp.ParseException, xpp_parser.XPPSyntaxError) as ex:
+                print 'Error parsing XPP source in {} on line {}:\n\t"{}"'.format(incl_file, ex.lineno, ex.line)
+                raise ex
+
+            # Paths within the included file are relative to its own
+            # directory.
+            with profile.source(incl_file) if profile is not None else u.null_context():
+                for substmt in compiler.for_include(incl_file).compile_block(incl_stmts):
+                    substmt(visitor)
+        return run
+
+    def _compile_define(self, stmt):
+        namespace = self.namespace
+        ident = stmt.ident
+        slot = self._slot(ident)
+        value = self._value(stmt.value)
+        bind = self.phases.bind
+        def run(visitor):
+            val = value()
             if isinstance(val, Resolvable) and not val.resolved:
                 val._resolve_(namespace)
-            namespace[stmt.ident] = val
-
-        # A delay is handled by incrementing the global time counter.
-        elif stmt_type == "delay_statement":
-            val = resolve_sym(stmt[0], namespace)
-                
+            namespace[ident] = val
+            slot.value = val
+            bind(ident.name, val)
+        return run
+
+    def _compile_delay(self, stmt):
+        state = self.state
+        sample_rate = self.sample_rate
+        value = self._value(stmt[0])
+        def run(visitor):
+            val = value()
             if not isinstance(val, Time):
                 raise TypeError("Delay periods must be times.")
-                
             state['t'] += int(val._time * sample_rate())
-
-        # Pulses are somewhat more complicated, and require us
-        # to handle each pulse sentence in parallel as well as
-        # to resolve the individual expressions within each sentence.
-        elif stmt_type == "pulse_statement":
-
-            # We will need to know how long this pulse statement
-            # took so that the global time can be incremented accordingly.
-            max_t = state['t']
-
-            # Loop over sentences, making sure not to alter globals
-            # until the end.
-            for pulse_sentence in stmt:
+        return run
+
+    def _compile_pulse(self, stmt):
+        # Each pulse sentence is compiled to the functions giving its
+        # channels, and a list of (kind, samples, value) parts.
+        state = self.state
+        sentences = []
+        for pulse_sentence in stmt:
+            channels = [self._value(sym) for sym in pulse_sentence.channel_spec]
+            parts = []
+            for expr_part in pulse_sentence.pulse_expr:
+                kind = expr_part.getName()
+                if kind == "delay_expr":
+                    parts.append((kind, self._samples(expr_part.period), None))
+                elif kind == "shaped_pulse":
+                    parts.append((kind, self._samples(expr_part.period), self._value(expr_part.waveform)))
+                elif kind == "phase_expr":
+                    parts.append((kind, None, self._value(expr_part.phase_value)))
+            # Channel sets that have already been checked, keyed by the
+            # identities of their channels.
+            sentences.append((channels, parts, {}))
+
+        def run(visitor):
+            # We will need to know how long this pulse statement took so
+            # that the global time can be incremented accordingly.
+            t_start = state['t']
+            max_t = t_start
+            # The pulses of every sentence are passed to the visitor
+            # together once the statement has been evaluated.
+            pulses = []
+            ends = []
+            for channel_fns, parts, checked in sentences:
                 # Keep track of the time local to this sentence.
-                local_t = state['t']
-                
-                # Unpack and resolve channel references.
-                channels = map(
-                            lambda sym: resolve_sym(sym, namespace), 
-                            pulse_sentence.channel_spec
-                              )
-                
+                local_t = t_start
+                channels = [channel() for channel in channel_fns]
+
                 # Enforce that channels cannot be mixed digital and analog.
-                analog = [channel.analog for channel in channels]
-                digital = [not x for x in analog]
-                
-                if not (all(analog) or all(digital)):
-                    raise ValueError("Cannot mix digital and analog channels as outputs of a pulse sentence.")
-                
-                # Now we can consider each of the three kinds of pulse
-                # expressions individually.
-                # In practice, this is where most of the compilation logic will go.
-                expr = pulse_sentence.pulse_expr
-                # in case no phase was specified in the pulse sentence, we
-                # set a default value here.
+                key = tuple(map(id, channels))
+                if key not in checked:
+                    analog = [channel.analog for channel in channels]
+                    if any(analog) and not all(analog):
+                        raise ValueError("Cannot mix digital and analog channels as outputs of a pulse sentence.")
+                    checked[key] = tuple(channels)
+
+                # In case no phase was specified in the pulse sentence, we
+                # use a default value.
                 cur_phase = (0, 1)
-                for expr_part in expr:
-                    if expr_part.getName() == "delay_expr":
-                        n_samp = int(resolve_sym(expr_part.period, namespace)._time * sample_rate())
-                        local_t += n_samp
-                        
-                    elif expr_part.getName() == "shaped_pulse":
-                        n_samp = int(resolve_sym(expr_part.period, namespace)._time * sample_rate())
-                        pulse_visitor.visit_pulseexpr(
-                            state, channels, local_t, n_samp, resolve_sym(expr_part.waveform, namespace), cur_phase
-                        )
+                for kind, samples, value in parts:
+                    if kind == "delay_expr":
+                        local_t += samples()
+                    elif kind == "shaped_pulse":
+                        n_samp = samples()
+                        pulses.append((channels, local_t, n_samp, value(), cur_phase))
                         local_t += n_samp
-                        
-                    elif expr_part.getName() == "phase_expr":
-                        cur_phase = resolve_sym(expr_part.phase_value, namespace).cur
-                        
-                # If this pulse sentence was the longest, set max_t
-                # accordingly.
+                    else:
+                        cur_phase = value().cur
                 max_t = max(max_t, local_t)
-                
-            # Update the global time with the amount of time this
-            # pulse statement took.
-            state['t'] = max_t
+                ends.append(local_t)
 
-        # Print statements are pretty basic.
-        elif stmt_type == "print_statement":
-            print resolve_sym(stmt.value, namespace)
-
-        # To increment phases, we search the namespace for
-        # phase lists and increment each individually.
-        elif stmt_type == "ipp_statement":
-            for val in namespace.values():
-                if isinstance(val, PhaseList):
-                    val.ipp()
-
-        # Repeat statements are simple to handle; it's the grammar
-        # that's tricky. We can now just loop over the statements in
-        # the block and feed them to handle_single_statement
-        # recursively.
-        elif stmt_type == "repeat_statement":
-            n_repeat = stmt.how_many
-            for idx in xrange(n_repeat):
-                for substmt in stmt.block_contents:
-                    handle_single_statement(substmt)
-                
-        # Option statements are nearly directly handled by the visitor.
-        elif stmt_type == "option_statement":
-            opt_name = stmt.name.name # stmt.name is an Identifier.
-            opt_value = resolve_sym(stmt.value, namespace)
-            print "Debug: {}, {}".format(opt_name, opt_value)
+            if pulses:
+                visitor.visit_pulses(state, pulses)
+            visitor.visit_advance(state, t_start, ends)
+            state['t'] = max_t
+        return run
+
+    def _compile_print(self, stmt):
+        value = self._value(stmt.value)
+        def run(visitor):
+            print value()
+        return run
+
+    def _compile_ipp(self, stmt):
+        # Phase lists in the namespace are tracked by the registry as they
+        # are defined, so incrementing them doesn't need to search the
+        # namespace.
+        ipp = self.phases.ipp
+        def run(visitor):
+            ipp()
+        return run
+
+    def _compile_repeat(self, stmt):
+        # If every iteration is the same apart from its start time, we run
+        # the block once and let the visitor handle all of the iterations
+        # together. Otherwise, we just loop over the block.
+        state = self.state
+        n_repeat = stmt.how_many
+        body = self.compile_block(stmt.block_contents)
+        if n_repeat > 1 and not self.debug and is_time_invariant(stmt.block_contents):
+            def run(visitor):
+                recorder = RepeatRecorder(visitor)
+                t_start = state['t']
+                for substmt in body:
+                    substmt(recorder)
+                period = state['t'] - t_start
+                visitor.visit_repeat(state, recorder.pulses, period, n_repeat)
+                state['t'] = t_start + n_repeat * period
+        else:
+            def run(visitor):
+                for idx in xrange(n_repeat):
+                    for substmt in body:
+                        substmt(visitor)
+        return run
+
+    def _compile_option(self, stmt):
+        state = self.state
+        sample_rate = self.sample_rate
+        debug = self.debug
+        opt_name = stmt.name.name # stmt.name is an Identifier.
+        value = self._value(stmt.value)
+        def run(visitor):
+            opt_value = value()
+            if debug is True:
+                print "Debug: {}, {}".format(opt_name, opt_value)
             # If value is a Time, we must convert it.
             if isinstance(opt_value, Time):
                 opt_value = int(opt_value._time * sample_rate())
-            pulse_visitor.visit_option(state, opt_name, opt_value)
-            
-            
-                
-        # A blank statement should actually be ignored.
-        # This will also match if the statement has only a
-        # comment.
-        elif stmt_type == "blank_statement":
+            visitor.visit_option(state, opt_name, opt_value)
+        return run
+
+    def _compile_blank(self, stmt):
+        # A blank statement, or one with only a comment, is ignored.
+        def run(visitor):
             pass
+        return run
+
+    _COMPILERS = {
+        'incl_statement': _compile_include,
+        'define_statement': _compile_define,
+        'delay_statement': _compile_delay,
+        'pulse_statement': _compile_pulse,
+        'print_statement': _compile_print,
+        'ipp_statement': _compile_ipp,
+        'repeat_statement': _compile_repeat,
+        'option_statement': _compile_option,
+        'blank_statement': _compile_blank,
+    }
+
+def compile_program(source, pulse_visitor, namespace=None, state=None, peripheral_id=0, is_include=False, debug=False, parser='fast', profile=None,
+        source_dir=None, resolver=None
+    ):
+    """
+    Given an **xpulprog**-language source file, calls a `visitor`_
+    for each pulse instruction in the compiled program. Most users will not
+    run this function directly, but will use one of the higher-level compiler
+    front-ends, such as `compile_to_directory`.
+    
+    :param source: Source code for the pulse program to be compiled, or
+        statements already returned by `~x6.pulprog.parse_program`.
+    :type source: `str` or `list`
+    :param CompilationVisitor pulse_visitor: A `visitor`_ that will observe
+        pulse expressions, option statements, etc.
+        See `~x6.pulprog.PrintVisitor` for an example.
+    :param dict namespace: A mapping from `~x6.pulprog.Identifier` instances
+        to values for each variable.
+    :param dict state: Initial state of the compiler, containing zero or more
+        of the keys ``t``, ``sample_rate``, ``active_channels`` and
+        ``override_active_channels``.
+    :param debug: If `True`, extra debugging information will be printed
+        during compilation. If ``"return"``, the statements run are returned
+        instead, in the order in which they ran, including each iteration
+        of a ``repeat`` block and the statements of included files.
+    :param str parser: Parser used for this program and any files it
+        includes; see `~x6.pulprog.parse_program`.
+    :param profile: If `True` or a `~x6.compile_profile.CompileProfile`,
+        timings of parsing, statements, visitor calls and post-compilation
+        steps are recorded, and the profile is returned.
+    :param str source_dir: Directory against which relative paths in the
+        program, such as those of included files and waveforms, are
+        resolved. Defaults to the working directory.
+    :param IncludeResolver resolver: Resolver used to find and load
+        included files; see `~x6.include_resolver.IncludeResolver`. By
+        default, a new resolver searching `sys.path` is used for each
+        program.
+    
         
-        else:
-            print "Statement type {} not handled.".format(stmt_type)
+    .. _visitor: http://en.wikipedia.org/wiki/Visitor_pattern
     
+    """
+
+    if namespace is None:
+        namespace = {}
+    
+    if profile is True:
+        profile = cprof.CompileProfile()
+    if profile is not None and not is_include:
+        compile_start = time.time()
+        pulse_visitor = profiled_visitor(pulse_visitor, profile)
+    
+    state = init_state(state)
     
     # Actually parse the source now.
     if not is_include: print "[XPP Compiler] Compiling..."
-    try:
-        stmts = pulse_program.parseString(source)
-    except pp.ParseException as ex:
-        print 'Error parsing XPP source on line {}:\n\t"{}"'.format(ex.lineno, ex.line)
-        raise ex
+    if isinstance(source, basestring):
+        try:
+            with profile.section('parse') if profile is not None else u.null_context():
+                stmts = parse_program(source, parser)
+        except (pp.ParseException, xpp_parser.XPPSyntaxError) as ex:
+            print 'Error parsing XPP source on line {}:\n\t"{}"'.format(ex.lineno, ex.line)
+            raise ex
+    else:
+        stmts = source
         
-    for stmt in stmts:
-        handle_single_statement(stmt)
+    # Compile the statements to closures, and then run them.
+    compiler = StatementCompiler(
+        namespace, state, source_dir=source_dir, resolver=resolver, parser=parser,
+        debug=debug, profile=profile
+    )
+    for run_stmt in compiler.compile_block(stmts):
+        run_stmt(pulse_visitor)
     if not is_include: print "[XPP Compiler] Done compiling."
       
     # We now allow the visitor to declare any options it needs in
@@ -1054,15 +1644,46 @@ def compile_program(source, pulse_visitor, namespace=None, state=None, periphera
     # program, not for any included files
     if not is_include: 
         print "[XPP Compiler] Starting post compilation steps..."
-        pulse_visitor.post_compilation(sample_rate(), active_channels(), extra_options, peripheral_id)
+        pulse_visitor.post_compilation(state_sample_rate(state), state_active_channels(state), extra_options, peripheral_id)
         print "[XPP Comiler] Done with post compilation."
         
     if debug == "return":
-        return stmts
+        return compiler.executed
+    if profile is not None and not is_include:
+        profile.total_seconds += time.time() - compile_start
+        return profile
             
+def compile_timeline(timeline, pulse_visitor, state=None, peripheral_id=0):
+    """
+    Runs a `visitor`_ over an already compiled `~x6.timeline.Timeline`,
+    producing the same results as compiling the program that the timeline
+    came from. Each option is passed to ``visit_option``, and then all
+    pulses are passed at once to ``visit_timeline``.
+    
+    :param Timeline timeline: The compiled pulses and options.
+    :param CompilationVisitor pulse_visitor: Visitor to run.
+    :param dict state: Initial state of the compiler; see
+        `~x6.pulprog.compile_program`.
+    """
+    state = init_state(state)
+    for _, opt_name, opt_value in timeline.options:
+        pulse_visitor.visit_option(state, opt_name, opt_value)
+    pulse_visitor.visit_timeline(state, timeline)
+    
+    extra_options = pulse_visitor.declare_final_options()
+    pulse_visitor.post_compilation(state_sample_rate(state), state_active_channels(state), extra_options, peripheral_id)
+
 ## COMPILER FRONT-ENDS #########################################################
 
-def compile_to_directory(source_file, dirname, namespace=None, overwrite=True):
+def _source_dir(source_file):
+    # Relative paths in a program are relative to the file it came from.
+    if hasattr(source_file, 'name'):
+        return os.path.dirname(os.path.abspath(source_file.name))
+    return None
+
+def compile_to_directory(source_file, dirname, namespace=None, overwrite=True, parser='fast', profile=None,
+        waveform_memory=WAVEFORM_BUFFER_MEMORY, resolver=None
+    ):
     """
     Compiles the XPP source in a given file to the directory given.
     
@@ -1075,25 +1696,135 @@ def compile_to_directory(source_file, dirname, namespace=None, overwrite=True):
     :param bool overwrite: If `True`, the output directory will be overwritten
         if it already exists. Otherwise, an exception will be raised if the
         output directory already exists.
+    :param str parser: Parser to use; see `~x6.pulprog.parse_program`.
+    :param profile: If `True` or a `~x6.compile_profile.CompileProfile`,
+        compilation is profiled, and the profile, including the size of
+        each output file, is returned.
+    :param int waveform_memory: Number of bytes of waveform samples to keep
+        in memory before spilling them to disk; see
+        `~x6.pulprog.WaveformBuilderVisitor`.
+    :param IncludeResolver resolver: See `~x6.pulprog.compile_program`.
+    
+    The outputs are written to a staging directory beside ``dirname``,
+    which then replaces ``dirname`` by renaming it; see
+    `x6.utils.staged_directory`. A failed compilation thus leaves any
+    previous outputs in ``dirname`` untouched, and a reader of ``dirname``
+    never sees a partly written set of outputs.
     """
 
     # Make a namespace dictionary in the format we need it.
     namespace = mk_namespace_dict(namespace)
     
+    # Load the source.
+    if isinstance(source_file, str):
+        source_file = open(source_file, 'r')
+    try:
+        source = "".join(source_file)
+    finally:
+        source_file.close()
+        
+    if profile is True:
+        profile = cprof.CompileProfile()
+    
     # Check if the output directory already exists and overwrite it or
     # raise an exception if so, depending on the value of ``overwrite``.
-    if os.path.exists(dirname):
-        if overwrite:
-            print "[XPP Compiler] Removing current contents of {}...".format(dirname)
-            shutil.rmtree(dirname, ignore_errors=True)
+    if os.path.exists(dirname) and overwrite:
+        print "[XPP Compiler] Replacing current contents of {}...".format(dirname)
+    with u.staged_directory(dirname, overwrite=overwrite) as staging:
+        # Make and run the build_all_visitor to generate all of the
+        # consituant files.
+        ba_visitor = build_all_visitor(staging, waveform_memory=waveform_memory)
+        
+        # Actually run the compiler with the given visitor.
+        source_dir = _source_dir(source_file)
+        if profile is not None:
+            with profile.source(os.path.abspath(source_file.name) if hasattr(source_file, 'name') else cprof.UNNAMED_SOURCE):
+                compile_program(source, ba_visitor, namespace=namespace, debug=False, parser=parser, profile=profile,
+                    source_dir=source_dir, resolver=resolver
+                )
+            profile.add_output_files(staging)
         else:
-            raise IOError("Folder already exists. Not overwriting.")
+            compile_program(source, ba_visitor, namespace=namespace, debug=False, parser=parser,
+                source_dir=source_dir, resolver=resolver
+            )
+    
+    if profile is not None:
+        return profile
+    
+
+def compile_to_timeline(source_file, namespace=None, parser='fast', resolver=None, visitors=()):
+    """
+    Compiles the XPP source in a given file into a `~x6.timeline.Timeline`
+    without writing any output files.
+    
+    :param source_file: File containing the xpulprog source to be compiled.
+    :type source_file: `str` containing a path or `file`-like
+    :param dict namespace: A mapping from strings to values, such that
+        ``namespace[name]`` specifies the initial value of the **xpulprog**
+        variable ``name``.
+    :param str parser: Parser to use; see `~x6.pulprog.parse_program`.
+    :param IncludeResolver resolver: See `~x6.pulprog.compile_program`.
+    :param list visitors: Further visitors to run over the program while
+        it is compiled.
+    :rtype: `~x6.timeline.Timeline`
+    """
+    namespace = mk_namespace_dict(namespace)
+    
+    if isinstance(source_file, str):
+        source_file = open(source_file, 'r')
+    try:
+        source = "".join(source_file)
+    finally:
+        source_file.close()
         
-    # If we made it here, then the folder doesn't exist, so we can create
-    # it with impunity.
-    os.mkdir(dirname)
+    visitor = MultiVisitor(TimelineVisitor(), StateVisitor(), *visitors)
+    compile_program(source, visitor, namespace=namespace, debug=False, parser=parser,
+        source_dir=_source_dir(source_file), resolver=resolver
+    )
+    return visitor._visitors[0].timeline
+
+def compile_incremental(source_file, dirname, namespace=None, parser='fast', peripheral_id=0,
+        waveform_memory=WAVEFORM_BUFFER_MEMORY, resolver=None
+    ):
+    """
+    Compiles the XPP source in a given file to the directory given, as
+    `~x6.pulprog.compile_to_directory` does, but rebuilding only those
+    outputs that would change.
+    
+    Along with its outputs, each compilation records a
+    `~x6.build_record.BuildRecord` of the source, namespace, parser and
+    the include and waveform files that the program read, together with a
+    digest of the compiled pulses that each artifact depends on:
+    
+    - ``waveform.velo`` depends on the lengths, channels, waveforms and
+      phases of the TX pulses, but not on when they start;
+    - ``rx.pattern`` and ``tx.pattern`` depend on the PRI entries;
+    - ``pulse.pulse`` is small, and is always rewritten.
+    
+    If none of the recorded inputs have changed, nothing is compiled.
+    Otherwise, the program is compiled to a `~x6.timeline.Timeline`, and
+    only the artifacts whose digests differ are rebuilt from it; the
+    others are copied from the previous outputs. Changing a delay thus
+    rewrites the PRI patterns, but not the waveforms.
+    
+    As with `~x6.pulprog.compile_to_directory`, the new outputs replace
+    ``dirname`` as a whole once they have all been written.
+    
+    :param source_file: File containing the xpulprog source to be compiled.
+    :type source_file: `str` containing a path or `file`-like
+    :param str dirname: Path to the output directory, which is replaced
+        if it exists.
+    :param dict namespace: See `~x6.pulprog.compile_to_directory`.
+    :param str parser: Parser to use; see `~x6.pulprog.parse_program`.
+    :param int peripheral_id: Peripheral ID of the board.
+    :param int waveform_memory: See `~x6.pulprog.compile_to_directory`.
+    :param IncludeResolver resolver: See `~x6.pulprog.compile_program`.
+        If given, every file that it has ever resolved is recorded as a
+        dependency.
+    :return: The names of the artifacts that were rebuilt.
+    """
+    namespace = mk_namespace_dict(namespace)
     
-    # Load the source.
     if isinstance(source_file, str):
         source_file = open(source_file, 'r')
     try:
@@ -1101,15 +1832,277 @@ def compile_to_directory(source_file, dirname, namespace=None, overwrite=True):
     finally:
         source_file.close()
         
-    # Make and run the build_all_visitor to generate all of the consituant
-    # files.
-    ba_visitor = build_all_visitor(dirname)
+    inputs = br.fingerprint_inputs(source, parser, peripheral_id, namespace)
+    record = br.BuildRecord.load(dirname) if os.path.isdir(dirname) else None
+    if record is not None and record.is_up_to_date(inputs, dirname):
+        print "[XPP Compiler] {} is up to date.".format(dirname)
+        return []
+        
+    if resolver is None:
+        resolver = IncludeResolver()
+    visitor = MultiVisitor(TimelineVisitor(), StateVisitor())
+    compile_program(source, visitor, namespace=namespace, debug=False, parser=parser,
+        source_dir=_source_dir(source_file), resolver=resolver
+    )
+    timeline = visitor._visitors[0].timeline
+    
+    new_record = br.BuildRecord(inputs, resolver.resolved_files + br.waveform_files(timeline))
+    digests = {
+        'patterns': br.patterns_digest(timeline),
+        'waveform': br.waveform_digest(timeline, peripheral_id)
+    }
+    files = {
+        'patterns': ['rx.pattern', 'tx.pattern'],
+        'waveform': ['waveform.velo']
+    }
+    stale = sorted(
+        name for name, digest in digests.items()
+        if record is None or not record.artifact_is_fresh(name, digest, dirname)
+    )
+    
+    with u.staged_directory(dirname) as staging:
+        visitors = []
+        for name in sorted(digests):
+            if name in stale:
+                continue
+            # Reused artifacts are copied rather than linked, so that the
+            # previous outputs are left as they were until they are
+            # replaced.
+            for filename in record.artifacts[name]['files']:
+                shutil.copy2(os.path.join(dirname, filename), os.path.join(staging, filename))
+            new_record.artifacts[name] = record.artifacts[name]
+            visitors.append(FinalOptionsVisitor(record.artifact_options(name)))
+            
+        builders = {}
+        if 'patterns' in stale:
+            builders['patterns'] = PRIPatternVisitor(
+                os.path.join(staging, 'rx.pattern'),
+                os.path.join(staging, 'tx.pattern')
+            )
+        if 'waveform' in stale:
+            builders['waveform'] = WaveformBuilderVisitor(
+                os.path.join(staging, 'waveform.velo'),
+                memory_limit=waveform_memory
+            )
+        visitors.extend(builders.values())
+        visitors.append(PulseConfigurationVisitor(os.path.join(staging, 'pulse.pulse')))
+        visitors.append(StateVisitor())
+        compile_timeline(timeline, MultiVisitor(*visitors, parallel=True), peripheral_id=peripheral_id)
+        
+        for name, builder in builders.items():
+            built = [filename for filename in files[name] if os.path.isfile(os.path.join(staging, filename))]
+            new_record.add_artifact(name, digests[name], built, builder.declare_final_options())
+        new_record.add_artifact('pulse', None, ['pulse.pulse'], {})
+        new_record.save(staging)
+        
+    print "[XPP Compiler] Rebuilt {} in {}.".format(", ".join(stale + ['pulse']), dirname)
+    return stale + ['pulse']
+
+def _compile_sweep_point(args):
+    # Runs in a worker process, so must be a module-level function.
+    source_file, dirname, namespace, overwrite, parser, cache_dir = args
+    if cache_dir is not None:
+        os.environ[parse_cache.CACHE_DIR_ENV_VAR] = cache_dir
+    compile_to_directory(source_file, dirname, namespace=namespace, overwrite=overwrite, parser=parser)
+    return dirname
+
+def _manifest_value(val):
+    if isinstance(val, (bool, int, long, float, basestring)) or val is None:
+        return val
+    elif isinstance(val, np.ndarray):
+        return "ndarray(shape={}, dtype={})".format(val.shape, val.dtype)
+    else:
+        return str(val)
+
+def iter_compile_sweep(source_file, namespaces, out_root, workers=None, overwrite=True, parser='fast'):
+    """
+    Compiles the XPP source in a given file once for each of a sequence of
+    namespaces, each into its own subdirectory of ``out_root``, using a pool
+    of worker processes.
+    
+    Results are yielded in the order of ``namespaces`` as soon as each point
+    has been compiled, so that the first points of a sweep can be used
+    while later points are still compiling.
+    
+    On Windows, this must be called from within an
+    ``if __name__ == "__main__":`` block of the calling script.
+    
+    :param str source_file: Path to the file containing the xpulprog
+        source to be compiled.
+    :param namespaces: Sequence of namespaces, in the format accepted by
+        `~x6.pulprog.compile_to_directory`.
+    :param str out_root: Directory in which the output directory for each
+        point is made.
+    :param int workers: Number of worker processes, defaulting to the
+        number of CPUs. If ``workers`` is 1, points are compiled in this
+        process.
+    :param bool overwrite: See `~x6.pulprog.compile_to_directory`.
+    :param str parser: See `~x6.pulprog.parse_program`.
+    :return: Iterator over ``(namespace, dirname)`` pairs.
+    """
+    source_file = os.path.abspath(source_file)
+    out_root = os.path.abspath(out_root)
+    if not os.path.exists(out_root):
+        os.makedirs(out_root)
+    namespaces = list(namespaces)
+    dirnames = [
+        os.path.join(out_root, "point_{:04d}".format(idx))
+        for idx in xrange(len(namespaces))
+    ]
+    
+    # Parsing once here fills the on-disk parse cache, which the workers
+    # then share, so that no worker has to parse the main program again.
+    cache_dir = parse_cache.default_cache().cache_dir
+    if parser == 'fast':
+        parse_file(source_file, parser)
+    
+    tasks = [
+        (source_file, dirname, namespace, overwrite, parser, cache_dir)
+        for dirname, namespace in zip(dirnames, namespaces)
+    ]
+    
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(tasks)))
+    
+    if workers == 1:
+        for namespace, task in zip(namespaces, tasks):
+            yield namespace, _compile_sweep_point(task)
+        return
+        
+    pool = multiprocessing.Pool(workers)
+    try:
+        for namespace, dirname in zip(namespaces, pool.imap(_compile_sweep_point, tasks)):
+            yield namespace, dirname
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def compile_sweep(source_file, namespaces, out_root, workers=None, overwrite=True, parser='fast'):
+    """
+    Compiles the XPP source in a given file once for each of a sequence of
+    namespaces, in parallel. See `~x6.pulprog.iter_compile_sweep` for a
+    description of the arguments.
+    
+    A manifest describing each point is also written to ``manifest.json``
+    in ``out_root``.
+    
+    :return: A `list` of ``(namespace, dirname)`` pairs, in the same order
+        as ``namespaces``.
+    """
+    manifest = list(iter_compile_sweep(
+        source_file, namespaces, out_root, workers=workers, overwrite=overwrite, parser=parser
+    ))
+    
+    with open(os.path.join(out_root, 'manifest.json'), 'w') as f:
+        json.dump({
+            'source': os.path.abspath(source_file),
+            'points': [
+                {
+                    'directory': os.path.relpath(dirname, out_root),
+                    'namespace': {
+                        str(key.name if isinstance(key, Identifier) else key): _manifest_value(val)
+                        for key, val in (namespace or {}).iteritems()
+                    }
+                }
+                for namespace, dirname in manifest
+            ]
+        }, f, indent=4, sort_keys=True)
+        
+    return manifest
+
+def board_peripheral_id(board, boards=None):
+    """
+    Returns the peripheral ID of a board, taken from ``boards`` if it
+    names the board, and otherwise from the digits that end the name of
+    the board, as in ``board1``.
+    
+    :param str board: Name of the board.
+    :param dict boards: Mapping from board names to peripheral IDs.
+    :raises ValueError: if no peripheral ID can be found.
+    """
+    if boards is not None and board in boards:
+        return boards[board]
+    digits = len(board) - len(board.rstrip('0123456789'))
+    if digits == 0:
+        raise ValueError("No peripheral ID was given for board {}.".format(board))
+    return int(board[-digits:])
+
+def compile_to_boards(source_file, dirname, boards=None, namespace=None, overwrite=True, parser='fast',
+        waveform_memory=WAVEFORM_BUFFER_MEMORY, resolver=None
+    ):
+    """
+    Compiles a program whose channels are on several X6 boards, writing the
+    outputs for each board to its own subdirectory of ``dirname``, as
+    `~x6.pulprog.compile_to_directory` would for a single board. A
+    ``manifest.json`` in ``dirname`` lists the boards, their peripheral IDs
+    and their output files.
     
-    # Actually run the compiler with the given visitor.
-    wd = source_file.name if hasattr(source_file, 'name') else os.getcwd()
-    with u.working_directory(wd):
-        compile_program(source, ba_visitor, namespace=namespace, debug=False)
+    Channels name their board before their pin, as in
+    ``channel("board1.DA0", analog)``. Channels that do not name a board
+    are on `~x6.pulprog.DEFAULT_BOARD`.
+    
+    :param source_file: File containing the xpulprog source to be compiled.
+    :type source_file: `str` containing a path or `file`-like
+    :param str dirname: Path to the output directory.
+    :param dict boards: Mapping from board names to peripheral IDs. Every
+        board in it gets outputs, even if the program does not use it;
+        other boards get their peripheral IDs from their names; see
+        `~x6.pulprog.board_peripheral_id`.
+    :param dict namespace: See `~x6.pulprog.compile_to_directory`.
+    :param bool overwrite: See `~x6.pulprog.compile_to_directory`.
+    :param str parser: Parser to use; see `~x6.pulprog.parse_program`.
+    :param int waveform_memory: Bytes of waveform samples that each board
+        may keep in memory; see `~x6.pulprog.WaveformBuilderVisitor`.
+    :param IncludeResolver resolver: See `~x6.pulprog.compile_program`.
+    :return: The contents of the manifest.
+    
+    As with `~x6.pulprog.compile_to_directory`, ``dirname`` is replaced
+    as a whole once every board has been compiled.
+    """
+    namespace_items = (namespace or {}).items()
+    namespace = mk_namespace_dict(namespace)
     
+    if isinstance(source_file, str):
+        source_file = open(source_file, 'r')
+    try:
+        source = "".join(source_file)
+    finally:
+        source_file.close()
+        
+    if os.path.exists(dirname) and overwrite:
+        print "[XPP Compiler] Replacing current contents of {}...".format(dirname)
+    with u.staged_directory(dirname, overwrite=overwrite) as staging:
+        router = BoardRouterVisitor(
+            lambda board: build_all_visitor(os.path.join(staging, board), waveform_memory=waveform_memory),
+            lambda board: board_peripheral_id(board, boards),
+            boards=sorted(boards) if boards is not None else ()
+        )
+        compile_program(source, MultiVisitor(router, StateVisitor()), namespace=namespace, debug=False, parser=parser,
+            source_dir=_source_dir(source_file), resolver=resolver
+        )
+        
+        manifest = {
+            'source': os.path.abspath(source_file.name) if hasattr(source_file, 'name') else None,
+            'namespace': {
+                str(key.name if isinstance(key, Identifier) else key): _manifest_value(val)
+                for key, val in namespace_items
+            },
+            'boards': {
+                board: {
+                    'directory': board,
+                    'peripheral_id': board_peripheral_id(board, boards),
+                    'files': sorted(os.listdir(os.path.join(staging, board)))
+                }
+                for board in router.boards
+            }
+        }
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+    return manifest
 
 def plot_pulprog(source_file, namespace=None):
     """
@@ -0,0 +1,470 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# pulse_template.py: Compiled pulse programs that can be re-instantiated
+#     with new parameter values without compiling them again.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import x6.pulprog as pp
+import x6.timeline as tl
+from x6 import xpp_parser
+from x6.include_resolver import IncludeResolver
+from x6.xpp_types import Time
+from x6.process_waveform import Waveform
+
+## CONSTANTS ###################################################################
+
+# Offsets, in samples, at which time-valued parameters are perturbed to
+# measure how the compiled program depends on them.
+PERTURBATIONS = (1, 2)
+
+## FUNCTIONS ###################################################################
+
+def _same_structure(base, other):
+    # Two timelines have the same structure if they differ at most in the
+    # times and lengths of their pulses and in the values of their options.
+    if len(base.entries) != len(other.entries) or len(base.options) != len(other.options):
+        return False
+    for field in ('mask', 'channels', 'waveform', 'phase'):
+        if not np.array_equal(base.entries[field], other.entries[field]):
+            return False
+    return all(
+        (idx, name) == (other_idx, other_name)
+        for (idx, name, _), (other_idx, other_name, _) in zip(base.options, other.options)
+    )
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+def _advance_winners(ends, starts):
+    # Returns the index into ends of the first latest end of each pulse
+    # statement, which is the one that set how far the statement advanced.
+    stops = list(starts[1:]) + [len(ends)]
+    return np.array(
+        [start + np.argmax(ends[start:stop]) for start, stop in zip(starts, stops)], dtype=int
+    )
+
+def _same_advances(base_advances, other_advances):
+    # Two compilations advance alike if they have the same pulse statements,
+    # and each is advanced by the same one of its sentences.
+    (ends, starts), (other_ends, other_starts) = base_advances, other_advances
+    return (
+        len(ends) == len(other_ends) and np.array_equal(starts, other_starts) and
+        np.array_equal(_advance_winners(ends, starts), _advance_winners(other_ends, other_starts))
+    )
+
+def _writes_waveform(channels):
+    # Mirrors WaveformBuilderVisitor, which only writes samples for analog
+    # TX channels.
+    return any(not ch.is_rx and ch.analog for ch in channels)
+
+def _time_dependence(base, base_advances, perturbed):
+    # Given the base timeline and advances, and the (timeline, advances)
+    # pairs compiled with a parameter increased by each of PERTURBATIONS
+    # samples, returns the per-sample change of the pulse times, pulse
+    # lengths, statement advances and option values, or None if the
+    # dependence is not affine.
+    #
+    # A pulse statement advances the time by the longest of its sentences,
+    # so times are only affine in a parameter while the same sentences are
+    # the longest; PulseTemplate._patch checks that they still are.
+    if not all(_same_structure(base, other) for other, _ in perturbed):
+        return None
+    if not all(_same_advances(base_advances, advances) for _, advances in perturbed):
+        return None
+    columns = {
+        't': (base.entries['t'], [other.entries['t'] for other, _ in perturbed]),
+        'n_samp': (base.entries['n_samp'], [other.entries['n_samp'] for other, _ in perturbed]),
+        'ends': (base_advances[0], [advances[0] for _, advances in perturbed])
+    }
+    coefs = {}
+    for field, (base_col, other_cols) in columns.iteritems():
+        coef = (other_cols[0] - base_col) // PERTURBATIONS[0]
+        for delta, other_col in zip(PERTURBATIONS, other_cols):
+            if not np.array_equal(other_col - base_col, coef * delta):
+                return None
+        coefs[field] = coef
+    perturbed = [other for other, _ in perturbed]
+
+    option_coefs = {}
+    for opt_idx, (_, _, value) in enumerate(base.options):
+        values = [other.options[opt_idx][2] for other in perturbed]
+        if all(other_value == value for other_value in values):
+            continue
+        if not all(isinstance(v, (int, long)) and not isinstance(v, bool) for v in [value] + values):
+            return None
+        coef = (values[0] - value) // PERTURBATIONS[0]
+        if any(other_value - value != coef * delta for delta, other_value in zip(PERTURBATIONS, values)):
+            return None
+        option_coefs[opt_idx] = coef
+    coefs['options'] = option_coefs
+    return coefs
+
+def _value_dependence(base, base_advances, perturbed, perturbed_values):
+    # For a numeric parameter, the only dependence we template is an option
+    # being set directly to the parameter's value.
+    if not all(_same_structure(base, other) for other, _ in perturbed):
+        return None
+    if not all(np.array_equal(base.entries, other.entries) for other, _ in perturbed):
+        return None
+    if not all(np.array_equal(base_advances[0], advances[0]) for _, advances in perturbed):
+        return None
+    perturbed = [other for other, _ in perturbed]
+    option_idxs = []
+    for opt_idx, (_, _, value) in enumerate(base.options):
+        values = [other.options[opt_idx][2] for other in perturbed]
+        if all(other_value == value for other_value in values):
+            continue
+        if values != perturbed_values:
+            return None
+        option_idxs.append(opt_idx)
+    return option_idxs
+
+## CLASSES #####################################################################
+
+class PulseTemplate(object):
+    """
+    A compiled pulse program, together with a record of how its PRI
+    entries, options and waveforms depend on each of its parameters.
+    Templates are made by `~x6.pulse_template.compile_template`, and
+    output directories are made from them by
+    `~x6.pulse_template.instantiate`.
+
+    Three kinds of parameters can be changed without recompiling:
+
+    - times, on which pulse times, pulse lengths and time-valued options
+      must depend affinely (in samples). As each pulse statement advances
+      the time by its longest sentence, this only holds while the same
+      sentences are the longest, so values that make another sentence
+      the longest are compiled from scratch;
+    - numbers that are used directly as option values;
+    - waveforms given as arrays.
+
+    Changing any other parameter compiles the program again.
+    """
+
+    def __init__(self, source_file, namespace, parser, timeline, advances,
+            time_params, value_params, waveform_params
+        ):
+        self.source_file = source_file
+        self.namespace = namespace
+        self.parser = parser
+        self.timeline = timeline
+        # The end of each pulse sentence relative to the start of its
+        # statement, as recorded by _AdvanceRecorder.
+        self._ends, self._starts = advances
+        self._winners = _advance_winners(self._ends, self._starts)
+        self._time_params = time_params
+        self._value_params = value_params
+        self._waveform_params = waveform_params
+
+        # Velo files are only rebuilt when the samples sent to the DA
+        # channels change, so we keep one built from the base waveforms.
+        self._velo_dir = tempfile.mkdtemp()
+        self._velo_files = {}
+
+        self._writes_waveform = np.array(
+            [_writes_waveform(channels) for channels in timeline.channel_sets], dtype=bool
+        )
+
+    def __repr__(self):
+        return "<PulseTemplate {} ({} parameters)>".format(
+            self.source_file, len(self.parameters)
+        )
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def parameters(self):
+        """
+        Names of the parameters that can be changed without recompiling.
+        """
+        return sorted(
+            ident.name for ident in
+            self._time_params.keys() + self._value_params.keys() + self._waveform_params.keys()
+        )
+
+    def close(self):
+        """
+        Removes the files kept by this template.
+        """
+        if self._velo_dir is not None:
+            shutil.rmtree(self._velo_dir, ignore_errors=True)
+            self._velo_dir = None
+
+    def _patch(self, new_values):
+        # Returns a timeline for the given values, or None if the values
+        # cannot be applied without recompiling.
+        base = self.timeline
+        entries = base.entries.copy()
+        ends = self._ends.copy()
+        options = list(base.options)
+        waveforms = list(base.waveforms)
+
+        for ident, value in new_values.iteritems():
+            if ident in self._time_params:
+                if not isinstance(value, Time):
+                    return None
+                base_samples, coefs = self._time_params[ident]
+                delta = int(value._time * base.sample_rate) - base_samples
+                entries['t'] += coefs['t'] * delta
+                entries['n_samp'] += coefs['n_samp'] * delta
+                ends += coefs['ends'] * delta
+                for opt_idx, coef in coefs['options'].iteritems():
+                    idx, name, opt_value = options[opt_idx]
+                    options[opt_idx] = (idx, name, opt_value + coef * delta)
+
+            elif ident in self._value_params:
+                if not _is_number(value):
+                    return None
+                for opt_idx in self._value_params[ident]:
+                    idx, name, _ = options[opt_idx]
+                    options[opt_idx] = (idx, name, value)
+
+            elif ident in self._waveform_params:
+                if not isinstance(value, Waveform):
+                    return None
+                for wf_idx in self._waveform_params[ident]:
+                    waveforms[wf_idx] = value
+
+            elif value is not self.namespace.get(ident):
+                return None
+
+        if (entries['n_samp'] < 0).any():
+            return None
+        # The fit holds only while each pulse statement is advanced by the
+        # same sentence as in the template.
+        if len(ends) and (np.maximum.reduceat(ends, self._starts) > ends[self._winners]).any():
+            return None
+
+        return tl.Timeline(
+            entries, base.channel_sets, waveforms, base.phases, options,
+            sample_rate=base.sample_rate, active_channels=base.active_channels
+        )
+
+    def _same_waveform_samples(self, timeline):
+        # The samples written to the DA channels depend only on the lengths
+        # and waveforms of the pulses that write to them, and not on the
+        # times at which the pulses are played.
+        writes = self._writes_waveform[timeline.entries['channels']] if len(timeline) else np.zeros(0, dtype=bool)
+        return (
+            np.array_equal(timeline.entries['n_samp'][writes], self.timeline.entries['n_samp'][writes])
+            and all(a is b for a, b in zip(timeline.waveforms, self.timeline.waveforms))
+        )
+
+## VISITORS ####################################################################
+
+class _AdvanceRecorder(pp.CompilationVisitor):
+    """
+    Records where each pulse sentence ended relative to the start of its
+    pulse statement. Each statement's entries are preceded by a zero, as a
+    statement whose sentences all end before it starts does not advance.
+    """
+    def __init__(self):
+        self._ends = []
+        self._starts = []
+
+    def visit_advance(self, state, t_start, ends):
+        self._starts.append(len(self._ends))
+        self._ends.append(0)
+        self._ends.extend(end - t_start for end in ends)
+
+    @property
+    def advances(self):
+        return np.array(self._ends, dtype=int), np.array(self._starts, dtype=int)
+
+class _CopyVeloVisitor(pp.CompilationVisitor):
+    """
+    Stands in for `~x6.pulprog.WaveformBuilderVisitor` when the Velo file
+    to be built is identical to one that has already been built.
+    """
+    def __init__(self, filename, velo_file, has_written):
+        self.filename = filename
+        self._velo_file = velo_file
+        self._has_written = has_written
+
+    def visit_timeline(self, state, timeline):
+        pass
+
+    def declare_final_options(self):
+        if self._has_written:
+            return {
+                'tx_play_from_file_enable': str(True),
+                'tx_play_from_file_filename': os.path.basename(self.filename)
+            }
+        else:
+            return {'tx_play_from_file_enable': str(False)}
+
+    def post_compilation(self, sample_rate, active_channels, extra_options, peripheral_id):
+        if self._has_written:
+            shutil.copyfile(self._velo_file, self.filename)
+
+## FRONT-ENDS ##################################################################
+
+def compile_template(source_file, namespace=None, parser='fast'):
+    """
+    Compiles the XPP source in a given file into a
+    `~x6.pulse_template.PulseTemplate`.
+
+    The dependence of the compiled program on each parameter is found by
+    compiling it again with that parameter perturbed, so making a template
+    costs a few compilations per parameter. Parameters whose effect cannot
+    be patched are still accepted by `~x6.pulse_template.instantiate`, but
+    changing them compiles the whole program.
+
+    Perturbing a parameter only shows its effect near its initial value,
+    which is too little to go on when the parameter is used in an
+    arithmetic expression: ``tau / 3`` is truncated to whole samples, and
+    may not change at all over the perturbations. Such parameters, and
+    those from which they are defined, are never patched. This includes
+    sums and integer multiples such as ``tau + 5ns``, which would be exact
+    in whole samples were it not for the compiler truncating each time to
+    a sample after rounding error in the sum.
+
+    :param str source_file: Path to the file containing the xpulprog source.
+    :param dict namespace: Initial values of the parameters, as accepted by
+        `~x6.pulprog.compile_to_directory`.
+    :param str parser: See `~x6.pulprog.parse_program`.
+    :rtype: `~x6.pulse_template.PulseTemplate`
+    """
+    source_file = os.path.abspath(source_file)
+    namespace = pp.mk_namespace_dict(namespace)
+
+    def compile_(trial, resolver=None):
+        recorder = _AdvanceRecorder()
+        timeline = pp.compile_to_timeline(
+            source_file, trial, parser=parser, resolver=resolver, visitors=[recorder]
+        )
+        return timeline, recorder.advances
+
+    resolver = IncludeResolver()
+    base, base_advances = compile_(namespace, resolver)
+
+    # Only the fast parser understands expressions.
+    in_expressions = set()
+    if parser == 'fast':
+        for filename in [source_file] + resolver.resolved_files:
+            in_expressions |= xpp_parser.expression_identifiers(pp.parse_file(filename, parser))
+
+    def perturbed(ident, values):
+        compiled = []
+        for value in values:
+            trial = dict(namespace)
+            trial[ident] = value
+            try:
+                compiled.append(compile_(trial))
+            except Exception:
+                return None
+        return compiled
+
+    time_params = {}
+    value_params = {}
+    waveform_params = {}
+    for ident, value in namespace.iteritems():
+        if ident.name in in_expressions:
+            continue
+        elif isinstance(value, Time):
+            base_samples = int(value._time * base.sample_rate)
+            # Perturb to the middle of a sample, so that rounding in the
+            # compiler cannot move us into a neighbouring one.
+            compiled = perturbed(ident, [
+                Time((base_samples + delta + 0.5) / base.sample_rate) for delta in PERTURBATIONS
+            ])
+            coefs = _time_dependence(base, base_advances, compiled) if compiled else None
+            if coefs is not None:
+                time_params[ident] = (base_samples, coefs)
+
+        elif _is_number(value):
+            values = [value + delta for delta in PERTURBATIONS]
+            compiled = perturbed(ident, values)
+            option_idxs = _value_dependence(base, base_advances, compiled, values) if compiled else None
+            if option_idxs is not None:
+                value_params[ident] = option_idxs
+
+        elif isinstance(value, Waveform):
+            waveform_params[ident] = [
+                idx for idx, waveform in enumerate(base.waveforms) if waveform is value
+            ]
+
+    return PulseTemplate(
+        source_file, namespace, parser, base, base_advances, time_params, value_params, waveform_params
+    )
+
+def instantiate(template, new_values, dirname, overwrite=True):
+    """
+    Writes the compiled program for the given template and parameter values
+    to a directory, as `~x6.pulprog.compile_to_directory` would.
+
+    PRI patterns and options are computed from the template's timeline.
+    The Velo file is copied from an earlier instantiation when the samples
+    sent to the DA channels are unchanged, and is otherwise rebuilt from
+    the timeline. If any value cannot be applied to the template, the
+    program is compiled from scratch.
+
+    :param PulseTemplate template: Template made by
+        `~x6.pulse_template.compile_template`.
+    :param dict new_values: Parameters to change, as a mapping from names
+        to values. Parameters not given keep their values from the template.
+    :param str dirname: Path to the output directory.
+    :param bool overwrite: See `~x6.pulprog.compile_to_directory`.
+    :return: `True` if the template was used, or `False` if the program had
+        to be compiled again.
+    """
+    new_values = pp.mk_namespace_dict(new_values)
+    timeline = template._patch(new_values)
+
+    if timeline is None:
+        namespace = dict(template.namespace)
+        namespace.update(new_values)
+        pp.compile_to_directory(template.source_file, dirname, namespace=namespace, overwrite=overwrite, parser=template.parser)
+        return False
+
+    if os.path.exists(dirname):
+        if overwrite:
+            shutil.rmtree(dirname, ignore_errors=True)
+        else:
+            raise IOError("Folder already exists. Not overwriting.")
+    os.mkdir(dirname)
+
+    velo_filename = os.path.join(dirname, 'waveform.velo')
+    active_channels = tuple(timeline.active_channels)
+    reuse_velo = template._same_waveform_samples(timeline)
+    has_written = bool((
+        template._writes_waveform[timeline.entries['channels']] & (timeline.entries['n_samp'] > 0)
+    ).any()) if len(timeline) else False
+
+    if reuse_velo and active_channels in template._velo_files:
+        waveform_visitor = _CopyVeloVisitor(velo_filename, template._velo_files[active_channels], has_written)
+    else:
+        waveform_visitor = pp.WaveformBuilderVisitor(velo_filename)
+
+    pp.compile_timeline(timeline, pp.MultiVisitor(
+        pp.PRIPatternVisitor(
+            os.path.join(dirname, 'rx.pattern'),
+            os.path.join(dirname, 'tx.pattern')
+        ),
+        waveform_visitor,
+        pp.PulseConfigurationVisitor(
+            os.path.join(dirname, 'pulse.pulse')
+        ),
+        pp.StateVisitor()
+    ))
+
+    if reuse_velo and has_written and active_channels not in template._velo_files:
+        cached = os.path.join(template._velo_dir, "{}.velo".format(len(template._velo_files)))
+        shutil.copyfile(velo_filename, cached)
+        template._velo_files[active_channels] = cached
+
+    return True
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_include_resolver.py: Checks where include statements are found. Run
+#     with ``python -m unittest x6.test_include_resolver``.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from x6.include_resolver import IncludeResolver
+
+## TESTS #######################################################################
+
+class TestResolve(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.path = lambda *names: os.path.join(self._dir, *names)
+        for dirname in ('progs', 'common', 'lib'):
+            os.mkdir(self.path(dirname))
+        for filename in ('common/channels.xpph', 'progs/local.xpph', 'lib/shared.xpph'):
+            open(self.path(filename), 'w').close()
+        self.resolver = IncludeResolver(search_path=[self.path('lib')])
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def test_same_directory(self):
+        self.assertEqual(
+            self.resolver.resolve('local.xpph', self.path('progs')), self.path('progs', 'local.xpph')
+        )
+
+    def test_parent_directory(self):
+        self.assertEqual(
+            self.resolver.resolve('../common/channels.xpph', self.path('progs')),
+            self.path('common', 'channels.xpph')
+        )
+        self.assertEqual(
+            self.resolver.resolve('../progs/../common/channels.xpph', self.path('progs')),
+            self.path('common', 'channels.xpph')
+        )
+
+    def test_search_path(self):
+        self.assertEqual(
+            self.resolver.resolve('shared.xpph', self.path('progs')), self.path('lib', 'shared.xpph')
+        )
+
+    def test_missing(self):
+        with self.assertRaises(IOError):
+            self.resolver.resolve('../common/missing.xpph', self.path('progs'))
+
+if __name__ == "__main__":
+    unittest.main()
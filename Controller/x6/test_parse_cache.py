@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_parse_cache.py: Checks where the parse cache keeps its entries on
+#     disk, and how many. Run with ``python -m unittest x6.test_parse_cache``.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from x6.parse_cache import ParseCache
+
+## CONSTANTS ###################################################################
+
+SOURCE = "define tau = {}ns\ndelay tau\n"
+
+## TESTS #######################################################################
+
+class TestOnDisk(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self._dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def entries(self):
+        return [name for name in os.listdir(self.cache_dir) if name.endswith('.pickle')]
+
+    @unittest.skipIf(sys.platform.startswith('win'), "POSIX permissions only")
+    def test_private_directory(self):
+        ParseCache(self.cache_dir).parse_source(SOURCE.format(1))
+        self.assertEqual(os.stat(self.cache_dir).st_mode & 0777, 0700)
+        self.assertEqual(len(self.entries()), 1)
+        cache = ParseCache(self.cache_dir)
+        self.assertIsNotNone(cache._load(cache._key(SOURCE.format(1))))
+
+    @unittest.skipIf(sys.platform.startswith('win'), "POSIX permissions only")
+    def test_shared_directory_unused(self):
+        os.mkdir(self.cache_dir)
+        os.chmod(self.cache_dir, 0777)
+        cache = ParseCache(self.cache_dir)
+        cache.parse_source(SOURCE.format(1))
+        self.assertEqual(self.entries(), [])
+
+        # Nor are entries planted by another user loaded.
+        key = cache._key(SOURCE.format(2))
+        with open(os.path.join(self.cache_dir, key + '.pickle'), 'wb') as f:
+            f.write('garbage')
+        self.assertIsNone(ParseCache(self.cache_dir)._load(key))
+
+    def test_trimmed_to_max_size(self):
+        cache = ParseCache(self.cache_dir, max_size=0)
+        cache.parse_source(SOURCE.format(1))
+        self.assertEqual(self.entries(), [])
+
+        cache = ParseCache(self.cache_dir)
+        for n in xrange(5):
+            cache.parse_source(SOURCE.format(n))
+        sizes = [os.path.getsize(os.path.join(self.cache_dir, name)) for name in self.entries()]
+        for name in self.entries():
+            os.utime(os.path.join(self.cache_dir, name), (0, 0))
+
+        # Loading the first entry makes it the most recently used, so that
+        # storing a sixth evicts two of the others.
+        cache = ParseCache(self.cache_dir, max_size=sum(sizes) - 1)
+        cache.parse_source(SOURCE.format(0))
+        cache.parse_source(SOURCE.format(5))
+        self.assertEqual(len(self.entries()), 4)
+        self.assertIn(cache._key(SOURCE.format(0)) + '.pickle', self.entries())
+        self.assertIn(cache._key(SOURCE.format(5)) + '.pickle', self.entries())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_pulse_template.py: Checks that instantiating a pulse template writes
+#     the same outputs as compiling the program from scratch. Run with
+#     ``python -m unittest x6.test_pulse_template``.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import shutil
+import hashlib
+import ConfigParser
+import tempfile
+import unittest
+
+import numpy as np
+
+from x6 import pulprog as pp
+from x6 import pulse_template as pt
+from x6.xpp_types import Time
+
+## CONSTANTS ###################################################################
+
+# Each pulse statement is advanced by whichever of its sentences is longer,
+# so the times of later pulses are only affine in w between 20ns and 50ns.
+PROGRAM = """\
+option sample_rate = 1000
+define DA2 = channel("DA2", analog)
+define DAC0_DIO0 = channel("DAC0_DIO0", digital)
+define DAC0_DIO1 = channel("DAC0_DIO1", digital)
+define g = waveform("%s")
+(w:g):DA2, (50ns:true):DAC0_DIO0
+delay 100ns
+repeat 3 {
+    (w:g):DA2, (20ns:true):DAC0_DIO1
+    delay 10ns
+}
+(10ns:true):DAC0_DIO1
+"""
+
+# tau / 3 is truncated to whole samples, so that perturbing tau by a sample
+# or two may not change the program at all.
+EXPRESSION_PROGRAM = """\
+option sample_rate = 1000
+define DAC0_DIO0 = channel("DAC0_DIO0", digital)
+define ADC0_DIO0 = channel("ADC0_DIO0", digital)
+(tau / 3:true):DAC0_DIO0
+delay 15ns
+(100ns:true):ADC0_DIO0
+"""
+
+## FUNCTIONS ###################################################################
+
+def ns(n):
+    return Time(n * 1e-3)
+
+def output_digests(dirname):
+    digests = {}
+    for filename in os.listdir(dirname):
+        with open(os.path.join(dirname, filename), 'rb') as f:
+            digests[filename] = hashlib.md5(f.read()).hexdigest()
+    return digests
+
+def pattern_value(filename, section):
+    pattern = ConfigParser.RawConfigParser()
+    pattern.read(filename)
+    return int(pattern.get(section, 'P0'))
+
+## TESTS #######################################################################
+
+class _TemplateTestCase(unittest.TestCase):
+    # Makes a template of the program with the given namespace.
+    program = None
+    namespace = None
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.path = lambda filename: os.path.join(self._dir, filename)
+        np.save(self.path('wf.npy'), np.linspace(-1, 1, 128))
+        with open(self.path('prog.xpp'), 'w') as f:
+            f.write(self.program.replace('%s', self.path('wf.npy')))
+        self.template = pt.compile_template(self.path('prog.xpp'), self.namespace)
+
+    def tearDown(self):
+        self.template.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def assertMatchesCompile(self, values):
+        used = pt.instantiate(self.template, values, self.path('from_template'))
+        pp.compile_to_directory(self.path('prog.xpp'), self.path('from_source'), namespace=values)
+        self.assertEqual(output_digests(self.path('from_template')), output_digests(self.path('from_source')))
+        return used
+
+class TestInstantiate(_TemplateTestCase):
+
+    program = PROGRAM
+    namespace = {'w': ns(40)}
+
+    def test_affine_values_use_template(self):
+        self.assertEqual(self.template.parameters, ['w'])
+        for w in (20, 40, 45, 50):
+            self.assertTrue(self.assertMatchesCompile({'w': ns(w)}), w)
+
+    def test_longer_sentence_recompiles(self):
+        # Past 50ns, the pulse on DA2 sets how far the first statement
+        # advances, and below 20ns it no longer sets how far the statement
+        # in the repeat block advances.
+        for w in (51, 77, 19, 10):
+            self.assertFalse(self.assertMatchesCompile({'w': ns(w)}), w)
+
+class TestExpressions(_TemplateTestCase):
+
+    program = EXPRESSION_PROGRAM
+    namespace = {'tau': ns(30)}
+
+    def test_expression_parameter_recompiles(self):
+        self.assertEqual(self.template.parameters, [])
+        for tau in (30, 31, 60):
+            self.assertFalse(self.assertMatchesCompile({'tau': ns(tau)}), tau)
+
+    def test_truncated_width(self):
+        # Fitting tau / 3 around 30ns would give a width of 10 samples and an
+        # RX delay of 25 samples here.
+        pt.instantiate(self.template, {'tau': ns(60)}, self.path('from_template'))
+        self.assertEqual(pattern_value(self.path('from_template/tx.pattern'), 'Width'), 20)
+        self.assertEqual(pattern_value(self.path('from_template/rx.pattern'), 'Delay'), 35)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# test_xpp_parser.py: Checks that the hand-written parser in xpp_parser.py
+#     agrees with the PyParsing grammar in pulprog.py, except where it is
+#     documented to differ, and that it parses arithmetic expressions. Run
+#     with ``python -m unittest x6.test_xpp_parser``.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pyparsing as pp
+
+# check_conformance imports the PyParsing grammar when first called, which
+# fails after a test changes the working directory if that is how x6 is found.
+import x6.pulprog
+from x6 import xpp_parser
+from x6.xpp_parser import check_conformance, XPPSyntaxError
+from x6.xpp_types import Identifier, Expression, Time
+
+## CONSTANTS ###################################################################
+
+CHANNELS_HEADER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'channels.xpph')
+
+PROGRAM = """\
+;; A program using each kind of statement.
+include "channels.xpph"
+option sample_rate = 1000
+option tx_period = 10ms
+define trig = channel("DAC0_DIO1", digital)
+define iq = iqchannel(DA0, DA2)
+define wf = waveform("wf_i.npy")
+define iqw = iqwaveform("wf_i.npy", "wf_q.npy")
+define ph = [0, 1, 2, 3] / 4
+define tau = 30ns
+define amp = 2.5
+define flag = true
+
+(100ns:wf):DA1
+delay tau
+(phase ph, 20ns:iqw, delay 5ns, 10ns:iqw):iq, (50ns:true):trig
+(10ns:true):(DAC0_DIO0, DAC0_DIO2)   ; several channels at once
+ipp
+repeat 5 {
+    (phase [0, 2] / 4, 25ns:iqw):iq, (1us:true):ADC0_DIO0
+    delay 10ns
+    ipp
+}
+print "Done."
+print tau
+"""
+
+## TESTS #######################################################################
+
+class TestConformance(unittest.TestCase):
+
+    def setUp(self):
+        # The PyParsing grammar loads waveforms while parsing, relative to
+        # the working directory.
+        self._cwd = os.getcwd()
+        self._dir = tempfile.mkdtemp()
+        np.save(os.path.join(self._dir, 'wf_i.npy'), np.linspace(-1, 1, 16))
+        np.save(os.path.join(self._dir, 'wf_q.npy'), np.linspace(1, -1, 16))
+        os.chdir(self._dir)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def test_channels_header(self):
+        with open(CHANNELS_HEADER, 'r') as f:
+            check_conformance(f.read())
+
+    def test_program(self):
+        check_conformance(PROGRAM)
+
+    def test_program_statements(self):
+        kinds = set(stmt[0] for stmt in xpp_parser._normalize_statements(xpp_parser.parse(PROGRAM)))
+        self.assertEqual(kinds, set([
+            'incl_statement', 'option_statement', 'define_statement', 'pulse_statement',
+            'delay_statement', 'repeat_statement', 'ipp_statement', 'print_statement'
+        ]))
+
+class TestDeliberateDifferences(unittest.TestCase):
+
+    def assertDiffers(self, source):
+        with self.assertRaises((AssertionError, pp.ParseException)):
+            check_conformance(source)
+
+    def fast_parse(self, source):
+        return xpp_parser._normalize_statements(xpp_parser.parse(source))
+
+    def test_leading_zero_decimal(self):
+        source = "define x = 2.05\n"
+        self.assertDiffers(source)
+        self.assertEqual(self.fast_parse(source), (
+            ('define_statement', ('identifier', 'x'), 2.05),
+        ))
+
+    def test_identifier_starting_with_boolean(self):
+        source = "define offset = 5ns\ndelay offset\n"
+        self.assertDiffers(source)
+        stmts = xpp_parser.parse(source)
+        self.assertEqual(stmts[0].ident, Identifier('offset'))
+        self.assertEqual(self.fast_parse(source)[1], ('delay_statement', ('identifier', 'offset')))
+
+    def test_whitespace_around_colon(self):
+        header = 'define d = channel("DA0", analog)\n'
+        self.assertDiffers(header + "(10ns : true) : d\n")
+        self.assertEqual(
+            self.fast_parse(header + "(10ns : true) : d\n"),
+            self.fast_parse(header + "(10ns:true):d\n")
+        )
+
+    def test_whitespace_around_comma(self):
+        header = 'define a = channel("DA0", analog)\ndefine b = channel("DA2", analog)\n'
+        for spaced, plain in [
+                ("(10ns:true):a,(10ns:true):b\n", "(10ns:true):a, (10ns:true):b\n"),
+                ("(10ns:true):a ,(10ns:true):b\n", "(10ns:true):a, (10ns:true):b\n"),
+                ("define iq = iqchannel(a,b)\n", "define iq = iqchannel(a, b)\n")
+            ]:
+            self.assertDiffers(header + spaced)
+            check_conformance(header + plain)
+            self.assertEqual(self.fast_parse(header + spaced), self.fast_parse(header + plain))
+
+class TestExpressions(unittest.TestCase):
+
+    def define(self, expression):
+        return xpp_parser.parse("define x = {}\n".format(expression))[0].value
+
+    def assertSyntaxError(self, expression, message):
+        with self.assertRaises(XPPSyntaxError) as cm:
+            self.define(expression)
+        self.assertIn(message, str(cm.exception))
+
+    def test_precedence(self):
+        self.assertEqual(self.define("1 + 2 * 3"), 7)
+        self.assertEqual(self.define("(1 + 2) * 3"), 9)
+        self.assertEqual(self.define("10 - 4 - 3"), 3)
+        self.assertEqual(self.define("12 / 3 / 2"), 2)
+
+    def test_unary_minus(self):
+        self.assertEqual(self.define("-2 + 5"), 3)
+        self.assertEqual(self.define("-(1 + 2) * 2"), -6)
+        self.assertEqual(self.define("--4"), 4)
+
+    def test_folds_times(self):
+        value = self.define("2 * 10ns + 5ns")
+        self.assertIsInstance(value, Time)
+        self.assertAlmostEqual(value._time, Time(25e-3)._time)
+        self.assertAlmostEqual(self.define("30ns / 3")._time, Time(10e-3)._time)
+        self.assertEqual(self.define("10ns / 5ns"), 2)
+
+    def test_keeps_identifiers(self):
+        value = self.define("tau * 2 + 1ns")
+        self.assertIsInstance(value, Expression)
+        self.assertEqual(xpp_parser._normalize(value), (
+            'expression', '+', ('expression', '*', ('identifier', 'tau'), 2), ('time', 1e-3)
+        ))
+        self.assertEqual(xpp_parser._normalize(self.define("-tau")), ('expression', 'neg', ('identifier', 'tau')))
+
+    def test_evaluate(self):
+        value = self.define("(tau - 10ns) / 2")
+        result = value.evaluate(lambda operand: Time(30e-3) if operand == Identifier('tau') else operand)
+        self.assertAlmostEqual(result._time, Time(10e-3)._time)
+
+    def test_time_and_number_rejected(self):
+        self.assertSyntaxError("1ns + 1", 'Cannot apply "+" to a time and a number')
+        self.assertSyntaxError("1 - 1ns", 'Cannot apply "-" to a number and a time')
+        self.assertSyntaxError("10ns * 2ns", 'Cannot apply "*" to a time and a time')
+
+    def test_division_by_zero(self):
+        self.assertSyntaxError("1 / 0", "Division by zero")
+        self.assertSyntaxError("10ns / (5 - 5)", "Division by zero")
+
+    def test_incomplete(self):
+        self.assertSyntaxError("1 +", "Expected value")
+        self.assertSyntaxError("(1 + 2", 'Expected ")"')
+
+    def test_expression_identifiers(self):
+        stmts = xpp_parser.parse(
+            "define t2 = tau\n"
+            "define t4 = t2 + 5ns\n"
+            "repeat 2 {\n"
+            "    delay t4 / 3\n"
+            "}\n"
+            "delay w\n"
+        )
+        self.assertEqual(xpp_parser.expression_identifiers(stmts), set(['t4', 't2', 'tau']))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# timeline.py: Columnar representation of the pulses produced by compiling
+#     an xpulprog program.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import numpy as np
+
+from x6 import CHANNELS
+from x6.xpp_types import IQChannel
+
+## CONSTANTS ###################################################################
+
+#: Bit assigned to each pin in the ``mask`` field of a timeline entry.
+CHANNEL_BITS = {pin: 1 << idx for idx, pin in enumerate(CHANNELS)}
+
+#: Data type of each entry in `~x6.timeline.Timeline.entries`.
+#:
+#: ``t`` and ``n_samp`` are the start and length of the pulse in samples,
+#: ``mask`` has a bit set for each pin used by the pulse (see
+#: `~x6.timeline.CHANNEL_BITS`), and ``channels``, ``waveform`` and
+#: ``phase`` index into the channel set, waveform and phase tables of the
+#: timeline.
+TIMELINE_DTYPE = np.dtype([
+    ('t', np.int64),
+    ('n_samp', np.int64),
+    ('mask', np.uint32),
+    ('channels', np.int32),
+    ('waveform', np.int32),
+    ('phase', np.int32),
+])
+
+#: Data type of the arrays returned by `~x6.timeline.Timeline.pri_entries`.
+PRI_ENTRY_DTYPE = np.dtype([
+    ('destination', np.int64),
+    ('delay', np.int64),
+    ('width', np.int64),
+])
+
+## FUNCTIONS ###################################################################
+
+def channel_pins(channel):
+    """
+    Returns the names of the pins driven by the given channel.
+    """
+    if isinstance(channel, IQChannel):
+        return [channel._ch_i._pin_name, channel._ch_q._pin_name]
+    return [channel._pin_name]
+
+def first_occurrences(entries):
+    """
+    Returns the distinct rows of a structured array, in the order in which
+    each first occurs.
+    """
+    if len(entries) == 0:
+        return entries
+    _, idx_first = np.unique(entries, return_index=True)
+    return entries[np.sort(idx_first)]
+
+## CLASSES #####################################################################
+
+class Timeline(object):
+    """
+    The pulses of a compiled program, stored as one
+    `~x6.timeline.TIMELINE_DTYPE` entry per pulse expression, along with
+    the tables that the entries index into. Passes over a timeline can work
+    on whole columns with NumPy rather than on one pulse at a time.
+
+    Timelines are normally built by `~x6.pulprog.TimelineVisitor`, or by
+    `~x6.pulprog.compile_to_timeline`.
+
+    :param np.ndarray entries: Array of `~x6.timeline.TIMELINE_DTYPE`.
+    :param list channel_sets: Tuples of the channels used by each pulse.
+    :param list waveforms: Waveforms used by the pulses.
+    :param list phases: ``(phase, n_parts)`` pairs used by the pulses.
+    :param list options: ``(index, name, value)`` triples recording each
+        option statement and the number of entries preceding it.
+    """
+
+    def __init__(self, entries, channel_sets, waveforms, phases, options=(),
+            sample_rate=None, active_channels=None
+        ):
+        self.entries = entries
+        self.channel_sets = list(channel_sets)
+        self.waveforms = list(waveforms)
+        self.phases = list(phases)
+        self.options = list(options)
+        self.sample_rate = sample_rate
+        self.active_channels = active_channels
+
+        # The PRI destination of each channel set, or -1 if the set has no
+        # RX (respectively, TX) channels.
+        self._rx_codes = np.array([self._pri_code(chs, True) for chs in self.channel_sets], dtype=np.int64)
+        self._tx_codes = np.array([self._pri_code(chs, False) for chs in self.channel_sets], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "<Timeline {} pulses, {} waveforms>".format(len(self.entries), len(self.waveforms))
+
+    @staticmethod
+    def _pri_code(channels, rx):
+        codes = [ch.pri_code for ch in channels if ch.is_rx == rx]
+        return reduce(lambda a, b: a | b, codes) if codes else -1
+
+    @property
+    def end(self):
+        """
+        Time, in samples, at which the last pulse ends.
+        """
+        if len(self.entries) == 0:
+            return 0
+        return int((self.entries['t'] + self.entries['n_samp']).max())
+
+    def pri_codes(self, rx=False):
+        """
+        Returns the RX or TX PRI destination of every entry, with -1 marking
+        entries that have no channel of that kind.
+        """
+        codes = self._rx_codes if rx else self._tx_codes
+        if len(codes) == 0:
+            return np.empty(0, dtype=np.int64)
+        return codes[self.entries['channels']]
+
+    def pri_entries(self, rx=False):
+        """
+        Returns the entries of the RX or TX PRI pattern described by this
+        timeline as an array of `~x6.timeline.PRI_ENTRY_DTYPE`. As with
+        `~x6.pulprog.PRIPatternVisitor`, repeated entries are kept only
+        where they first occur.
+        """
+        codes = self.pri_codes(rx)
+        keep = codes >= 0
+        pri = np.empty(np.count_nonzero(keep), dtype=PRI_ENTRY_DTYPE)
+        pri['destination'] = codes[keep]
+        pri['delay'] = self.entries['t'][keep]
+        pri['width'] = self.entries['n_samp'][keep]
+        return first_occurrences(pri)
+
+    def used_pins(self):
+        """
+        Returns the names of all pins used by at least one pulse.
+        """
+        mask = int(np.bitwise_or.reduce(self.entries['mask'])) if len(self.entries) else 0
+        return [pin for pin in CHANNELS if mask & CHANNEL_BITS[pin]]
+
+    def replay(self, visitor, state, options=True):
+        """
+        Calls ``visitor`` with each pulse and option in the order in which the
+        compiler produced them, so that visitors written against
+        `~x6.pulprog.CompilationVisitor` can consume a timeline.
+        
+        :param bool options: If `False`, only pulses are replayed.
+        """
+        options = iter(self.options if options else ())
+        next_option = next(options, None)
+        for idx, entry in enumerate(self.entries.tolist()):
+            while next_option is not None and next_option[0] <= idx:
+                visitor.visit_option(state, next_option[1], next_option[2])
+                next_option = next(options, None)
+            t, n_samp, _, ch_idx, wf_idx, ph_idx = entry
+            visitor.visit_pulseexpr(
+                state, list(self.channel_sets[ch_idx]), t, n_samp,
+                self.waveforms[wf_idx], self.phases[ph_idx]
+            )
+        while next_option is not None:
+            visitor.visit_option(state, next_option[1], next_option[2])
+            next_option = next(options, None)
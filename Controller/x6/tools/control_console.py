@@ -26,7 +26,7 @@ import subprocess
 
 from PySide import QtGui
 from x6.tools.ui import control_gui
-from x6 import pulplot, pulprog, utils
+from x6 import pulplot, pulprog, utils, compile_server
 
 import ConfigParser as cp
 
@@ -144,28 +144,34 @@ class MainWindow(QtGui.QMainWindow):
             self._compile_dirty = True
             self._conf_dirty = True
             
-            # Delete any previous compilation attempts, ignoring errors.
-            # It's a temporary directory after all.
-            if self._compile_dir is not None:
-                try:
-                    shutil.rmtree(self._compile_dir)
-                except:
-                    pass
-                
-            # Make a new directory to hold the compiled output.
-            self._compile_dir = tempfile.mkdtemp()
+            # Compile into the same directory each time, so that only the
+            # outputs affected by a change are rebuilt.
+            if self._compile_dir is None:
+                self._compile_dir = tempfile.mkdtemp()
             self.console_print("Compiling to {}...".format(self._compile_dir))
             
-            # Find and open the source file.
-            with open(pulseprog_file, 'r') as source_file:
-                
-                # Actually perform the compilation.
-                pulprog.compile_to_directory(source_file, self._compile_dir)
+            # Compile on a compile server if one is running, so that this
+            # process is spared the parsing and waveform building.
+            client = compile_server.connect()
+            if client is not None:
+                with client:
+                    rebuilt = client.compile(
+                        pulseprog_file, self._compile_dir, progress=self.console_print
+                    )['rebuilt']
+            else:
+                # Find and open the source file.
+                with open(pulseprog_file, 'r') as source_file:
+                    
+                    # Actually perform the compilation.
+                    rebuilt = pulprog.compile_incremental(source_file, self._compile_dir)
             
             # Mark that we completed successfully.
             self._compile_dirty = False
             
-            self.console_print('Done.')
+            if rebuilt:
+                self.console_print('Done; rebuilt {}.'.format(", ".join(rebuilt)))
+            else:
+                self.console_print('Done; already up to date.')
             
         except Exception as ex:
             self.report("compiling", ex)
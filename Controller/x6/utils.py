@@ -17,6 +17,9 @@ import StringIO
 import numpy as np
 import scipy.io as sio
 import os, sys
+import shutil
+import threading
+import uuid
 #import x6 as x6
 
 from contextlib import contextmanager
@@ -38,6 +41,14 @@ def strip_spaces_from_ini(filename):
             else:
                 fp.write(line + "\n")
 
+@contextmanager
+def null_context():
+    """
+    Context manager that does nothing, for use where a context manager is
+    only sometimes needed.
+    """
+    yield
+
 def mk_named_temp():
     f = tf.NamedTemporaryFile(delete=False)
     f.close()
@@ -58,6 +69,83 @@ def working_directory(new_wd):
     os.chdir(new_wd)
     yield
     os.chdir(old_wd)
+
+def _sibling_path(dirname, tag):
+    parent, name = os.path.split(dirname)
+    return os.path.join(parent, '.{}.{}-{}'.format(name, tag, uuid.uuid4().hex[:12]))
+
+@contextmanager
+def staged_directory(dirname, overwrite=True):
+    """
+    Yields the path of a new, empty directory beside ``dirname`` in which to
+    build the new contents of ``dirname``. If the context block succeeds,
+    the staging directory is renamed to ``dirname``, replacing any directory
+    already there. Otherwise, the staging directory is removed, and
+    ``dirname`` is left as it was.
+    
+    Since the staging directory is on the same filesystem as ``dirname``,
+    anything reading ``dirname`` sees either all of its old contents or all
+    of its new contents, and never a partial update. When replacing a
+    directory, the old directory is first renamed out of the way, so that
+    ``dirname`` is briefly missing between the two renames.
+    
+    :param str dirname: Path to the directory to create or replace.
+    :param bool overwrite: If `False`, `IOError` is raised rather than
+        replacing an existing directory.
+    :raises OSError: if either directory cannot be renamed, such as when
+        files in them are open on Windows. The old directory is then left
+        in place.
+    """
+    dirname = os.path.abspath(dirname)
+    if os.path.exists(dirname) and not overwrite:
+        raise IOError("Folder already exists. Not overwriting.")
+    parent = os.path.dirname(dirname)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+        
+    staging = _sibling_path(dirname, 'staging')
+    os.mkdir(staging)
+    try:
+        yield staging
+        
+        if not os.path.exists(dirname):
+            os.rename(staging, dirname)
+        elif not overwrite:
+            raise IOError("Folder already exists. Not overwriting.")
+        else:
+            retired = _sibling_path(dirname, 'old')
+            os.rename(dirname, retired)
+            try:
+                os.rename(staging, dirname)
+            except OSError:
+                # Put the old directory back rather than leave none at all.
+                os.rename(retired, dirname)
+                raise
+            shutil.rmtree(retired, ignore_errors=True)
+    finally:
+        if os.path.exists(staging):
+            shutil.rmtree(staging, ignore_errors=True)
+
+def call_in_threads(functions):
+    """
+    Calls each of a sequence of functions with no arguments in a thread of
+    its own, returning once all have returned. If any raise an exception,
+    the first to do so is re-raised once every thread has finished.
+    """
+    errors = []
+    def run(function):
+        try:
+            function()
+        except Exception:
+            errors.append(sys.exc_info())
+            
+    threads = [threading.Thread(target=run, args=(function,)) for function in functions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
     
 def find_on_path(filename):
     """
@@ -345,6 +433,210 @@ class PRIPatternParser(cp.SafeConfigParser):
     def optionxform(self, option):
         return str(option)
 
+class PRIPattern(object):
+    """
+    A pattern for the X6 PRI, stored as three integer arrays giving the
+    destination, delay and width of each pulse.
+    
+    Unlike `~x6.utils.PRIPatternParser`, which keeps each pulse as strings
+    in a `ConfigParser`, this class appends, sorts and merges pulses with
+    array operations, and reads and writes pattern files in a single pass.
+    Written files use the ``key=value`` form without spaces that the X6
+    requires.
+    
+    :param str filename: If given, the pattern file to read, and the default
+        file for `write`.
+    """
+    
+    DESTINATION = PRIPatternParser.DESTINATION
+    DELAY = PRIPatternParser.DELAY
+    WIDTH = PRIPatternParser.WIDTH
+    ARRAY_SIZE = PRIPatternParser.ARRAY_SIZE
+    
+    SECTIONS = PRIPatternParser.SECTIONS
+    
+    DATA_TYPE = np.int64
+    
+    def __init__(self, filename=None):
+        self._filename = filename
+        self._size = 0
+        self._data = np.zeros((3, 16), dtype=self.DATA_TYPE)
+        
+        if filename is not None and os.path.exists(filename):
+            self.read(filename)
+            
+    @classmethod
+    def from_arrays(cls, destination, delay, width, filename=None):
+        """
+        Returns a new pattern containing the given pulses.
+        """
+        pattern = cls(filename=None)
+        pattern._filename = filename
+        pattern.extend(destination, delay, width)
+        return pattern
+        
+    def __len__(self):
+        return self._size
+        
+    def __repr__(self):
+        return "<PRIPattern {} pulses>".format(self._size)
+        
+    ## ARRAYS ##
+    
+    @property
+    def destination(self):
+        return self._data[0, :self._size]
+        
+    @property
+    def delay(self):
+        return self._data[1, :self._size]
+        
+    @property
+    def width(self):
+        return self._data[2, :self._size]
+        
+    def _reserve(self, size):
+        if size > self._data.shape[1]:
+            capacity = max(size, 2 * self._data.shape[1])
+            data = np.zeros((3, capacity), dtype=self.DATA_TYPE)
+            data[:, :self._size] = self._data[:, :self._size]
+            self._data = data
+            
+    ## PULSES ##
+    
+    def get_array_size(self):
+        return self._size
+        
+    def append_pulse(self, destination, delay, width):
+        self._reserve(self._size + 1)
+        self._data[:, self._size] = (destination, delay, width)
+        self._size += 1
+        
+    def extend(self, destination, delay, width):
+        """
+        Appends many pulses at once. Each argument may be a scalar or an
+        array, and they are broadcast together.
+        """
+        destination, delay, width = np.broadcast_arrays(destination, delay, width)
+        n_new = destination.size
+        self._reserve(self._size + n_new)
+        for row, values in enumerate((destination, delay, width)):
+            self._data[row, self._size:self._size + n_new] = values.ravel()
+        self._size += n_new
+        
+    def set_pulse(self, pulse_num, destination, delay, width):
+        if pulse_num >= self._size:
+            raise ValueError('Your pulse_num is out of bounds; it cannot be greater than ArraySize-1={}'.format(self._size - 1))
+        self._data[:, pulse_num] = (destination, delay, width)
+        
+    def get_pulse(self, pulse_num):
+        if pulse_num >= self._size:
+            raise ValueError('Your pulse_num is out of bounds; it cannot be greater than ArraySize-1={}'.format(self._size - 1))
+        return tuple(int(x) for x in self._data[:, pulse_num])
+        
+    def get_all_pulses(self):
+        return zip(*self._data[:, :self._size].tolist())
+        
+    def clear(self):
+        self._size = 0
+        
+    def sort(self):
+        """
+        Sorts the pulses by delay, keeping pulses with equal delays in their
+        current order.
+        """
+        order = np.argsort(self.delay, kind='mergesort')
+        self._data[:, :self._size] = self._data[:, order]
+        
+    def merge(self, other):
+        """
+        Adds the pulses of another pattern to this one, and sorts the result
+        by delay.
+        
+        :param PRIPattern other: The pattern to merge into this one.
+        """
+        self.extend(other.destination, other.delay, other.width)
+        self.sort()
+        
+    ## FILES ##
+    
+    def read(self, filename=None):
+        """
+        Replaces the pulses in this pattern by those in a pattern file.
+        """
+        filename = self._filename if filename is None else filename
+        if filename is None:
+            raise ValueError('There is no file to read from.')
+            
+        sections = {}
+        section = None
+        with open(filename, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] in '#;':
+                    continue
+                if line[0] == '[' and line[-1] == ']':
+                    section = sections.setdefault(line[1:-1], {})
+                    continue
+                if section is None or '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                section[key.strip()] = value.strip()
+        
+        if not all(name in sections for name in self.SECTIONS):
+            if any(name in sections for name in self.SECTIONS):
+                warnings.warn('Only some of the required sections were found in the pattern file. This will likely result in indexing errors.')
+        
+        array_sizes = [int(sections.get(name, {}).get(self.ARRAY_SIZE, 0)) for name in self.SECTIONS]
+        if len(set(array_sizes)) > 1:
+            warnings.warn('The ArraySize in the Destination, Delay, and Width sections are not equal.')
+        size = array_sizes[0]
+        
+        self._size = 0
+        self._reserve(size)
+        for row, name in enumerate(self.SECTIONS):
+            values = sections.get(name, {})
+            self._data[row, :size] = [int(values['P{}'.format(idx)], 0) for idx in xrange(size)]
+        self._size = size
+        
+    def dumps(self):
+        """
+        Returns the contents of the pattern file for this pattern.
+        """
+        header = 'ArraySize={}\n'.format(self._size)
+        keys = ['P{}='.format(idx) for idx in xrange(self._size)]
+        chunks = []
+        for name, fmt, values in (
+                (self.DESTINATION, '{}{:#x}\n', self.destination),
+                (self.DELAY, '{}{}\n', self.delay),
+                (self.WIDTH, '{}{}\n', self.width)
+            ):
+            chunks.append('[{}]\n'.format(name))
+            chunks.append(header)
+            chunks.append(''.join(fmt.format(key, value) for key, value in zip(keys, values.tolist())))
+            chunks.append('\n')
+        return ''.join(chunks)
+        
+    def write(self, file=None):
+        """
+        Writes this pattern to the given file, or to the file it was read
+        from.
+        
+        :type file: `str` containing a path, or `file`-like
+        """
+        if file is None:
+            if self._filename is None:
+                raise ValueError('There is no file to write to.')
+            file = self._filename
+        if isinstance(file, basestring):
+            with open(file, 'w') as f:
+                f.write(self.dumps())
+        else:
+            file.write(self.dumps())
+            
+    def cat(self):
+        print self.dumps()
+
 class X6Settings(object):
     """
     A class for dealing with the settings file. We choose not to just 
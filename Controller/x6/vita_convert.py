@@ -18,6 +18,7 @@ logger.addHandler(logging.NullHandler())
 ## IMPORTS ##
 
 import numpy as np
+import tempfile as tf
 import warnings
 import itertools
 
@@ -36,6 +37,11 @@ except ImportError:
 VITA_PACKET_SIZE = int( '0xF000', 16) * 4
 VELO_PACKET_SIZE = int('0x10000', 16) * 4
 
+# Bytes added to the data of each Vita packet by its header and trailer,
+# and to each Velo packet by its header.
+VITA_OVERHEAD_SIZE = 8 * 4
+VELO_HEADER_SIZE = 4 * 4
+
 VELO_HEADER_FORMAT = \
     "uintle:24=velo_packet_size, uintle:8=peripheral_id, pad:32, pad:32, pad:32"
 VITA_IF_WORD_FORMAT = \
@@ -149,10 +155,15 @@ class VitaReader(object):
     """
     A utility class that reads from a file-like object into one
     or more NumPy arrays containing samples.
+    
+    :param bool mmap: If `True`, each stream is spooled to a temporary file
+        and `~x6.vita_convert.VitaReader.asarrays` returns read-only memory
+        maps of those files instead of arrays held in memory.
     """
 
-    def __init__(self):
+    def __init__(self, mmap=False):
         self._streams = {}
+        self._mmap = mmap
 
     def fromstream(self, stream_file):
         """
@@ -164,16 +175,28 @@ class VitaReader(object):
 
         for stream_id, vita_packet_data in _packetize_vita_stream(stream_file):
             if stream_id not in self._streams:
-                self._streams[stream_id] = StringIO()
+                self._streams[stream_id] = tf.TemporaryFile() if self._mmap else StringIO()
                 
             self._streams[stream_id].write(vita_packet_data)
                 
 
     def asarrays(self):
-        return {
-            hex(stream_id): np.fromstring(sio.getvalue(), dtype="<i2")
-            for stream_id, sio in self._streams.iteritems()
-        }
+        if not self._mmap:
+            return {
+                hex(stream_id): np.fromstring(sio.getvalue(), dtype="<i2")
+                for stream_id, sio in self._streams.iteritems()
+            }
+            
+        arrays = {}
+        for stream_id, spool in self._streams.iteritems():
+            spool.flush()
+            n_samples = spool.tell() // 2
+            if n_samples == 0:
+                # Empty files cannot be memory-mapped.
+                arrays[hex(stream_id)] = np.empty(0, dtype="<i2")
+            else:
+                arrays[hex(stream_id)] = np.memmap(spool, dtype="<i2", mode='r', shape=(n_samples,))
+        return arrays
 
 class VeloReader(object): # <- maybe make this inherit from IOBase?
     """
@@ -236,13 +259,17 @@ class VeloVitaPacker(object):
     """
     A utility class for packing vita packets into a file in velo chunks
     
-    :param filename: The filename to pack the data into
-    :type filename: `str`
+    :param filename: The filename to pack the data into, or an open
+        `file`-like object to write the packed data to.
+    :type filename: `str` or `file`-like
     :param peripheral_id: The X6 PID
     :type peripheral_id: `int`
     """
     def __init__(self, filename, peripheral_id=0):
-        self._file = open(filename, 'wb')
+        if isinstance(filename, str):
+            self._file = open(filename, 'wb')
+        else:
+            self._file = filename
         self._buffer = bs.BitArray('')
         self._peripheral_id = peripheral_id
         
@@ -321,7 +348,7 @@ def _packetize_vita_stream(stream_file):
 
 ## FUNCTIONS ##
 
-def parse_velo_stream(stream_filename='Data.bin'):
+def parse_velo_stream(stream_filename='Data.bin', mmap=False):
     """
     Given a file containing an encapsulated Velocia stream,
     unpacks the encoded Vita streams and returns them as
@@ -333,10 +360,12 @@ def parse_velo_stream(stream_filename='Data.bin'):
     II documentation.
 
     :param str stream_filename: Path to the stream file to load.
+    :param bool mmap: If `True`, the decoded streams are returned as
+        memory maps of temporary files rather than as in-memory arrays.
     :return: A dictionary from Vita stream IDs to NumPy arrays.        
     """
 
-    vita_r = VitaReader()
+    vita_r = VitaReader(mmap=mmap)
 
     with open(stream_filename, 'rb') as f:
         velo_r = VeloReader(f)
@@ -382,34 +411,31 @@ def vita_trailer(padding=0):
 def repeat_iter(i):
     return itertools.chain.from_iterable(itertools.repeat(i))
        
-def rawbin_to_velo(velo_filename, rawbin_file_dict, peripheral_id):
+def iter_vita_packets(stream_chunks):
     """
-    Converts raw binary waveforms into vita packets spliced into velo packets 
-    and saves this new binary to disk.
+    Given the raw binary data of one or more streams, each broken up into
+    chunks of at most `VITA_PACKET_SIZE` bytes, yields Vita packets that
+    alternate between the streams in the order given. This is the packet
+    ordering used by `~x6.vita_convert.rawbin_to_velo`.
     
-    :param str velo_filename: File name of the output velo packets binary.
-    :param rawbin_file_dict: A dictionary associating stream IDs to raw binary 
-        file names.
-    :type rawbin_file_dict: A `dict` of the form, e.g., 
-        ``{'0x100': 'file1.bin', '0x101': 'file2.bin'}``
-    :param int peripheral_id: The PID of the X6
+    :param stream_chunks: A sequence of pairs ``(stream_id, chunks)``, where
+        ``chunks`` is an iterable of `str` objects. An empty chunk
+        is treated as the end of that stream.
+    :yields: `~x6.vita_convert.VitaPacket` instances with their packet counts
+        already set.
     """
+    streams = [(stream_id, iter(chunks)) for stream_id, chunks in stream_chunks]
+    if not streams:
+        return
     
-    packer = VeloVitaPacker(velo_filename, peripheral_id)
-    
-    files = [
-        (stream_id, open(filename, 'rb'))
-        for stream_id, filename in rawbin_file_dict.items()
-    ]
-    
-    eof = {stream_id: False for stream_id in rawbin_file_dict}
+    eof = {stream_id: False for stream_id, chunks in streams}
     
-    for packet_count, (stream_id, file_obj) in itertools.izip(repeat_iter(range(16)), repeat_iter(files)):
+    for packet_count, (stream_id, chunks) in itertools.izip(repeat_iter(range(16)), repeat_iter(streams)):
         
         if not eof[stream_id]:
-            data = file_obj.read(VITA_PACKET_SIZE)
+            data = next(chunks, None)
             
-            if not data:
+            if data is None or len(data) == 0:
                 eof[stream_id] = True
                 if all(eof.values()):
                     break
@@ -423,8 +449,43 @@ def rawbin_to_velo(velo_filename, rawbin_file_dict, peripheral_id):
                 # Note that contrary to the documentation, we don't use 
                 # separate counters for the separate streams
                 packet.packet_count = packet_count
-                packer.pack(packet)
+                yield packet
+       
+def rawbin_to_velo(velo_filename, rawbin_file_dict, peripheral_id):
+    """
+    Converts raw binary waveforms into vita packets spliced into velo packets 
+    and saves this new binary to disk.
+    
+    :param str velo_filename: File name of the output velo packets binary.
+    :param rawbin_file_dict: A dictionary associating stream IDs to raw binary 
+        file names.
+    :type rawbin_file_dict: A `dict` of the form, e.g., 
+        ``{'0x100': 'file1.bin', '0x101': 'file2.bin'}``
+    :param int peripheral_id: The PID of the X6
+    """
+    
+    def file_chunks(file_obj):
+        while True:
+            data = file_obj.read(VITA_PACKET_SIZE)
+            if not data:
+                break
+            yield data
+    
+    packer = VeloVitaPacker(velo_filename, peripheral_id)
+    
+    files = [
+        (stream_id, open(filename, 'rb'))
+        for stream_id, filename in rawbin_file_dict.items()
+    ]
+    
+    try:
+        for packet in iter_vita_packets(
+            [(stream_id, file_chunks(file_obj)) for stream_id, file_obj in files]
+        ):
+            packer.pack(packet)
                 
-            
-    packer.flush()
+        packer.flush()
+    finally:
+        for stream_id, file_obj in files:
+            file_obj.close()
     
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# waveform_library.py: Storage of many named waveforms in a single
+#     indexed, memory-mapped file.
+##
+
+## FEATURES ##
+
+from __future__ import division
+
+## IMPORTS ##
+
+import os
+import json
+import struct
+import threading
+import numpy as np
+
+## CONSTANTS ##
+
+#: Suffix used to recognize waveform library files in references of the form
+#: ``"shapes.wlib:name"``.
+LIBRARY_SUFFIX = '.wlib'
+
+# A library file starts with MAGIC, followed by the length of the JSON
+# header as a little-endian uint32, followed by the header itself. The
+# waveforms follow, each starting at a multiple of ALIGNMENT bytes.
+MAGIC = 'X6WLIB01'
+PREFIX_FORMAT = '<8sI'
+PREFIX_SIZE = struct.calcsize(PREFIX_FORMAT)
+ALIGNMENT = 64
+
+DATA_TYPE = '<i2'
+
+## CLASSES ##
+
+class WaveformLibrary(object):
+    """
+    A read-only collection of named 16-bit waveforms stored in a single file.
+    The file is memory-mapped when the library is opened, so that looking
+    up a waveform neither reads nor copies its samples.
+
+    Most callers should use `~x6.waveform_library.open_library`, which
+    keeps each library open for as long as its file is unchanged.
+
+    :param str filename: Path to a file written by
+        `~x6.waveform_library.write_waveform_library`.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+
+        with open(filename, 'rb') as f:
+            magic, header_size = struct.unpack(PREFIX_FORMAT, f.read(PREFIX_SIZE))
+            if magic != MAGIC:
+                raise IOError("{} is not a waveform library.".format(filename))
+            header = json.loads(f.read(header_size))
+
+        self._index = {
+            str(name): (entry['offset'], entry['length'])
+            for name, entry in header['waveforms'].iteritems()
+        }
+        self._map = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    def __repr__(self):
+        return "<WaveformLibrary {} ({} waveforms)>".format(self._filename, len(self._index))
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, name):
+        """
+        Returns the named waveform as a read-only view onto the memory map.
+        """
+        try:
+            offset, length = self._index[name]
+        except KeyError:
+            raise KeyError("No waveform named {} in library {}.".format(name, self._filename))
+        return self._map[offset:offset + length * np.dtype(DATA_TYPE).itemsize].view(DATA_TYPE)
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def names(self):
+        return sorted(self._index.keys())
+
+## FUNCTIONS ##
+
+_open_libraries = {}
+_open_libraries_lock = threading.Lock()
+
+def open_library(filename):
+    """
+    Returns a `~x6.waveform_library.WaveformLibrary` for the given file,
+    opening the file only if it has not been opened before, or if it has
+    been modified since it was last opened.
+
+    :param str filename: Path to the library file.
+    """
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (stat.st_mtime, stat.st_size)
+
+    with _open_libraries_lock:
+        cached = _open_libraries.get(filename)
+        if cached is None or cached[0] != key:
+            cached = (key, WaveformLibrary(filename))
+            _open_libraries[filename] = cached
+        return cached[1]
+
+def split_reference(reference):
+    """
+    Splits a waveform reference of the form ``"path/to/shapes.wlib:name"``
+    into the library path and the waveform name. Returns `None` if
+    ``reference`` does not refer to a waveform library.
+    """
+    if ':' not in reference:
+        return None
+    library, name = reference.rsplit(':', 1)
+    if not library.endswith(LIBRARY_SUFFIX) or not name:
+        return None
+    return library, name
+
+def load_reference(reference):
+    """
+    Given a reference of the form ``"shapes.wlib:name"``, returns the named
+    waveform as a view onto the memory-mapped library.
+    """
+    split = split_reference(reference)
+    if split is None:
+        raise ValueError("{} is not a waveform library reference.".format(reference))
+    library, name = split
+    return open_library(library)[name]
+
+def write_waveform_library(filename, waveforms):
+    """
+    Writes a waveform library containing the given waveforms.
+
+    For example, a set of MAT-files can be collected into one library by::
+
+        write_waveform_library('shapes.wlib', {
+            'rand_1': scipy.io.loadmat('rand_data_1.mat')['r'],
+            'rand_1_10': scipy.io.loadmat('rand_data_1_10.mat')['r'],
+        })
+
+    :param str filename: Path of the library file to write.
+    :param waveforms: Mapping from names to arrays. Each array is flattened
+        and converted to 16-bit little-endian integers.
+    :type waveforms: `dict` or a sequence of ``(name, array)`` pairs
+    """
+    if hasattr(waveforms, 'items'):
+        waveforms = sorted(waveforms.items())
+
+    arrays = []
+    for name, array in waveforms:
+        if ':' in name:
+            raise ValueError("Waveform names may not contain ':' ({}).".format(name))
+        arrays.append((str(name), np.ascontiguousarray(np.asarray(array).ravel(), dtype=DATA_TYPE)))
+
+    def align(offset):
+        return -(-offset // ALIGNMENT) * ALIGNMENT
+
+    # The offsets depend on the length of the header, which in turn depends
+    # on the offsets, so we reserve enough space for the header to hold
+    # the largest offsets we could need.
+    entries = {}
+    offset = 0
+    for name, array in arrays:
+        entries[name] = {'offset': offset, 'length': len(array)}
+        offset = align(offset + array.nbytes)
+    max_header = json.dumps({'version': 1, 'dtype': DATA_TYPE, 'waveforms': {
+        name: {'offset': 10**19, 'length': entry['length']} for name, entry in entries.iteritems()
+    }})
+    data_start = align(PREFIX_SIZE + len(max_header))
+    for entry in entries.itervalues():
+        entry['offset'] += data_start
+    header = json.dumps({'version': 1, 'dtype': DATA_TYPE, 'waveforms': entries})
+
+    # Make sure that a library we have open is not kept mapped while we
+    # replace its file.
+    with _open_libraries_lock:
+        _open_libraries.pop(os.path.abspath(filename), None)
+
+    with open(filename, 'wb') as f:
+        f.write(struct.pack(PREFIX_FORMAT, MAGIC, len(header)))
+        f.write(header)
+        for name, array in arrays:
+            f.seek(entries[name]['offset'])
+            f.write(array.data)
@@ -0,0 +1,596 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# xpp_parser.py: Tokenizer and recursive-descent parser for the xpulprog
+#     language, producing the same statement structures as the PyParsing
+#     grammar in pulprog.py.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import re
+
+from x6.xpp_types import (
+    UNIT_VALUES, OPERATORS, Time, Identifier, Expression, Channel, IQChannel,
+    PhaseList, WaveformLiteral, IQWaveformLiteral
+)
+
+## CONSTANTS ###################################################################
+
+KEYWORDS = frozenset([
+    'define', 'delay', 'phase', 'include', 'channel', 'iqchannel', 'waveform',
+    'iqwaveform', 'print', 'analog', 'digital', 'ipp', 'repeat', 'option'
+])
+
+BOOLEAN_TRUES = frozenset(['True', 'true', 'on', 'high'])
+BOOLEAN_FALSES = frozenset(['False', 'false', 'off', 'low'])
+
+# Each alternative is tried in turn at the current position; whitespace and
+# comments are matched so that they can be skipped.
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>[ \t\r]+)
+  | (?P<comment>;[^\n]*)
+  | (?P<newline>\n)
+  | (?P<number>\d+(?:\.\d+)?)(?P<unit>ps|ns|us|ms|s)?(?![A-Za-z0-9_.])
+  | (?P<string>"(?:[^"\\\n]|\\.)*")
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>[()\[\]{},:=/*+-])
+''', re.VERBOSE)
+
+## EXCEPTIONS ##################################################################
+
+class XPPSyntaxError(ValueError):
+    """
+    Raised when an xpulprog source cannot be parsed. Like the exceptions
+    raised by PyParsing, instances record the line number ``lineno``, column
+    ``col`` and text ``line`` of the offending line.
+    """
+    def __init__(self, msg, source, loc):
+        self.msg = msg
+        self.loc = loc
+        self.lineno = source.count('\n', 0, loc) + 1
+        line_start = source.rfind('\n', 0, loc) + 1
+        line_end = source.find('\n', loc)
+        self.col = loc - line_start + 1
+        self.line = source[line_start:line_end if line_end >= 0 else len(source)]
+        ValueError.__init__(self, str(self))
+
+    def __str__(self):
+        return "{} (at char {}), (line:{}, col:{})".format(
+            self.msg, self.loc, self.lineno, self.col
+        )
+
+## CLASSES #####################################################################
+
+class Node(object):
+    """
+    A parsed statement or part of a statement. Nodes expose the same
+    interface as the PyParsing results that `~x6.pulprog.compile_program`
+    consumes: a name returned by ``getName()``, named fields available as
+    attributes, and positional items available by iterating or indexing.
+    """
+    def __init__(self, node_name, items=(), lineno=None, **fields):
+        self._name = node_name
+        self._items = list(items)
+        self.lineno = lineno
+        self.__dict__.update(fields)
+
+    def getName(self):
+        return self._name
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, idx):
+        return self._items[idx]
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        fields = ", ".join(
+            "{}={!r}".format(key, val) for key, val in sorted(self.__dict__.items())
+            if not key.startswith('_') and key != 'lineno'
+        )
+        return "<{} {}{}>".format(self._name, fields, " " + repr(self._items) if self._items else "")
+
+class _Parser(object):
+    def __init__(self, source):
+        self._source = source
+        self._tokens = self._tokenize(source)
+        self._idx = 0
+
+    ## TOKENIZER ##
+
+    def _tokenize(self, source):
+        tokens = []
+        pos = 0
+        lineno = 1
+        end = len(source)
+        match = _TOKEN_RE.match
+        while pos < end:
+            m = match(source, pos)
+            if m is None:
+                raise XPPSyntaxError("Unexpected character {!r}".format(source[pos]), source, pos)
+            kind = m.lastgroup
+            if kind == 'unit':
+                # The unit group closes after the number group, so lastgroup
+                # names it whenever a time suffix is present.
+                kind = 'time'
+            if kind == 'number':
+                kind = 'float' if '.' in m.group('number') else 'int'
+            if kind not in ('ws', 'comment'):
+                tokens.append((kind, m, pos, lineno))
+            if kind == 'newline':
+                lineno += 1
+            pos = m.end()
+        tokens.append(('eof', None, end, lineno))
+        return tokens
+
+    ## TOKEN HELPERS ##
+
+    def _peek(self):
+        return self._tokens[self._idx]
+
+    def _next(self):
+        tok = self._tokens[self._idx]
+        self._idx += 1
+        return tok
+
+    def _error(self, msg, tok=None):
+        if tok is None:
+            tok = self._peek()
+        return XPPSyntaxError(msg, self._source, tok[2])
+
+    def _is_op(self, op, tok=None):
+        tok = tok if tok is not None else self._peek()
+        return tok[0] == 'op' and tok[1].group() == op
+
+    def _is_name(self, name, tok=None):
+        tok = tok if tok is not None else self._peek()
+        return tok[0] == 'name' and tok[1].group() == name
+
+    def _expect_op(self, op):
+        if not self._is_op(op):
+            raise self._error("Expected \"{}\"".format(op))
+        self._next()
+
+    def _expect_int(self):
+        tok = self._next()
+        if tok[0] != 'int':
+            raise self._error("Expected integer", tok)
+        return int(tok[1].group())
+
+    def _expect_string(self):
+        tok = self._next()
+        if tok[0] != 'string':
+            raise self._error("Expected string", tok)
+        return tok[1].group()[1:-1]
+
+    def _expect_identifier(self):
+        tok = self._next()
+        if tok[0] != 'name' or tok[1].group() in KEYWORDS or self._is_boolean(tok):
+            raise self._error("Expected identifier", tok)
+        return Identifier(tok[1].group())
+
+    def _is_boolean(self, tok):
+        return tok[0] == 'name' and (tok[1].group() in BOOLEAN_TRUES or tok[1].group() in BOOLEAN_FALSES)
+
+    ## STATEMENTS ##
+
+    def parse_program(self):
+        stmts = self._statement_list(in_block=False)
+        tok = self._peek()
+        if tok[0] != 'eof':
+            raise self._error("Expected end of text")
+        return stmts
+
+    def _statement_list(self, in_block):
+        stmts = []
+        while True:
+            tok = self._peek()
+            if tok[0] == 'newline':
+                self._next()
+                continue
+            if tok[0] == 'eof' or (in_block and self._is_op('}', tok)):
+                return stmts
+
+            stmts.append(self._statement())
+
+            # Every statement must end the line, except that the last
+            # statement in a block may be followed directly by its "}".
+            tok = self._peek()
+            if tok[0] == 'newline':
+                self._next()
+            elif not (tok[0] == 'eof' or (in_block and self._is_op('}', tok))):
+                raise self._error("Expected end of line")
+
+    def _statement(self):
+        tok = self._peek()
+        lineno = tok[3]
+
+        if tok[0] == 'op' and tok[1].group() == '(':
+            return self._pulse_statement(lineno)
+        if tok[0] != 'name':
+            raise self._error("Expected statement")
+
+        word = tok[1].group()
+        if word == 'include':
+            self._next()
+            return Node('incl_statement', lineno=lineno, incl_file=self._expect_string())
+        elif word == 'define':
+            self._next()
+            ident = self._expect_identifier()
+            self._expect_op('=')
+            return Node('define_statement', lineno=lineno, ident=ident, value=self._expression())
+        elif word == 'delay':
+            self._next()
+            return Node('delay_statement', [self._period()], lineno=lineno)
+        elif word == 'print':
+            self._next()
+            if self._peek()[0] == 'string':
+                value = self._expect_string()
+            else:
+                value = self._value()
+            return Node('print_statement', lineno=lineno, value=value)
+        elif word == 'ipp':
+            self._next()
+            return Node('ipp_statement', lineno=lineno)
+        elif word == 'option':
+            self._next()
+            name = self._expect_identifier()
+            self._expect_op('=')
+            return Node('option_statement', lineno=lineno, name=name, value=self._expression())
+        elif word == 'repeat':
+            self._next()
+            how_many = self._expect_int()
+            self._expect_op('{')
+            block_contents = self._statement_list(in_block=True)
+            self._expect_op('}')
+            return Node('repeat_statement', lineno=lineno, how_many=how_many, block_contents=block_contents)
+        else:
+            raise self._error("Expected statement")
+
+    def _pulse_statement(self, lineno):
+        sentences = [self._pulse_sentence()]
+        while self._is_op(','):
+            self._next()
+            sentences.append(self._pulse_sentence())
+        return Node('pulse_statement', sentences, lineno=lineno)
+
+    def _pulse_sentence(self):
+        self._expect_op('(')
+        pulse_expr = [self._pulse_expr()]
+        while self._is_op(','):
+            self._next()
+            pulse_expr.append(self._pulse_expr())
+        self._expect_op(')')
+        self._expect_op(':')
+
+        if self._is_op('('):
+            self._next()
+            channel_spec = [self._channel()]
+            while self._is_op(','):
+                self._next()
+                channel_spec.append(self._channel())
+            self._expect_op(')')
+        else:
+            channel_spec = [self._channel()]
+
+        return Node('pulse_sentence', pulse_expr=pulse_expr, channel_spec=channel_spec)
+
+    def _pulse_expr(self):
+        if self._is_name('delay'):
+            self._next()
+            return Node('delay_expr', period=self._period())
+        elif self._is_name('phase'):
+            self._next()
+            if self._is_op('['):
+                phase_value = self._phase_literal()
+            else:
+                phase_value = self._expect_identifier()
+            return Node('phase_expr', phase_value=phase_value)
+        else:
+            period = self._period()
+            self._expect_op(':')
+            tok = self._peek()
+            if self._is_boolean(tok):
+                self._next()
+                waveform = tok[1].group() in BOOLEAN_TRUES
+            elif self._is_name('waveform') or self._is_name('iqwaveform'):
+                waveform = self._fn_literal()
+            else:
+                waveform = self._expect_identifier()
+            return Node('shaped_pulse', period=period, waveform=waveform)
+
+    ## VALUES ##
+
+    def _period(self):
+        tok = self._peek()
+        period = self._expression()
+        if not isinstance(period, (Time, Identifier, Expression)):
+            raise self._error("Expected time", tok)
+        return period
+
+    def _channel(self):
+        if self._is_name('channel') or self._is_name('iqchannel'):
+            return self._fn_literal()
+        return self._expect_identifier()
+
+    def _value(self):
+        tok = self._peek()
+        kind = tok[0]
+        if kind == 'int':
+            self._next()
+            return int(tok[1].group())
+        elif kind == 'float':
+            self._next()
+            return float(tok[1].group())
+        elif kind == 'time':
+            self._next()
+            number = tok[1].group('number')
+            number = float(number) if '.' in number else int(number)
+            return Time(number * UNIT_VALUES[tok[1].group('unit')])
+        elif kind == 'op' and tok[1].group() == '[':
+            return self._phase_literal()
+        elif kind == 'name':
+            word = tok[1].group()
+            if word in ('channel', 'iqchannel', 'waveform', 'iqwaveform'):
+                return self._fn_literal()
+            elif word in BOOLEAN_TRUES:
+                self._next()
+                return True
+            elif word in BOOLEAN_FALSES:
+                self._next()
+                return False
+            return self._expect_identifier()
+        raise self._error("Expected value")
+
+    ## EXPRESSIONS ##
+    # Sums of products of values, with parentheses and unary minus. An
+    # operation whose operands are all constants is folded as it is parsed,
+    # so that only operations on identifiers are left for the compiler.
+
+    def _expression(self):
+        value = self._term()
+        while self._is_op('+') or self._is_op('-'):
+            tok = self._next()
+            value = self._fold(tok, tok[1].group(), value, self._term())
+        return value
+
+    def _term(self):
+        value = self._factor()
+        while self._is_op('*') or self._is_op('/'):
+            tok = self._next()
+            value = self._fold(tok, tok[1].group(), value, self._factor())
+        return value
+
+    def _factor(self):
+        tok = self._peek()
+        if self._is_op('-', tok):
+            self._next()
+            return self._fold(tok, 'neg', self._factor())
+        elif self._is_op('(', tok):
+            self._next()
+            value = self._expression()
+            self._expect_op(')')
+            return value
+        return self._value()
+
+    def _fold(self, tok, op, *operands):
+        for operand in operands:
+            if not _is_arithmetic(operand):
+                raise self._error("Expected number, time or identifier as operand of \"{}\"".format(tok[1].group()), tok)
+        if any(isinstance(operand, (Identifier, Expression)) for operand in operands):
+            return Expression(op, operands)
+        try:
+            return OPERATORS[op](*operands)
+        except TypeError:
+            raise self._error("Cannot apply \"{}\" to {}".format(
+                tok[1].group(), " and ".join(_kind(operand) for operand in operands)
+            ), tok)
+        except ZeroDivisionError:
+            raise self._error("Division by zero", tok)
+
+    def _phase_literal(self):
+        self._expect_op('[')
+        phases = [self._expect_int()]
+        while self._is_op(','):
+            self._next()
+            phases.append(self._expect_int())
+        self._expect_op(']')
+        self._expect_op('/')
+        return PhaseList(phases, self._expect_int())
+
+    def _fn_literal(self):
+        word = self._next()[1].group()
+        self._expect_op('(')
+        if word == 'channel':
+            pin_name = self._expect_string()
+            self._expect_op(',')
+            tok = self._next()
+            if not (self._is_name('analog', tok) or self._is_name('digital', tok)):
+                raise self._error("Expected analog or digital", tok)
+            value = Channel(pin_name, tok[1].group())
+        elif word == 'iqchannel':
+            ch_i = self._channel()
+            self._expect_op(',')
+            value = IQChannel(ch_i, self._channel())
+        elif word == 'waveform':
+            value = WaveformLiteral(self._expect_string())
+        else:
+            waveform_i = self._expect_string()
+            self._expect_op(',')
+            value = IQWaveformLiteral(waveform_i, self._expect_string())
+        self._expect_op(')')
+        return value
+
+## FUNCTIONS ###################################################################
+
+def _is_arithmetic(value):
+    return isinstance(value, (Time, Identifier, Expression, int, long, float)) and not isinstance(value, bool)
+
+def _kind(value):
+    return 'a time' if isinstance(value, Time) else 'a number'
+
+def parse(source):
+    """
+    Parses an **xpulprog** source, returning a list of statement nodes.
+    Blank statements and comments are dropped.
+
+    :param str source: Source code of the pulse program.
+    :raises XPPSyntaxError: if the source is not a valid program.
+    """
+    return _Parser(source).parse_program()
+
+def _normalize(value):
+    # Reduces a value or statement from either parser to nested tuples,
+    # so that results from the two parsers can be compared with ==.
+    if isinstance(value, Identifier):
+        return ('identifier', value.name)
+    elif isinstance(value, Expression):
+        return ('expression', value.op) + tuple(_normalize(operand) for operand in value.operands)
+    elif isinstance(value, Time):
+        return ('time', value._time)
+    elif isinstance(value, PhaseList):
+        return ('phase', list(value._phases), value._n_parts)
+    elif isinstance(value, IQChannel):
+        return ('iqchannel', _normalize(value._ch_i), _normalize(value._ch_q))
+    elif isinstance(value, Channel):
+        return ('channel', value._pin_name, value.analog)
+    elif isinstance(value, IQWaveformLiteral):
+        return ('iqwaveform', value._waveform_i, value._waveform_q)
+    elif isinstance(value, WaveformLiteral):
+        return ('waveform', value._waveform)
+    elif type(value).__name__ == 'IQWaveform':
+        return ('iqwaveform', value.waveform_i._from, value.waveform_q._from)
+    elif type(value).__name__ == 'Waveform':
+        return ('waveform', value._from)
+    elif isinstance(value, (bool, int, long, float, str)):
+        return value
+    elif not hasattr(value, 'getName'):
+        return tuple(_normalize(item) for item in value)
+
+    name = value.getName()
+    if name == 'incl_statement':
+        return (name, value.incl_file)
+    elif name == 'define_statement':
+        return (name, _normalize(value.ident), _normalize(value.value))
+    elif name == 'delay_statement':
+        return (name, _normalize(value[0]))
+    elif name == 'pulse_statement':
+        return (name, tuple(
+            (tuple(_normalize(part) for part in sentence.pulse_expr),
+             tuple(_normalize(ch) for ch in sentence.channel_spec))
+            for sentence in value
+        ))
+    elif name == 'delay_expr':
+        return (name, _normalize(value.period))
+    elif name == 'shaped_pulse':
+        return (name, _normalize(value.period), _normalize(value.waveform))
+    elif name == 'phase_expr':
+        return (name, _normalize(value.phase_value))
+    elif name == 'print_statement':
+        return (name, _normalize(value.value))
+    elif name == 'ipp_statement':
+        return (name,)
+    elif name == 'option_statement':
+        return (name, _normalize(value.name), _normalize(value.value))
+    elif name == 'repeat_statement':
+        return (name, value.how_many, _normalize_statements(value.block_contents))
+    else:
+        raise ValueError("Unknown statement type {}.".format(name))
+
+def _normalize_statements(stmts):
+    return tuple(
+        _normalize(stmt) for stmt in stmts
+        if stmt.getName() not in (None, 'blank_statement')
+    )
+
+def _identifier_names(value):
+    # Names of the identifiers anywhere within a normalized value.
+    if isinstance(value, tuple):
+        if len(value) == 2 and value[0] == 'identifier':
+            return set([value[1]])
+        return set().union(*[_identifier_names(item) for item in value]) if value else set()
+    return set()
+
+def _expressions(value):
+    # Yields the outermost expressions within a normalized value.
+    if isinstance(value, tuple) and value:
+        if value[0] == 'expression':
+            yield value
+        else:
+            for item in value:
+                for expression in _expressions(item):
+                    yield expression
+
+def _defines(stmts):
+    # Yields (name, value) for each define statement, including those within
+    # repeat blocks.
+    for stmt in stmts:
+        if stmt[0] == 'define_statement':
+            yield stmt[1][1], stmt[2]
+        elif stmt[0] == 'repeat_statement':
+            for define in _defines(stmt[2]):
+                yield define
+
+def expression_identifiers(stmts):
+    """
+    Returns the names of the identifiers whose values are used in arithmetic
+    expressions by the given statements, either directly or through other
+    identifiers defined from them.
+
+    :param list stmts: Statements, as returned by either parser.
+    :rtype: `set`
+    """
+    stmts = _normalize_statements(stmts)
+    names = set()
+    for expression in _expressions(stmts):
+        names |= _identifier_names(expression)
+
+    # An identifier defined from another carries that one's value along.
+    sources = {}
+    for name, value in _defines(stmts):
+        sources.setdefault(name, set()).update(_identifier_names(value))
+    pending = list(names)
+    while pending:
+        for source in sources.get(pending.pop(), ()):
+            if source not in names:
+                names.add(source)
+                pending.append(source)
+    return names
+
+def check_conformance(source):
+    """
+    Parses ``source`` with both this parser and the PyParsing grammar
+    `x6.pulprog.pulse_program`, and raises `AssertionError` describing
+    the first statement on which the two disagree.
+
+    Note that the PyParsing grammar loads waveform files while parsing, so
+    this must be run from the directory that the program's waveform paths
+    are relative to.
+
+    This parser deliberately differs from the PyParsing grammar in a few
+    cases that the latter gets wrong: decimals with leading zeros after the
+    point (``2.05``) are read correctly, identifiers may start with a
+    boolean word (``offset``), and whitespace is allowed around ``:`` and
+    ``,`` everywhere. Arithmetic expressions, such as ``2*tau + 15ns``, are
+    only understood by this parser.
+    """
+    from x6.pulprog import pulse_program
+
+    expected = _normalize_statements(pulse_program.parseString(source))
+    actual = _normalize_statements(parse(source))
+
+    if len(expected) != len(actual):
+        raise AssertionError("Parsers found {} and {} statements.".format(len(expected), len(actual)))
+    for idx, (exp_stmt, act_stmt) in enumerate(zip(expected, actual)):
+        if exp_stmt != act_stmt:
+            raise AssertionError("Statement {} differs:\n\tPyParsing: {}\n\tHand-written: {}".format(
+                idx, exp_stmt, act_stmt
+            ))
@@ -0,0 +1,534 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+##
+# xpp_types.py: Values manipulated by xpulprog programs, shared by the
+#     parsers and the compiler in pulprog.py.
+##
+# Authors: Christopher Granade (cgranade@cgranade.com) and Ian Hincks.
+##
+
+## FEATURES ####################################################################
+
+from __future__ import division
+
+## IMPORTS #####################################################################
+
+import os
+import operator
+
+import numpy as np
+
+from x6 import TX_CHANNELS, CHANNEL_PRI_CODES
+from x6.process_waveform import Waveform, IQWaveform
+
+## UNITS #######################################################################
+# We define units such as seconds abstractly so that we can easily change
+# scales.
+
+UNIT_VALUES = {
+    's':  1e6,
+    'ms': 1e3,
+    'us': 1e0,
+    'ns': 1e-3,
+    'ps': 1e-6
+}
+
+## OPERATORS ###################################################################
+# Arithmetic operators that may appear in expressions; see Expression below.
+
+OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    'neg': operator.neg
+}
+
+## FUNCTIONS ###################################################################
+
+def resolve_sym(sym, namespace, source_dir=None):
+    if isinstance(sym, Identifier):
+        if sym in namespace:
+            return namespace[sym]
+        else:
+            raise KeyError("Variable {} has not been defined.".format(sym.name))
+    elif isinstance(sym, Expression):
+        return sym.evaluate(lambda operand: resolve_sym(operand, namespace, source_dir))
+    elif isinstance(sym, WaveformLiteral):
+        return sym.load(source_dir)
+    else:
+        return sym    
+
+def source_path(filename, source_dir=None):
+    """
+    Returns the path to a file named in a program, relative names being
+    taken relative to ``source_dir`` rather than to the working directory.
+    """
+    if source_dir is None or os.path.isabs(filename):
+        return filename
+    return os.path.join(source_dir, filename)
+        
+
+def split_board(pin_name):
+    """
+    Splits a pin name of the form ``"board1.DA0"`` into the name of the
+    board and the name of the pin on that board. The board is `None` if
+    the pin name does not name one.
+    """
+    if '.' in pin_name:
+        board, pin_name = pin_name.split('.', 1)
+        return board, pin_name
+    return None, pin_name
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+def _operand_str(operand):
+    if isinstance(operand, Identifier):
+        return operand.name
+    elif isinstance(operand, Expression):
+        return "({})".format(operand)
+    return str(operand)
+
+## CLASSES #####################################################################
+
+class Time(object):
+    def __init__(self, time):
+        self._time = time
+        
+    def __str__(self):
+        return "{} s".format(str(self._time/ UNIT_VALUES['s']))
+        
+    def __repr__(self):
+        return "<Time {} s>".format(self.time)
+        
+    @property
+    def time(self):
+        return self._time / UNIT_VALUES['s']
+
+    ## ARITHMETIC ##
+    # Times may be added to and subtracted from each other, and scaled by
+    # numbers. The ratio of two times is a number. Mixing times and numbers
+    # in any other way raises TypeError, as there is no implied unit.
+
+    def __neg__(self):
+        return Time(-self._time)
+
+    def __add__(self, other):
+        if isinstance(other, Time):
+            return Time(self._time + other._time)
+        return NotImplemented
+
+    def __sub__(self, other):
+        if isinstance(other, Time):
+            return Time(self._time - other._time)
+        return NotImplemented
+
+    def __mul__(self, other):
+        if _is_number(other):
+            return Time(self._time * other)
+        return NotImplemented
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Time):
+            return self._time / other._time
+        elif _is_number(other):
+            return Time(self._time / other)
+        return NotImplemented
+    __div__ = __truediv__
+        
+class Identifier(object):
+    """
+    Represents an identifier used as the name of a variable.
+    """
+    
+    def __init__(self, name):
+        self._name = name
+        
+    def __repr__(self):
+        return "<Identifier {}>".format(self.name)
+        
+    @property
+    def name(self):
+        return self._name
+        
+    def __hash__(self):
+        return hash(self.name)
+        
+    def __eq__(self, other):
+        if isinstance(other, Identifier):
+            return self.name == other.name
+        else:
+            return False
+
+class Expression(object):
+    """
+    Represents an arithmetic expression that could not be folded into a
+    constant by the parser, as it refers to identifiers whose values are
+    only known during compilation.
+
+    :param str op: One of ``"+"``, ``"-"``, ``"*"``, ``"/"`` or, for unary
+        minus, ``"neg"``.
+    :param list operands: Constants, `Identifier` instances or nested
+        `Expression` instances.
+    """
+
+    def __init__(self, op, operands):
+        self._op = op
+        self._operands = list(operands)
+
+    def __repr__(self):
+        return "<Expression {}>".format(self)
+
+    def __str__(self):
+        if self._op == 'neg':
+            return "-{}".format(_operand_str(self._operands[0]))
+        return " {} ".format(self._op).join(_operand_str(operand) for operand in self._operands)
+
+    @property
+    def op(self):
+        return self._op
+
+    @property
+    def operands(self):
+        return self._operands
+
+    @property
+    def function(self):
+        return OPERATORS[self._op]
+
+    def evaluate(self, resolve):
+        """
+        Evaluates this expression, calling ``resolve`` on each operand that
+        is not itself an expression to find its value.
+        """
+        return self.function(*[
+            operand.evaluate(resolve) if isinstance(operand, Expression) else resolve(operand)
+            for operand in self._operands
+        ])
+
+class Resolvable(object):
+    """
+    Base class for object types that need identifiers resolved for them.
+    """
+    def _resolve_(self, namespace):
+        return NotImplemented
+        
+class Channel(object):
+    """
+    Represents either an analog or digital channel associated with a given
+    pinout name.
+    
+    The pin name may be prefixed by the name of a board, as in
+    ``"board1.DA0"``, for programs that drive several X6 boards; see
+    `~x6.pulprog.compile_to_boards`.
+    """
+    _board = None
+
+    def __init__(self, pin_name, analog):
+        self._board, self._pin_name = split_board(pin_name)
+        if isinstance(analog, str):
+            self._analog = analog == "analog"
+        else:
+            self._analog = bool(analog)
+            
+    @property
+    def analog(self):
+        return self._analog
+        
+    @property
+    def board(self):
+        """
+        Name of the board that this channel is on, or `None` if the channel
+        did not name a board.
+        """
+        return self._board
+        
+    @property
+    def pri_code(self):
+        """
+        Returns the bitmask used as a PRI destination code when sending output
+        to or recieving input from this channel.
+        
+        :type: `int`
+        """
+        return CHANNEL_PRI_CODES[self._pin_name]
+        
+    @property
+    def is_rx(self):
+        """
+        `True` if and only if the pin for this channel is controlled by the
+        RX PRI settings on the X6 board.
+        
+        .. note::
+            This does not necessarily mean that the pin is used to recieve data,
+            but only that the pin is configured via the reciever settings.
+        """
+        return not self.is_tx
+        
+    @property
+    def is_tx(self):
+        """
+        `True` if and only if the pin for this channel is controlled by the
+        TX PRI settings on the X6 board.
+        
+        .. note::
+            This does not necessarily mean that the pin is used to transmit data,
+            but only that the pin is configured via the transmitter settings.
+        """
+        return self._pin_name in TX_CHANNELS
+            
+    def __str__(self):
+        pin_name = self._pin_name if self._board is None else "{}.{}".format(self._board, self._pin_name)
+        return "{} [{}]".format(pin_name, "analog" if self.analog else "digital")
+        
+    def __repr__(self):
+        return "<Channel {}>".format(str(self))
+
+class IQChannel(Channel, Resolvable):
+    """
+    Subclass of `Channel` representing the pairing of two channels into
+    a single logical channel with in-phase and quadrature parts.
+    """
+    def __init__(self, ch_i, ch_q):
+        self._ch_i = ch_i
+        self._ch_q = ch_q
+
+    def _resolve_(self, namespace):
+        if isinstance(self._ch_i, Identifier):
+            self._ch_i = namespace[self._ch_i]
+        if isinstance(self._ch_q, Identifier):
+            self._ch_q = namespace[self._ch_q]
+        if self._ch_i.board != self._ch_q.board:
+            raise ValueError('Both channels in an IQChannel must be on the same board.')
+        if self._ch_i._pin_name == self._ch_q._pin_name:
+            raise ValueError('Different TX channels must be used in an IQChannel.')
+        if not self._ch_i.analog or not self._ch_q.analog:
+            raise ValueError('Both channels in an IQChannel must be analog channels.')
+
+    @property
+    def resolved(self):
+        return not (isinstance(self._ch_i, Identifier) or isinstance(self._ch_q, Identifier))
+
+    @property
+    def analog(self): return True
+
+    @property
+    def board(self):
+        return self._ch_i.board if self.resolved else None
+
+    @property
+    def is_tx(self): return True
+
+    @property
+    def pri_code(self):
+        if self.resolved:
+            return self._ch_i.pri_code | self._ch_q.pri_code
+        else:
+            return None
+
+    def __repr__(self):
+        if self.resolved:
+            return "<IQChannel I = {}, Q = {}>".format(
+                self._ch_i._pin_name, self._ch_q._pin_name
+            )
+        else:
+            return "<IQChannel I = {}, Q = {} [unresolved]>".format(
+                self._ch_i, self._ch_q
+            )
+
+    def __str__(self):
+        return "(I={}, Q={}) [iq]".format(
+            self._ch_i, self._ch_q
+        )
+       
+class PhaseList(object):
+    """
+    A list of phases, each a multiple of ``1 / n_parts`` of a cycle, that
+    ``ipp`` statements step through.
+    
+    Once a phase list is registered with a `PhaseRegistry`, its position is
+    kept by the registry rather than by the phase list itself.
+    """
+    _registry = None
+    _pos = None
+
+    def __init__(self, phases, n_parts):
+        self._phases = phases
+        self._n_parts = n_parts
+        self._idx = 0
+        
+    def __str__(self):
+        return str(self._phases) + " / " + str(self._n_parts)
+        
+    def __repr__(self):
+        return "<PhaseList {}>".format(str(self))
+        
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_idx'] = self.index
+        state.pop('_registry', None)
+        state.pop('_pos', None)
+        return state
+        
+    @property
+    def index(self):
+        if self._registry is not None:
+            return int(self._registry.indices[self._pos])
+        return self._idx
+        
+    @property
+    def cur(self):
+        return (self._phases[self.index], self._n_parts)
+        
+    def ipp(self):
+        if self._registry is not None:
+            self._registry.advance(self._pos)
+        else:
+            self._idx = (self._idx + 1) % len(self._phases)
+
+class PhaseRegistry(object):
+    """
+    Phase-cycle state of the phase lists bound to the variables of a
+    program, kept as a vector holding the position of each phase list.
+    
+    An ``ipp`` statement advances every phase list bound to a variable, once
+    for each variable bound to it. The registry tracks how many variables
+    are bound to each phase list as they are defined, so that ``ipp`` is a
+    single vector operation rather than a scan of the namespace. The state
+    can be saved with `~x6.xpp_types.PhaseRegistry.snapshot`, and the
+    positions after any number of ``ipp`` statements computed at once with
+    `~x6.xpp_types.PhaseRegistry.schedule`.
+    """
+
+    def __init__(self):
+        self._lists = []
+        self._by_id = {}
+        self._names = {}
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.bindings = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._lists)
+
+    def register(self, phase_list):
+        """
+        Returns the position of a phase list in the state vector, adding
+        it at its current position in the cycle if it is new.
+        """
+        pos = self._by_id.get(id(phase_list))
+        if pos is None:
+            pos = self._by_id[id(phase_list)] = len(self._lists)
+            index = phase_list.index
+            self._lists.append(phase_list)
+            self.indices = np.append(self.indices, index)
+            self.lengths = np.append(self.lengths, len(phase_list._phases))
+            self.bindings = np.append(self.bindings, 0)
+            phase_list._registry, phase_list._pos = self, pos
+        return pos
+
+    def bind(self, name, value):
+        """
+        Records that the variable ``name`` now holds ``value``.
+        """
+        old = self._names.pop(name, None)
+        if old is not None:
+            self.bindings[old] -= 1
+        if isinstance(value, PhaseList):
+            pos = self.register(value)
+            self.bindings[pos] += 1
+            self._names[name] = pos
+
+    def bind_all(self, namespace):
+        """
+        Records every variable in a namespace.
+        """
+        for ident, value in namespace.iteritems():
+            self.bind(ident.name if isinstance(ident, Identifier) else ident, value)
+
+    ## PHASE CYCLING ##
+
+    def ipp(self):
+        """
+        Advances every phase list bound to a variable, as an ``ipp``
+        statement does.
+        """
+        if len(self._names):
+            np.add(self.indices, self.bindings, out=self.indices)
+            np.remainder(self.indices, self.lengths, out=self.indices)
+
+    def advance(self, pos):
+        self.indices[pos] = (self.indices[pos] + 1) % self.lengths[pos]
+
+    def snapshot(self):
+        """
+        Returns a copy of the current state vector.
+        """
+        return self.indices.copy()
+
+    def restore(self, snapshot):
+        """
+        Returns to a state returned by `~x6.xpp_types.PhaseRegistry.snapshot`.
+        Phase lists registered since are left as they are.
+        """
+        self.indices[:len(snapshot)] = snapshot
+
+    def schedule(self, n_steps):
+        """
+        Returns an array whose row ``k`` is the state vector after ``k``
+        more ``ipp`` statements, for ``k`` from 0 to ``n_steps - 1``,
+        without changing the current state.
+        """
+        steps = np.arange(n_steps, dtype=np.int64)[:, np.newaxis]
+        return (self.indices + steps * self.bindings) % self.lengths
+
+class WaveformLiteral(object):
+    """
+    A ``waveform("...")`` literal as parsed from a program. The waveform is
+    only loaded the first time that the literal is evaluated, and the loaded
+    waveform is not kept when the literal is pickled, so that parsed programs
+    stay small and can be cached.
+
+    Relative file names are taken relative to the directory of the program
+    containing the literal, as passed to
+    `~x6.xpp_types.WaveformLiteral.load`.
+    """
+    def __init__(self, waveform):
+        self._waveform = waveform
+        self._loaded = None
+
+    def __repr__(self):
+        return "<WaveformLiteral {}>".format(self._waveform)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_loaded'] = None
+        return state
+
+    def _load_(self, source_dir):
+        return Waveform(source_path(self._waveform, source_dir))
+
+    def load(self, source_dir=None):
+        if self._loaded is None:
+            self._loaded = self._load_(source_dir)
+        return self._loaded
+
+class IQWaveformLiteral(WaveformLiteral):
+    """
+    An ``iqwaveform("...", "...")`` literal as parsed from a program.
+    """
+    def __init__(self, waveform_i, waveform_q):
+        self._waveform_i = waveform_i
+        self._waveform_q = waveform_q
+        self._loaded = None
+
+    def __repr__(self):
+        return "<IQWaveformLiteral I = {}, Q = {}>".format(self._waveform_i, self._waveform_q)
+
+    def _load_(self, source_dir):
+        return IQWaveform(
+            source_path(self._waveform_i, source_dir),
+            source_path(self._waveform_q, source_dir)
+        )